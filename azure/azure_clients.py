@@ -0,0 +1,101 @@
+"""
+Shared, cached Azure credentials and clients for the scripts in this folder.
+
+Clients are created once per process and argument set (functools.lru_cache),
+so a long-lived worker calling the script functions many times reuses the
+same AAD token (azure-identity keeps it in memory until shortly before it
+expires) and the same HTTP connection pools (each client holds one session).
+
+Service Principal variables are read from the environment (or a ".env" file
+via python-dotenv) when a credential is first requested:
+- TENANT_ID
+- CLIENT_ID
+- CLIENT_SECRET
+
+Each SDK is imported by the factories that use it, so a script only needs
+the packages of the clients it creates (e.g. azure-storage-blob alone for a
+connection-string blob client).  All of them:
+
+azure-identity>=1.12.0
+azure-kusto-data>=4.0.0
+azure-kusto-ingest>=4.0.0
+azure-storage-blob>=12.14.1
+python-dotenv>=0.12.0
+"""
+import os
+from functools import lru_cache
+
+# Clients created by the cached factories, closed by close_all()
+_open_clients = []
+
+
+@lru_cache(maxsize=None)
+def get_credential(tenant_id=None, client_id=None, client_secret=None):
+    """Service Principal credential, arguments default to the environment variables"""
+    from azure.identity import ClientSecretCredential
+    from dotenv import load_dotenv
+    load_dotenv()
+    return ClientSecretCredential(tenant_id or os.getenv("TENANT_ID", ""),
+                                  client_id or os.getenv("CLIENT_ID", ""),
+                                  client_secret or os.getenv("CLIENT_SECRET", ""))
+
+
+def kusto_connection_string(cluster_url, credential=None):
+    """Connection string authenticating with the shared token credential"""
+    from azure.kusto.data import KustoConnectionStringBuilder
+    return KustoConnectionStringBuilder.with_azure_token_credential(cluster_url,
+                                                                    credential or get_credential())
+
+
+def kusto_urls(adx_cluster, az_region):
+    """(ingest url, query url) of an ADX cluster"""
+    return (f'https://ingest-{adx_cluster}.{az_region}.kusto.windows.net',
+            f'https://{adx_cluster}.{az_region}.kusto.windows.net')
+
+
+@lru_cache(maxsize=None)
+def get_kusto_client(cluster_url):
+    """Query client for a cluster url"""
+    from azure.kusto.data import KustoClient
+    client = KustoClient(kusto_connection_string(cluster_url))
+    _open_clients.append(client)
+    return client
+
+
+@lru_cache(maxsize=None)
+def get_ingest_client(ingest_cluster_url):
+    """Queued ingest client for an ingest-... cluster url"""
+    from azure.kusto.ingest import QueuedIngestClient
+    client = QueuedIngestClient(kusto_connection_string(ingest_cluster_url))
+    _open_clients.append(client)
+    return client
+
+
+@lru_cache(maxsize=None)
+def get_blob_service_client(connection_string=None, account_url=None):
+    """Blob service client from a connection string (default STORAGE_CONNECTION_STRING)
+    or, when account_url is given, from the account url and the shared credential"""
+    from azure.storage.blob import BlobServiceClient
+    if account_url:
+        client = BlobServiceClient(account_url, credential=get_credential())
+    else:
+        client = BlobServiceClient.from_connection_string(
+            connection_string or os.getenv("STORAGE_CONNECTION_STRING", ""))
+    _open_clients.append(client)
+    return client
+
+
+def get_container_client(container, connection_string=None, account_url=None):
+    """Container client sharing the cached service client's connection pool"""
+    return get_blob_service_client(connection_string, account_url).get_container_client(container)
+
+
+def close_all():
+    """Close cached clients and forget them (e.g. at worker shutdown)"""
+    while _open_clients:
+        client = _open_clients.pop()
+        close = getattr(client, 'close', None)
+        if close is not None:
+            close()
+    for cached in (get_kusto_client, get_ingest_client, get_blob_service_client, get_credential):
+        cached.cache_clear()
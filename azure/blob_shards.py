@@ -0,0 +1,270 @@
+"""
+Pack a directory of many small files (e.g. label .txt files and JPEGs) into
+size-targeted tar shards in Azure Blob Storage, WebDataset-style, and read
+them back.
+
+Files are sorted by their path relative to --dir and kept together by sample
+key (the path without extension, so img001.jpg and img001.txt land in the
+same shard).  Each shard is <prefix>/shard-000000.tar; <prefix>/index.jsonl
+has one line per file {"name", "shard", "offset", "size", "compressed"}
+with the byte offset and size of its data inside the shard, so a single file
+is fetched with one range read.  With compression on, members that are not
+already compressed (not .jpg, .png, .gz, ...) are gzipped individually
+(member name + ".gz"), which keeps range reads possible.  Shards are packed
+on --pack-workers threads while finished shards upload on --upload-workers
+threads, with at most pack + upload workers shards held in memory.
+
+usage:
+blob_shards.py --dir images --prefix images --shard-mb 256
+blob_shards.py --prefix images                          (stream every shard, report MB/s)
+blob_shards.py --prefix images --get train/img001.jpg --output img001.jpg
+
+Make sure to set the environment variables before running:
+- STORAGE_CONNECTION_STRING
+- STORAGE_CONTAINER_NAME
+
+To run you will need to pip install the following Python packages:
+
+azure-storage-blob>=12.14.1
+"""
+import argparse
+import gzip
+import io
+import json
+import os
+import tarfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from azure_clients import get_container_client
+
+# Not worth gzipping again
+COMPRESSED_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.gif', '.webp', '.mp4', '.avi', '.mkv',
+                         '.gz', '.tgz', '.zip', '.bz2', '.xz', '.npz', '.parquet'}
+INDEX_NAME = 'index.jsonl'
+
+
+def shard_name(prefix, number):
+    return '{}/shard-{:06d}.tar'.format(prefix, number)
+
+
+def plan_shards(directory, target_bytes):
+    """Group the relative paths of the files under directory into shards of
+    about target_bytes, never splitting a sample key across shards"""
+    names = sorted(os.path.relpath(os.path.join(root, filename), directory).replace(os.sep, '/')
+                   for root, _, filenames in os.walk(directory) for filename in filenames)
+    shards, shard, size, last_key = [], [], 0, None
+    for name in names:
+        key = os.path.splitext(name)[0]
+        if shard and size >= target_bytes and key != last_key:
+            shards.append(shard)
+            shard, size = [], 0
+        shard.append(name)
+        size += os.path.getsize(os.path.join(directory, name))
+        last_key = key
+    if shard:
+        shards.append(shard)
+    return shards
+
+
+def pack_shard(directory, names, compress=True):
+    """(tar bytes, index entries without the shard) of files under directory"""
+    buffer = io.BytesIO()
+    compressed = {}
+    with tarfile.open(fileobj=buffer, mode='w') as tar:
+        for name in names:
+            filename = os.path.join(directory, name)
+            with open(filename, 'rb') as f:
+                data = f.read()
+            member = name
+            if compress and os.path.splitext(name)[1].lower() not in COMPRESSED_EXTENSIONS:
+                data = gzip.compress(data, compresslevel=6, mtime=0)
+                member = name + '.gz'
+            compressed[member] = (name, member != name)
+            info = tarfile.TarInfo(member)
+            info.size = len(data)
+            info.mtime = int(os.path.getmtime(filename))
+            info.mode = 0o644
+            tar.addfile(info, io.BytesIO(data))
+    # Read the headers back for the data offsets (pax headers make them variable)
+    buffer.seek(0)
+    with tarfile.open(fileobj=buffer, mode='r') as tar:
+        entries = [{'name': compressed[member.name][0], 'offset': member.offset_data,
+                    'size': member.size, 'compressed': compressed[member.name][1]} for member in tar]
+    return buffer.getvalue(), entries
+
+
+def upload_shards(directory, container_client, prefix=None, shard_mb=256, compress=True, pack_workers=4,
+                  upload_workers=4, max_concurrency=4):
+    """Pack and upload directory as shards plus index.jsonl under prefix
+    (default the directory name), returns the index entries"""
+    prefix = (prefix or os.path.basename(os.path.normpath(directory))).strip('/')
+    shards = plan_shards(directory, shard_mb * 2**20)
+    print('Packing {} files into {} shards under {}/'.format(sum(map(len, shards)), len(shards), prefix))
+    # Bounds the shards packed or uploading (each held in memory) at a time
+    in_flight = threading.BoundedSemaphore(pack_workers + upload_workers)
+    lock = threading.Lock()
+    uploaded_bytes, t0 = [0], time.time()
+
+    def upload(number, data):
+        try:
+            container_client.upload_blob(name=shard_name(prefix, number), data=data, overwrite=True,
+                                         max_concurrency=max_concurrency)
+            with lock:
+                uploaded_bytes[0] += len(data)
+            print('Uploaded {} ({:.1f} MB, {:.1f} MB/s overall)'.format(
+                shard_name(prefix, number), len(data) / 2**20, uploaded_bytes[0] / 2**20 / (time.time() - t0)))
+        finally:
+            in_flight.release()
+
+    def pack(number, names):
+        try:
+            data, entries = pack_shard(directory, names, compress)
+        except BaseException:
+            in_flight.release()
+            raise
+        for entry in entries:
+            entry['shard'] = shard_name(prefix, number)
+        return entries, uploader.submit(upload, number, data)
+
+    with ThreadPoolExecutor(max_workers=upload_workers) as uploader, \
+            ThreadPoolExecutor(max_workers=pack_workers) as packer:
+        packed = []
+        for number, names in enumerate(shards):
+            in_flight.acquire()
+            packed.append(packer.submit(pack, number, names))
+        index = []
+        for future in packed:
+            entries, upload_future = future.result()
+            upload_future.result()
+            index.extend(entries)
+
+    container_client.upload_blob(name='{}/{}'.format(prefix, INDEX_NAME), overwrite=True,
+                                 data=''.join(json.dumps(entry) + '\n' for entry in index).encode())
+    print('Uploaded {:.1f} MB in {:.1f} s'.format(uploaded_bytes[0] / 2**20, time.time() - t0))
+    return index
+
+
+class _ChunkStream(io.RawIOBase):
+    """Readable file over an iterator of byte chunks (a blob download)"""
+
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._chunk = memoryview(b'')
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        while not self._chunk:
+            try:
+                self._chunk = memoryview(next(self._chunks))
+            except StopIteration:
+                return 0
+        n = min(len(b), len(self._chunk))
+        b[:n] = self._chunk[:n]
+        self._chunk = self._chunk[n:]
+        return n
+
+
+class ShardReader:
+    """Stream shards written by upload_shards in order, or read single files through the index"""
+
+    def __init__(self, container_client, prefix):
+        self.container_client = container_client
+        self.prefix = prefix.strip('/')
+        index = container_client.download_blob('{}/{}'.format(self.prefix, INDEX_NAME)).readall()
+        self.index = {}
+        self.shards = []
+        for line in index.decode().splitlines():
+            entry = json.loads(line)
+            self.index[entry['name']] = entry
+            if not self.shards or self.shards[-1] != entry['shard']:
+                self.shards.append(entry['shard'])
+
+    def __len__(self):
+        return len(self.index)
+
+    def read(self, name):
+        """Bytes of one file, one range read of its shard"""
+        entry = self.index[name]
+        data = self.container_client.download_blob(entry['shard'], offset=entry['offset'],
+                                                   length=entry['size']).readall()
+        return gzip.decompress(data) if entry['compressed'] else data
+
+    def iter_shard(self, shard):
+        """(name, bytes) of the files of one shard, streamed sequentially"""
+        stream = io.BufferedReader(_ChunkStream(self.container_client.download_blob(shard).chunks()),
+                                   buffer_size=2**20)
+        with tarfile.open(fileobj=stream, mode='r|') as tar:
+            for member in tar:
+                data = tar.extractfile(member).read()
+                name = member.name[:-3] if member.name.endswith('.gz') else member.name
+                if self.index.get(name, {}).get('compressed') and name != member.name:
+                    yield name, gzip.decompress(data)
+                else:
+                    yield member.name, data
+
+    def __iter__(self):
+        for shard in self.shards:
+            yield from self.iter_shard(shard)
+
+    def iter_samples(self):
+        """WebDataset-style samples: {'__key__': key, extension: bytes, ...} of files sharing a key"""
+        sample = None
+        for name, data in self:
+            key, extension = os.path.splitext(name)
+            if sample is None or sample['__key__'] != key:
+                if sample is not None:
+                    yield sample
+                sample = {'__key__': key}
+            sample[extension.lstrip('.')] = data
+        if sample is not None:
+            yield sample
+
+
+def main(args):
+    container_client = get_container_client(args.container or os.getenv("STORAGE_CONTAINER_NAME", ""))
+    if args.directory:
+        return upload_shards(args.directory, container_client, args.prefix, args.shard_mb, args.compress,
+                             args.pack_workers, args.upload_workers, args.max_concurrency)
+    reader = ShardReader(container_client, args.prefix)
+    if args.get:
+        data = reader.read(args.get)
+        with open(args.output or os.path.basename(args.get), 'wb') as f:
+            f.write(data)
+        print('Read {} ({} bytes)'.format(args.get, len(data)))
+        return data
+    t0, files, total = time.time(), 0, 0
+    for _, data in reader:
+        files += 1
+        total += len(data)
+    elapsed = time.time() - t0
+    print('Streamed {} files from {} shards, {:.1f} MB in {:.1f} s ({:.1f} MB/s, {:.0f} files/s)'.format(
+        files, len(reader.shards), total / 2**20, elapsed, total / 2**20 / elapsed, files / elapsed))
+    return files
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Pack a directory into tar shards in Azure Blob Storage or read them back.')
+    parser.add_argument('--dir', dest='directory', default=None, help='Directory to pack and upload')
+    parser.add_argument('--prefix', dest='prefix', default=None,
+                        help='Blob name prefix of the shards (default the directory name)')
+    parser.add_argument('--container', dest='container', default=None,
+                        help='Container (default STORAGE_CONTAINER_NAME)')
+    parser.add_argument('--shard-mb', dest='shard_mb', type=float, default=256, help='Target shard size in MB')
+    parser.add_argument('--no-compress', dest='compress', action='store_false',
+                        help='Do not gzip members that are not already compressed')
+    parser.add_argument('--pack-workers', dest='pack_workers', type=int, default=4, help='Shards packed at a time')
+    parser.add_argument('--upload-workers', dest='upload_workers', type=int, default=4,
+                        help='Shards uploaded at a time')
+    parser.add_argument('--max-concurrency', dest='max_concurrency', type=int, default=4,
+                        help='Parallel block uploads per shard')
+    parser.add_argument('--get', dest='get', default=None, help='Read a single file through the index')
+    parser.add_argument('--output', dest='output', default=None, help='Where to write the --get file')
+
+    args = parser.parse_args()
+    if not args.directory and not args.prefix:
+        parser.error('--prefix is required to read shards')
+    main(args)
@@ -0,0 +1,233 @@
+"""
+Ingest csv (or other format) blobs straight from Azure Blob Storage into
+Kusto/ADX with ingest_from_blob, so the data never passes through this
+machine: only the blob URIs and sizes are sent.
+
+Blobs come from a manifest (json lines {"uri": ..., "size": ...} as written
+by `upload_to_blob_storage.py --manifest`, or one URI per line) or from a
+container listing (--container/--prefix, with STORAGE_CONNECTION_STRING).
+The service reads the blobs itself, so listed URIs and manifest URIs without
+a query string get --sas appended (a read SAS token for the container)
+unless the cluster has its own access.
+
+Blobs are submitted in batches of at most --batch-blobs blobs and --batch-gb
+raw GB, --workers submissions at a time.  With --track each batch waits for
+its ingestion status before the next one starts, so a large backfill is fed
+to the cluster at a bounded rate.  A blob whose submission fails does not
+stop the others.  Blobs whose submission failed, and with --track those
+whose ingestion failed, are written to --failed-manifest without their SAS
+token; retry them with --manifest and --sas.
+
+usage:
+blob_to_kusto.py --manifest uploaded.jsonl --cluster ADX_CLUSTER --region AZ_REGION --db ADX_DB_NAME --table ADX_TABLE_NAME --ignore-first-record
+blob_to_kusto.py --container data --prefix 2022/01/ --sas "sv=...&sig=..." --cluster ADX_CLUSTER --region AZ_REGION --db ADX_DB_NAME --table ADX_TABLE_NAME --track
+
+With --simulator FILE the local SQLite simulator (kusto_simulator.py) ingests
+the blobs instead, fetching them over http(s) (e.g. from Azurite).
+
+To run you will need to pip install the following Python packages:
+
+azure-identity>=1.12.0
+azure-kusto-data>=4.0.0
+azure-kusto-ingest>=4.0.0
+azure-storage-blob>=12.14.1
+python-dotenv==0.12.0
+"""
+import argparse
+import json
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote
+
+from azure.kusto.data.data_format import DataFormat
+from azure.kusto.ingest import BlobDescriptor, IngestionProperties
+
+from azure_clients import get_container_client, get_ingest_client, kusto_urls
+from ingestion_tracker import IngestionTracker
+
+
+# set logger to print at info level
+logger_format = '%(asctime)s:%(message)s'
+logging.basicConfig(format=logger_format, level=logging.INFO, datefmt="%H:%M:%S")
+
+# Raw size of compressed blobs is unknown from a listing, the service estimates it
+COMPRESSED_EXTENSIONS = ('.gz', '.zip')
+
+
+def raw_size(name, size):
+    return None if name.lower().endswith(COMPRESSED_EXTENSIONS) else size
+
+
+def with_sas(uri, sas=None):
+    """uri with the SAS token appended, unless it has a query string already"""
+    if sas and '?' not in uri:
+        uri += '?' + sas.lstrip('?')
+    return uri
+
+
+def read_manifest(manifest, sas=None):
+    """[(uri, raw size or None)] from json lines or plain URI lines"""
+    blobs = []
+    with open(manifest) as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            if line.startswith('{'):
+                entry = json.loads(line)
+                blobs.append((with_sas(entry['uri'], sas),
+                              raw_size(entry['uri'].split('?')[0], entry.get('size'))))
+            else:
+                blobs.append((with_sas(line, sas), None))
+    return blobs
+
+
+def list_container_blobs(container, prefix=None, sas=None, connection_string=None):
+    """[(uri, raw size or None)] of the blobs of a container, with a SAS token appended"""
+    container_client = get_container_client(container, connection_string)
+    blobs = []
+    for blob in container_client.list_blobs(name_starts_with=prefix):
+        uri = with_sas('{}/{}'.format(container_client.url, quote(blob.name)), sas)
+        blobs.append((uri, raw_size(blob.name, blob.size)))
+    return blobs
+
+
+def batch_blobs(blobs, max_blobs=100, max_bytes=10 * 2**30):
+    """Split blobs into consecutive batches limited by count and raw size"""
+    batches, batch, size = [], [], 0
+    for uri, blob_size in blobs:
+        if batch and (len(batch) >= max_blobs or size + (blob_size or 0) > max_bytes):
+            batches.append(batch)
+            batch, size = [], 0
+        batch.append((uri, blob_size))
+        size += blob_size or 0
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+def ingest_blobs(blobs, ingest_client, adx_db_name, adx_table_name, workers=8, max_blobs=100,
+                 max_bytes=10 * 2**30, tracker=None, data_format=DataFormat.CSV,
+                 ignore_first_record=False, status_timeout=3600):
+    """Submit blobs with ingest_from_blob in bounded batches.  A failed submission
+    does not stop the backfill, returns {'queued': [(uri, result)], 'failed': [(uri, error)]}.
+    With a tracker, blobs whose ingestion failed are moved from queued to failed."""
+    def submit(blob):
+        uri, size = blob
+        if tracker is not None:
+            return tracker.ingest_blob(uri, size, adx_db_name, adx_table_name,
+                                       data_format=data_format, ignore_first_record=ignore_first_record)
+        ingestion_properties = IngestionProperties(database=adx_db_name,
+                                                   table=adx_table_name,
+                                                   data_format=data_format,
+                                                   ignore_first_record=ignore_first_record)
+        return ingest_client.ingest_from_blob(BlobDescriptor(uri, size),
+                                              ingestion_properties=ingestion_properties)
+
+    results = {'queued': [], 'failed': []}
+    batches = batch_blobs(blobs, max_blobs, max_bytes)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for i, batch in enumerate(batches):
+            t0 = time.time()
+            futures = [(uri, executor.submit(submit, (uri, size))) for uri, size in batch]
+            for uri, future in futures:
+                try:
+                    results['queued'].append((uri, future.result()))
+                except Exception as err:
+                    logging.info('Failed to submit {}: {}'.format(uri.split('?')[0], err))
+                    results['failed'].append((uri, str(err)))
+            logging.info('Batch {}/{}: {} blobs, {:.1f} MB submitted in {:.2f} s ({} failed so far)'.format(
+                i + 1, len(batches), len(batch), sum(size or 0 for _, size in batch) / 2**20,
+                time.time() - t0, len(results['failed'])))
+            if tracker is not None:
+                # Bound the load on the cluster: next batch once this one is ingested
+                pending = tracker.wait(timeout=status_timeout, interval=2)
+                if pending:
+                    logging.info('{} ingestions still pending after {} s'.format(len(pending), status_timeout))
+    if tracker is not None:
+        # Submitted but rejected by the service (bad format, missing table, ...)
+        failed = [(uri, batch) for uri, batch in results['queued'] if batch.status == 'Failed']
+        results['queued'] = [(uri, batch) for uri, batch in results['queued'] if batch.status != 'Failed']
+        results['failed'].extend((uri, str(batch.error)) for uri, batch in failed)
+    return results
+
+
+def main(args):
+    if args.manifest:
+        blobs = read_manifest(args.manifest, args.sas)
+    else:
+        blobs = list_container_blobs(args.container, args.prefix, args.sas)
+    logging.info('{} blobs to ingest'.format(len(blobs)))
+
+    status_queues = None
+    if args.simulator:
+        # Local SQLite stand-in for the cluster, see kusto_simulator.py
+        from kusto_simulator import KustoSimulator
+        store = KustoSimulator(args.simulator)
+        ingest_client, status_queues = store.ingest_client(), store.status_queues
+    else:
+        ingest_client = get_ingest_client(kusto_urls(args.adx_cluster, args.az_region)[0])
+
+    tracker = IngestionTracker(ingest_client, status_queues) if args.track else None
+    results = ingest_blobs(blobs, ingest_client, args.adx_db_name, args.adx_table_name,
+                           args.workers, args.batch_blobs, args.batch_gb * 2**30, tracker,
+                           DataFormat[args.data_format.upper()], args.ignore_first_record,
+                           args.status_timeout)
+    if results['failed']:
+        # Without the SAS token, it is a secret
+        print(json.dumps({'failed': [{'uri': uri.split('?')[0], 'error': error}
+                                     for uri, error in results['failed']]}, indent=4))
+        if args.failed_manifest:
+            # Same format as --manifest, to retry only the failed blobs (with --sas)
+            sizes = dict(blobs)
+            with open(args.failed_manifest, 'w') as f:
+                for uri, _ in results['failed']:
+                    f.write(json.dumps({'uri': uri.split('?')[0], 'size': sizes[uri]}) + '\n')
+            logging.info('Failed blobs written to {}'.format(args.failed_manifest))
+    print(json.dumps({k: len(v) for k, v in results.items()}))
+    if tracker is not None:
+        print(json.dumps(tracker.summary(), indent=4))
+    elif args.simulator:
+        ingest_client.flush()
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--manifest', type=str, default=None,
+                        help='Blob URIs, json lines {"uri", "size"} or one URI per line')
+    source.add_argument('--container', type=str, default=None,
+                        help='Container to list (STORAGE_CONNECTION_STRING)')
+    parser.add_argument('--prefix', type=str, default=None, help='Only blobs whose name starts with this')
+    parser.add_argument('--sas', type=str, default=None,
+                        help='Read SAS token appended to listed blob URIs and manifest URIs without one')
+    parser.add_argument('--cluster', type=str, dest='adx_cluster', help='ADX cluster name')
+    parser.add_argument('--region', type=str, dest='az_region', default='westus',
+                        help='Azure region (all lowercase), e.g., westus')
+    parser.add_argument('--db', type=str, dest='adx_db_name', required=True, help='ADX database name')
+    parser.add_argument('--table', type=str, dest='adx_table_name', required=True,
+                        help='ADX database table name')
+    parser.add_argument('--format', type=str, dest='data_format', default='csv',
+                        help='Data format of the blobs, e.g. csv, json, parquet')
+    parser.add_argument('--ignore-first-record', action='store_true', dest='ignore_first_record',
+                        help='Skip the header line of each csv blob')
+    parser.add_argument('--workers', type=int, default=8, help='Concurrent ingest_from_blob calls')
+    parser.add_argument('--batch-blobs', type=int, dest='batch_blobs', default=100,
+                        help='Maximum blobs per batch')
+    parser.add_argument('--batch-gb', type=float, dest='batch_gb', default=10.,
+                        help='Maximum raw GB per batch')
+    parser.add_argument('--track', action='store_true',
+                        help='Report ingestion status and wait for each batch before the next')
+    parser.add_argument('--status-timeout', type=int, dest='status_timeout', default=3600,
+                        help='Seconds to wait for a batch with --track')
+    parser.add_argument('--failed-manifest', type=str, dest='failed_manifest', default='blob_to_kusto_failed.jsonl',
+                        help='Where to write the failed blobs, without SAS tokens (a --manifest to retry them)')
+    parser.add_argument('--simulator', type=str, default=None,
+                        help='SQLite file of a local simulated cluster (kusto_simulator.py) to use instead of ADX')
+
+    args = parser.parse_args()
+    if not args.simulator and not args.adx_cluster:
+        parser.error('--cluster is required unless --simulator is given')
+    main(args)
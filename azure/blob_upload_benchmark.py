@@ -0,0 +1,77 @@
+"""
+Upload throughput of staged block uploads (upload_large_file in
+upload_to_blob_storage.py) for combinations of block size and per-file
+concurrency, against Azurite (local Azure Storage emulator) by default.
+
+Start Azurite first, e.g.:
+docker run -p 10000:10000 mcr.microsoft.com/azure-storage/azurite azurite-blob --blobHost 0.0.0.0
+
+usage: blob_upload_benchmark.py --size-mb 512 --block-sizes-mb 4 8 32 --concurrency 1 4 8
+
+Pass --connection-string (or set STORAGE_CONNECTION_STRING) to measure a
+real storage account instead.
+
+To run you will need to pip install the following Python packages:
+
+azure-storage-blob>=12.14.1
+"""
+import argparse
+import os
+import time
+
+from azure_clients import get_container_client
+from upload_to_blob_storage import create_container, upload_large_file
+
+# Well-known development account of Azurite
+AZURITE_CONNECTION_STRING = ('DefaultEndpointsProtocol=http;AccountName=devstoreaccount1;'
+                             'AccountKey=Eby8vdM02xNOcqFlqUwJPLlmEtlCDXJ1OUzFT50uSRZ6IFsuFq2UVErCz4I6tq/'
+                             'K1SZFPTOtr/KBHBeksoGMGw==;BlobEndpoint=http://127.0.0.1:10000/devstoreaccount1;')
+
+
+def write_test_file(filename, size_mb):
+    with open(filename, 'wb') as f:
+        for _ in range(int(size_mb)):
+            f.write(os.urandom(2**20))
+
+
+def main(args):
+    if not os.path.exists(args.filename) or os.path.getsize(args.filename) != int(args.size_mb) * 2**20:
+        print('Writing {} MB to {}'.format(int(args.size_mb), args.filename))
+        write_test_file(args.filename, args.size_mb)
+    connection_string = args.connection_string or os.getenv('STORAGE_CONNECTION_STRING') or AZURITE_CONNECTION_STRING
+    container_client = get_container_client(args.container, connection_string)
+    create_container(container_client)
+
+    print('{:>14} {:>12} {:>10} {:>10}'.format('block size MB', 'concurrency', 'seconds', 'MB/s'))
+    results = []
+    for block_size_mb in args.block_sizes_mb:
+        for concurrency in args.concurrency:
+            blob_name = 'benchmark/{}mb-{}.bin'.format(block_size_mb, concurrency)
+            # Fresh blob each run so no block is skipped as already staged
+            blob_client = container_client.get_blob_client(blob_name)
+            if blob_client.exists():
+                blob_client.delete_blob()
+            t0 = time.time()
+            upload_large_file(container_client, args.filename, blob_name, int(block_size_mb * 2**20),
+                              concurrency, progress=None)
+            seconds = time.time() - t0
+            results.append((block_size_mb, concurrency, seconds, args.size_mb / seconds))
+            print('{:>14} {:>12} {:>10.2f} {:>10.1f}'.format(*results[-1]))
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--size-mb', type=float, dest='size_mb', default=256, help='Size of the test file')
+    parser.add_argument('--file', type=str, dest='filename', default='blob_upload_benchmark.bin',
+                        help='Test file, written first if missing or of another size')
+    parser.add_argument('--block-sizes-mb', type=float, nargs='+', dest='block_sizes_mb', default=[4, 8, 32],
+                        help='Block sizes to compare')
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 4, 8],
+                        help='Parallel block uploads to compare')
+    parser.add_argument('--container', type=str, default='upload-benchmark', help='Container to upload to')
+    parser.add_argument('--connection-string', type=str, dest='connection_string', default=None,
+                        help='Storage connection string (default STORAGE_CONNECTION_STRING, then Azurite)')
+
+    args = parser.parse_args()
+    main(args)
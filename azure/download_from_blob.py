@@ -0,0 +1,172 @@
+"""
+Download data from blob storage with the v12 SDK's asyncio clients
+(azure.storage.blob.aio, tested with azure-storage-blob==12.14.1)
+
+Blobs are listed page by page (--page-size names at a time, so a container
+with millions of blobs is never held in memory) and downloaded by
+--concurrency tasks, each blob itself in --max-concurrency parallel range
+requests of --chunk-mb.  Every blob is written to a temporary file next to
+its destination, checked against the MD5 stored with the blob (when it has
+one, blobs uploaded in blocks often do not) and then atomically renamed, so
+an interrupted run never leaves a partial file under the final name.
+Existing files of the same size are skipped unless --overwrite is given.
+
+Make sure to set the environment variables before running:
+STORAGE_CONNECTION_STRING
+or (as for the legacy v2.1 script)
+STORAGE_ACCOUNT_NAME
+STORAGE_ACCOUNT_KEY
+
+usage: download_from_blob.py --container data --prefix 2022/01/ --output-dir downloads --concurrency 16
+
+To run you will need to pip install the following Python packages:
+
+aiohttp>=3.8.0
+azure-storage-blob>=12.14.1
+python-dotenv>=0.12.0
+"""
+import argparse
+import asyncio
+import hashlib
+import os
+import tempfile
+import time
+
+from azure.storage.blob.aio import BlobServiceClient
+from dotenv import load_dotenv
+
+
+def arg_parse():
+    """
+    Parse arguments
+    """
+    parser = argparse.ArgumentParser(description='This script is for downloading blob files from a blob storage container on Azure.')
+    parser.add_argument("--container", dest='container', help="Blob storage container name", type=str)
+    parser.add_argument("--output-dir", dest='output_dir', help="Local folder to which files will be saved", type=str)
+    parser.add_argument("--prefix", dest='prefix', default=None, help="Only download blobs whose name starts with this", type=str)
+    parser.add_argument("--concurrency", dest='concurrency', default=8, help="Blobs downloaded at the same time", type=int)
+    parser.add_argument("--max-concurrency", dest='max_concurrency', default=4,
+                        help="Parallel range requests per blob", type=int)
+    parser.add_argument("--chunk-mb", dest='chunk_mb', default=8, help="Size of each range request in MB", type=int)
+    parser.add_argument("--page-size", dest='page_size', default=1000, help="Blob names listed per request", type=int)
+    parser.add_argument("--overwrite", dest='overwrite', action='store_true',
+                        help="Download blobs even if a file of the same size exists")
+    parser.add_argument("--no-verify", dest='verify', action='store_false', help="Skip the MD5 check")
+    return parser.parse_args()
+
+
+def blob_service_client(connection_string=None, chunk_mb=8):
+    """Async service client from STORAGE_CONNECTION_STRING or the account name and key"""
+    load_dotenv()
+    chunk_size = chunk_mb * 2**20
+    connection_string = connection_string or os.getenv('STORAGE_CONNECTION_STRING')
+    if connection_string:
+        return BlobServiceClient.from_connection_string(connection_string, max_single_get_size=chunk_size,
+                                                        max_chunk_get_size=chunk_size)
+    account_name = os.getenv('STORAGE_ACCOUNT_NAME')
+    return BlobServiceClient(f'https://{account_name}.blob.core.windows.net',
+                             credential={'account_name': account_name,
+                                         'account_key': os.getenv('STORAGE_ACCOUNT_KEY')},
+                             max_single_get_size=chunk_size, max_chunk_get_size=chunk_size)
+
+
+def local_path(output_dir, name):
+    """Destination of a blob, refusing names that would escape output_dir"""
+    path = os.path.normpath(os.path.join(output_dir, name))
+    if os.path.commonpath([os.path.abspath(path), os.path.abspath(output_dir)]) != os.path.abspath(output_dir):
+        raise ValueError('Blob name {} points outside {}'.format(name, output_dir))
+    return path
+
+
+def file_md5(filename, block_size=8 * 2**20):
+    md5 = hashlib.md5()
+    with open(filename, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            md5.update(block)
+    return md5.digest()
+
+
+async def download_blob(container_client, blob, output_dir, max_concurrency=4, verify=True, overwrite=False):
+    """Download one blob through a temporary file, returns 'downloaded', 'skipped' or 'unverified'"""
+    path = local_path(output_dir, blob.name)
+    if not overwrite and os.path.isfile(path) and os.path.getsize(path) == blob.size:
+        return 'skipped'
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.' + os.path.basename(path),
+                                     suffix='.part')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            downloader = await container_client.download_blob(blob.name, max_concurrency=max_concurrency)
+            await downloader.readinto(f)
+        expected = blob.content_settings.content_md5 if blob.content_settings else None
+        if verify and expected:
+            # Hash the local copy off the event loop, the file is still in the page cache
+            actual = await asyncio.get_running_loop().run_in_executor(None, file_md5, temp_path)
+            if actual != bytes(expected):
+                raise IOError('MD5 mismatch for blob {}'.format(blob.name))
+        os.replace(temp_path, path)
+    except BaseException:
+        os.remove(temp_path)
+        raise
+    return 'downloaded' if expected or not verify else 'unverified'
+
+
+async def download_container_async(container_name, output_dir, prefix=None, concurrency=8, max_concurrency=4,
+                                   chunk_mb=8, page_size=1000, verify=True, overwrite=False,
+                                   connection_string=None):
+    """Download the blobs of a container under output_dir, returns {status: [blob names]}"""
+    os.makedirs(output_dir, exist_ok=True)
+    results = {'downloaded': [], 'unverified': [], 'skipped': [], 'failed': []}
+    downloaded_bytes = 0
+    # Bounded queue: listing stays at most a couple of pages ahead of the downloads
+    queue = asyncio.Queue(maxsize=2 * max(concurrency, page_size))
+
+    async def worker(container_client):
+        nonlocal downloaded_bytes
+        while True:
+            blob = await queue.get()
+            if blob is None:
+                return
+            try:
+                status = await download_blob(container_client, blob, output_dir, max_concurrency,
+                                             verify, overwrite)
+                print("\t Blob name: {} ({})".format(blob.name, status))
+                if status != 'skipped':
+                    downloaded_bytes += blob.size
+            except Exception as err:
+                print("WARNING: failed to download {}: {}".format(blob.name, err))
+                status = 'failed'
+            results[status].append(blob.name)
+
+    t0 = time.time()
+    async with blob_service_client(connection_string, chunk_mb) as service_client:
+        container_client = service_client.get_container_client(container_name)
+        workers = [asyncio.create_task(worker(container_client)) for _ in range(concurrency)]
+        try:
+            pages = container_client.list_blobs(name_starts_with=prefix, results_per_page=page_size).by_page()
+            async for page in pages:
+                async for blob in page:
+                    await queue.put(blob)
+        finally:
+            for _ in workers:
+                await queue.put(None)
+            await asyncio.gather(*workers)
+
+    elapsed = time.time() - t0
+    print('{} downloaded ({} without MD5), {} skipped, {} failed: {:.1f} MB in {:.1f} s ({:.1f} MB/s)'.format(
+        len(results['downloaded']) + len(results['unverified']), len(results['unverified']),
+        len(results['skipped']), len(results['failed']), downloaded_bytes / 2**20, elapsed,
+        downloaded_bytes / 2**20 / max(elapsed, 1e-9)))
+    return results
+
+
+def download_container(container_name, output_dir, **kwargs):
+    """Blocking wrapper of download_container_async"""
+    return asyncio.run(download_container_async(container_name, output_dir, **kwargs))
+
+
+if __name__ == '__main__':
+    args = arg_parse()
+    download_container(args.container, args.output_dir, prefix=args.prefix, concurrency=args.concurrency,
+                       max_concurrency=args.max_concurrency, chunk_mb=args.chunk_mb, page_size=args.page_size,
+                       verify=args.verify, overwrite=args.overwrite)
@@ -10,25 +10,111 @@ is used, which collects Azure logins into teams.
 
 import csv
 import argparse
-import os
 import json
+import os
+import shlex
+import subprocess
+import tempfile
+import threading
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import inflect
 
 __author__ = "Micheleen Harris"
 __license__ = "MIT"
 __status__ = "Development"
 
+# Building an inflect engine is slow, share one
+_inflect_engine = inflect.engine()
+
 def num2word(num):
     """This util converts an integer to its word represenation"""
-    p = inflect.engine()
-    numword = list(p.number_to_words(num))
+    numword = list(_inflect_engine.number_to_words(num))
     # Capitalize first letter
     numword[0] = str.upper(numword[0])
     numword = ''.join(numword)
     return numword
 
-def main(file, teaminfoflag):
+def az_login_tenant(user, passwd, az_command='az', timeout=60):
+    """Log in with the Azure CLI and return the tenant id, None on failure.
+
+    Each call gets its own AZURE_CONFIG_DIR so concurrent logins do not
+    share (and race on) the CLI token cache.  az_command may be replaced by
+    any command that prints the same json as `az login` (e.g. a fake for
+    running offline).
+    """
+    cmd = shlex.split(az_command) + ['login', '-u', user, '-p', passwd, '--output', 'json']
+    with tempfile.TemporaryDirectory() as config_dir:
+        env = dict(os.environ, AZURE_CONFIG_DIR=config_dir)
+        try:
+            out = subprocess.run(cmd, capture_output=True, text=True, timeout=timeout,
+                                 env=env).stdout
+        except subprocess.TimeoutExpired:
+            return None
+    if not out:
+        # this may be due to a bad login
+        return None
+    try:
+        return json.loads(out)[0]['tenantId']
+    except (ValueError, KeyError, IndexError):
+        return None
+
+class TenantResolver:
+    """Resolves tenant ids on a bounded thread pool, one login per cache key
+    (the subscription when known, otherwise the user).  Further users of an
+    already submitted key are kept as fallbacks in case the login fails; a
+    fallback arriving after every earlier login of its key failed starts a
+    new resolve of that key."""
+
+    def __init__(self, executor, az_command='az', timeout=60):
+        self.executor = executor
+        self.az_command = az_command
+        self.timeout = timeout
+        self.candidates = {}
+        self.tried = {}
+        self.running = set()
+        self.resolved = {}
+        self.futures = {}
+        self.latest = {}
+        self.lock = threading.Lock()
+
+    def submit(self, key, user, passwd):
+        with self.lock:
+            self.candidates.setdefault(key, []).append((user, passwd))
+            if key in self.running or key in self.resolved:
+                return
+            self.running.add(key)
+        future = self.executor.submit(self.resolve, key)
+        self.futures[future] = key
+        self.latest[key] = future
+
+    def resolve(self, key):
+        """Try the key's candidates not tried yet until one logs in"""
+        while True:
+            with self.lock:
+                i = self.tried.get(key, 0)
+                if i >= len(self.candidates[key]):
+                    self.running.discard(key)
+                    return None
+                self.tried[key] = i + 1
+                user, passwd = self.candidates[key][i]
+            tenantid = az_login_tenant(user, passwd, self.az_command, self.timeout)
+            if tenantid:
+                with self.lock:
+                    self.resolved[key] = tenantid
+                    self.running.discard(key)
+                return tenantid
+
+    def as_completed(self):
+        """Yield (key, tenant id or None) as logins finish, once per key"""
+        for future in as_completed(list(self.futures)):
+            key = self.futures[future]
+            # A failed resolve superseded by a later one with new fallbacks
+            if future is not self.latest[key]:
+                continue
+            yield key, future.result()
+
+def main(file, teaminfoflag, az_command='az', workers=8, timeout=60):
     """Function to read a file with Azure subs, IDs, passwords
     and output a comma separated string of Tenant IDs plus (optionally) 
     team assigments.  This was made for ML OpenHack.
@@ -43,6 +129,12 @@ def main(file, teaminfoflag):
     teaminfoflag : command line flag, False when not present
         Simple flag for whether or not to produce a json representation
         of the User, Sub and Team assignments (for a particular use case)
+    az_command : str
+        Azure CLI command, logins run as `<az_command> login -u USER -p PASSWORD`
+    workers : int
+        Number of logins run concurrently
+    timeout : int
+        Seconds before a single login is abandoned
 
     Returns
     -------
@@ -51,20 +143,18 @@ def main(file, teaminfoflag):
         A json representation of User, Subscription ID, and a Team
         from the special csv file from a vendor (script could be generalized)
     """
-    with open(file) as csvfile:
-        tenantids = set()
+    teaminfolist = []
+    tenantids = set()
+    with open(file) as csvfile, ThreadPoolExecutor(max_workers=workers) as executor:
+        resolver = TenantResolver(executor, az_command, timeout)
         reader = csv.DictReader(csvfile)
-        rowlist = list(reader)
-
-        # Move past the header
-        next(reader, None)
 
         if teaminfoflag:
             # Initialize everything
-            teaminfolist, smalldict, tmpusernames, teamnum, subid = [], defaultdict(), [], 1, ''
+            smalldict, tmpusernames, teamnum, subid = defaultdict(), [], 1, ''
 
-        for i in range(len(rowlist)):
-            row = rowlist[i]
+        # Logins are submitted while the file is read, one pass, no list of rows
+        for row in reader:
 
             # Blank row, add collated info to list
             if not row['Azure Account Log-In']:
@@ -80,25 +170,27 @@ def main(file, teaminfoflag):
                 continue
 
             user = row['Azure Account Log-In'].replace(' Azure UserName: ','')
+            rowsubid = (row.get(' CSP Subscription Id') or '').replace(' CSP Subscription Id: ', '')
             if teaminfoflag:
                 tmpusernames.append(user)
-                subid = row[' CSP Subscription Id'].replace(' CSP Subscription Id: ', '')
+                subid = rowsubid
             passwd = row['Azure Account Password'].replace(' Azure Password: ', '')
 
-            # Log in to Azure using Azure CLI
-            cmd = "az login -u {} -p \"{}\"".format(user, passwd)
-            out = os.popen(cmd).read()
-            if not out:
-                # this may be due to a tricky password character
-                continue
-            data = json.loads(out)
-            tenantids.add('"' + data[0]['tenantId'] + '"')
+            # Users sharing a subscription share a tenant, log in once per subscription
+            resolver.submit(rowsubid or user, user, passwd)
+
+        # Stream tenant ids out as the logins finish
+        for key, tenantid in resolver.as_completed():
+            if tenantid is None:
+                print('No tenant id for {}'.format(key))
+            elif '"' + tenantid + '"' not in tenantids:
+                tenantids.add('"' + tenantid + '"')
+                print('"' + tenantid + '"', flush=True)
 
     tenantids_str = ",\n".join(tenantids)
-    print(tenantids_str)
 
     # Populate with the last team's info
-    if teaminfoflag:
+    if teaminfoflag and tmpusernames:
         smalldict['SubscriptionId'] = subid
         smalldict['Usernames'] = tmpusernames
         smalldict['TeamName'] = 'Team {}'.format(num2word(teamnum))
@@ -113,9 +205,14 @@ if __name__ == '__main__':
     parser.add_argument("--file", help="Azure sub file")
     # Optional flag for gleaning info around "teams" of users
     parser.add_argument('--teaminfo', action='store_true')
+    parser.add_argument("--az-command", default='az',
+                        help="Azure CLI command (e.g. a fake printing `az login` json to run offline)")
+    parser.add_argument("--workers", type=int, default=8, help="Concurrent logins")
+    parser.add_argument("--timeout", type=int, default=60, help="Seconds before a login is abandoned")
 
     args = parser.parse_args()
-    tenantids_str, teaminfo_str = main(args.file, args.teaminfo)
+    tenantids_str, teaminfo_str = main(args.file, args.teaminfo, args.az_command,
+                                       args.workers, args.timeout)
 
     with open('tenantids_out.txt', 'w') as f:
         f.write(tenantids_str)
@@ -0,0 +1,234 @@
+"""
+End-to-end tracking of queued Kusto/ADX ingestions.
+
+QueuedIngestClient only queues data, so the time an ingest call takes says
+nothing about when (or whether) the rows landed in the table.  The tracker
+turns on status reporting for every ingestion it submits
+(ReportLevel.FailuresAndSuccesses, ReportMethod.Queue), polls the ingestion
+status queues, matches messages to submissions by source id and records per
+batch rows/s, bytes/s, queue latency and failures as structured metrics.
+A batch completes at the time stamped on its status message (SucceededOn /
+FailedOn, set by the service), so latencies do not depend on how often the
+queues are polled; only messages without a usable time stamp fall back to
+the time they were received.  Bytes are the raw size of the data sent (the
+serialized csv for dataframes).
+
+Example:
+
+    tracker = IngestionTracker(get_ingest_client(ingest_url))
+    tracker.ingest_dataframe(dataframe, 'db', 'table')
+    tracker.wait(timeout=600)
+    print(tracker.summary())
+
+The status queues can be replaced by any object with `success` and `failure`
+queues providing `pop(n)` (e.g. a local fake) through `status_queues`.
+
+To run you will need to pip install the following Python packages:
+
+pandas==1.5.1
+azure-kusto-ingest>=4.0.0
+"""
+import json
+import logging
+import os
+import re
+import tempfile
+import time
+from dataclasses import asdict, dataclass, field
+from datetime import datetime, timezone
+from typing import Optional
+
+import numpy as np
+
+from azure.kusto.data.data_format import DataFormat
+from azure.kusto.ingest import (BlobDescriptor, FileDescriptor, IngestionProperties, ReportLevel,
+                                ReportMethod)
+from azure.kusto.ingest.status import KustoIngestStatusQueues
+
+
+@dataclass
+class BatchMetrics:
+    """Metrics of one submitted ingestion"""
+    source_id: str
+    database: str
+    table: str
+    rows: int
+    bytes: int
+    submitted_at: float
+    submit_seconds: float
+    status: str = 'Queued'
+    completed_at: Optional[float] = None
+    error: Optional[str] = None
+    details: dict = field(default_factory=dict)
+
+    @property
+    def queue_latency(self):
+        """Seconds from submission until the ingestion completed"""
+        if self.completed_at is None:
+            return None
+        return self.completed_at - self.submitted_at
+
+    @property
+    def rows_per_sec(self):
+        return self.rows / self.queue_latency if self.queue_latency else None
+
+    @property
+    def bytes_per_sec(self):
+        return self.bytes / self.queue_latency if self.queue_latency else None
+
+    def as_dict(self):
+        metrics = asdict(self)
+        metrics.update(queue_latency=self.queue_latency,
+                       rows_per_sec=self.rows_per_sec,
+                       bytes_per_sec=self.bytes_per_sec)
+        return metrics
+
+
+def gzip_raw_size(path):
+    """Uncompressed size of a single-member gzip file, from its trailer (modulo 4 GiB)"""
+    with open(path, 'rb') as f:
+        f.seek(-4, os.SEEK_END)
+        return int.from_bytes(f.read(4), 'little')
+
+
+def message_time(message):
+    """Epoch seconds of a status message's SucceededOn/FailedOn, None without one"""
+    value = getattr(message, 'SucceededOn', None) or getattr(message, 'FailedOn', None)
+    if not value:
+        return None
+    if not isinstance(value, datetime):
+        # .NET writes 7 fractional digits and a Z, fromisoformat takes up to 6 and +00:00
+        text = re.sub(r'(\.\d{6})\d+', r'\1', str(value).strip().replace('Z', '+00:00'))
+        try:
+            value = datetime.fromisoformat(text)
+        except ValueError:
+            return None
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.timestamp()
+
+
+class IngestionTracker:
+    """Submits ingestions with status reporting and follows them to completion"""
+
+    def __init__(self, client, status_queues=None):
+        self.client = client
+        self.status_queues = status_queues if status_queues is not None else KustoIngestStatusQueues(client)
+        self.batches = {}
+
+    @staticmethod
+    def ingestion_properties(adx_db_name, adx_table_name, data_format=DataFormat.CSV, **kwargs):
+        """IngestionProperties reporting both successes and failures to the status queues"""
+        return IngestionProperties(database=adx_db_name,
+                                   table=adx_table_name,
+                                   data_format=data_format,
+                                   report_level=ReportLevel.FailuresAndSuccesses,
+                                   report_method=ReportMethod.Queue,
+                                   **kwargs)
+
+    def track(self, result, rows, nbytes, submitted_at, submit_seconds):
+        """Record a submission from the IngestionResult of an ingest_from_* call"""
+        batch = BatchMetrics(source_id=str(result.source_id),
+                             database=result.database,
+                             table=result.table,
+                             rows=rows,
+                             bytes=nbytes,
+                             submitted_at=submitted_at,
+                             submit_seconds=submit_seconds)
+        self.batches[batch.source_id] = batch
+        return batch
+
+    def ingest_dataframe(self, dataframe, adx_db_name, adx_table_name, **kwargs):
+        """Queue a dataframe for ingestion, bytes are its size as csv.
+
+        Serialized here as ingest_from_dataframe does (gzipped csv without
+        header) and sent with ingest_from_file, so the csv size is known
+        without writing the data twice."""
+        properties = self.ingestion_properties(adx_db_name, adx_table_name, **kwargs)
+        t0 = time.time()
+        fd, path = tempfile.mkstemp(suffix='.csv.gz')
+        os.close(fd)
+        try:
+            dataframe.to_csv(path, index=False, header=False, compression='gzip')
+            nbytes = gzip_raw_size(path)
+            result = self.client.ingest_from_file(FileDescriptor(path, nbytes), ingestion_properties=properties)
+        finally:
+            os.remove(path)
+        return self.track(result, len(dataframe), nbytes, t0, time.time() - t0)
+
+    def ingest_file(self, path, adx_db_name, adx_table_name, rows=0, **kwargs):
+        """Queue a local file for ingestion, bytes are its size on disk"""
+        properties = self.ingestion_properties(adx_db_name, adx_table_name, **kwargs)
+        t0 = time.time()
+        result = self.client.ingest_from_file(path, ingestion_properties=properties)
+        return self.track(result, rows, os.path.getsize(path), t0, time.time() - t0)
+
+    def ingest_blob(self, uri, size, adx_db_name, adx_table_name, rows=0, **kwargs):
+        """Queue a blob for ingestion by the service.  size is its raw (uncompressed)
+        size, None when unknown (compressed blobs, the service estimates it),
+        bytes are then 0"""
+        properties = self.ingestion_properties(adx_db_name, adx_table_name, **kwargs)
+        t0 = time.time()
+        result = self.client.ingest_from_blob(BlobDescriptor(uri, size), ingestion_properties=properties)
+        return self.track(result, rows, size or 0, t0, time.time() - t0)
+
+    @property
+    def pending(self):
+        return [batch for batch in self.batches.values() if batch.completed_at is None]
+
+    def poll(self, max_messages=32):
+        """Drain status messages, returns the batches completed by them.
+        Messages of ingestions not submitted through this tracker are ignored."""
+        completed = []
+        for queue, status in ((self.status_queues.success, 'Succeeded'),
+                              (self.status_queues.failure, 'Failed')):
+            for message in queue.pop(max_messages):
+                batch = self.batches.get(str(message.IngestionSourceId))
+                if batch is None or batch.completed_at is not None:
+                    continue
+                batch.status = status
+                # The service's completion time; the receive time if missing or
+                # earlier than the submission (clock skew)
+                completed_at = message_time(message)
+                if completed_at is None or completed_at < batch.submitted_at:
+                    completed_at = time.time()
+                batch.completed_at = completed_at
+                if status == 'Failed':
+                    batch.error = getattr(message, 'ErrorCode', None) or getattr(message, 'Details', None)
+                    batch.details = {'details': getattr(message, 'Details', None),
+                                     'failure_status': str(getattr(message, 'FailureStatus', ''))}
+                completed.append(batch)
+                logging.info('Ingestion %s', json.dumps(batch.as_dict(), default=str))
+        return completed
+
+    def wait(self, timeout=300, interval=5):
+        """Poll until every tracked ingestion completed or timeout seconds passed,
+        returns the batches still pending"""
+        deadline = time.time() + timeout
+        while self.pending and time.time() < deadline:
+            if not self.poll():
+                time.sleep(interval)
+        return self.pending
+
+    def summary(self):
+        """Totals and latency percentiles over all tracked batches"""
+        batches = list(self.batches.values())
+        done = [b for b in batches if b.status == 'Succeeded']
+        latencies = [b.queue_latency for b in done]
+        summary = {
+            'batches': len(batches),
+            'succeeded': len(done),
+            'failed': sum(b.status == 'Failed' for b in batches),
+            'pending': sum(b.completed_at is None for b in batches),
+            'rows': sum(b.rows for b in done),
+            'bytes': sum(b.bytes for b in done),
+        }
+        if done:
+            # Throughput over the whole window from first submission to last completion
+            elapsed = max(b.completed_at for b in done) - min(b.submitted_at for b in done)
+            p50, p90 = np.percentile(latencies, [50, 90])
+            summary.update(rows_per_sec=summary['rows'] / elapsed if elapsed else None,
+                           bytes_per_sec=summary['bytes'] / elapsed if elapsed else None,
+                           queue_latency_p50=float(p50), queue_latency_p90=float(p90),
+                           queue_latency_max=max(latencies))
+        return summary
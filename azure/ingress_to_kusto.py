@@ -3,7 +3,12 @@ Python ingress example for Kusto DB (from CSV file)
 
 usage: ingress_to_kusto.py --csv CSV_FILENAME --cluster ADX_CLUSTER --region AZ_REGION --db ADX_DB_NAME --table ADX_TABLE_NAME --timestamp-name TIMESTAMP_NAME
 
-There must be a file called ".env" in this folder with the environment variables 
+--csv may also be a directory or a quoted glob ("data/*.csv"): files are
+ingested oldest first by --workers threads sharing one client, small files
+are combined into ingestions of about --batch-mb, and completed files are
+recorded in --state-file so a rerun skips them.
+
+There must be a file called ".env" in this folder (read by azure_clients.py) with the environment variables 
 (each is NAME_OF_VAR=value, one per line).
 
 It must be an AAD application / Service Principal that is cleared for access to 
@@ -14,9 +19,11 @@ the ADX databases (give this Service Principal access to ADX first). The variabl
 
 To run you will need to pip install the following Python packages:
 
-pandas==1.5.1
-azure-kusto-data==3.1.3
-azure-kusto-ingest==3.1.3
+pandas>=2.0.0
+pyarrow>=12.0.0
+azure-identity>=1.12.0
+azure-kusto-data>=4.0.0
+azure-kusto-ingest>=4.0.0
 python-dotenv==0.12.0
 
 Prerequisites:
@@ -29,53 +36,42 @@ Hint to use KQL to create an empty table in an existing DB:
 // Create table command example:
 .create table ['IngestTest']  (['timestamp']:datetime, ['id']:int, ['name']:string, ['value']:long)
 """
+import glob
+import json
 import os
+import threading
 import pandas as pd
 import time
 import logging
 import argparse
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 from azure.kusto.data.exceptions import KustoServiceError
 from azure.kusto.data.helpers import dataframe_from_result_table
-from azure.kusto.data import KustoClient, KustoConnectionStringBuilder
 from azure.kusto.data.data_format import DataFormat
-from azure.kusto.ingest import IngestionProperties, QueuedIngestClient
+from azure.kusto.ingest import IngestionProperties
 
-from dotenv import load_dotenv
+from azure_clients import get_ingest_client, get_kusto_client, kusto_urls
+from ingestion_tracker import IngestionTracker
+from kusto_schema import DEFAULT_TIMESTAMP_FORMAT, fetch_table_schema, read_csv_with_schema
 
 
 # set logger to print at info level
 logger_format = '%(asctime)s:%(message)s'
 logging.basicConfig(format=logger_format, level=logging.INFO, datefmt="%H:%M:%S")
 
-# Load my environment variables (looks for .env file - for Kusto auth)
-load_dotenv()
-
-# Authenticate with following AAD username and password
-# read more at https://docs.microsoft.com/en-us/onedrive/find-your-office-365-tenant-id 
-AUTHORITY_ID = os.getenv("TENANT_ID", "")
-CLIENT_ID = os.getenv("CLIENT_ID", "")
-CLIENT_SECRET = os.getenv("CLIENT_SECRET", "")
+# Authentication (TENANT_ID, CLIENT_ID, CLIENT_SECRET from the environment or
+# .env file) and clients are shared and cached by azure_clients.py, so calling
+# ingest_csv repeatedly from a long-lived worker does not re-authenticate.
+# read more at https://docs.microsoft.com/en-us/onedrive/find-your-office-365-tenant-id
 
 def authenticate_to_kusto(cluster):
-    """Authenticate and return kusto connection client"""
-    kcsb = KustoConnectionStringBuilder.with_aad_application_key_authentication(cluster,
-                                                                                CLIENT_ID,
-                                                                                CLIENT_SECRET,
-                                                                                AUTHORITY_ID)
-    # The authentication method will be taken from the chosen KustoConnectionStringBuilder.
-    kusto_client = KustoClient(kcsb)
-    return kusto_client
+    """Return the (cached) kusto query client for a cluster url"""
+    return get_kusto_client(cluster)
 
 def authenticate_to_kusto_ingress(cluster):
-    """Authenticate and return kusto connection client"""
-    kcsb = KustoConnectionStringBuilder.with_aad_application_key_authentication(cluster,
-                                                                                CLIENT_ID,
-                                                                                CLIENT_SECRET,
-                                                                                AUTHORITY_ID)
-    # The authentication method will be taken from the chosen KustoConnectionStringBuilder.
-    kusto_client = QueuedIngestClient(kcsb)
-    return kusto_client
+    """Return the (cached) kusto queued ingest client for an ingest cluster url"""
+    return get_ingest_client(cluster)
 
 def query_kusto(query, db, client):
     """Query a kusto DB given client object, returns pandas dataframe"""
@@ -120,14 +116,18 @@ def get_last_ingress_date(client_ingr, adx_db_name, adx_table_name, timestamp_na
     else:
         return None
 
-def ingress_kusto(dataframe_input, adx_db_name, adx_table_name, client):
-    """Ingest into a kusto db give an input pandas dataframe"""
+def ingress_kusto(dataframe_input, adx_db_name, adx_table_name, client, tracker=None):
+    """Ingest into a kusto db give an input pandas dataframe.  With an
+    IngestionTracker the ingestion reports its status and its BatchMetrics
+    are returned (queued ingestion completes later, see tracker.wait)."""
     t0 = time.time()
     logging.info('Ingest started.')
-    ingestion_properties = IngestionProperties(database=adx_db_name,
-                                               table=adx_table_name,
-                                               data_format=DataFormat.CSV)
     try:
+        if tracker is not None:
+            return tracker.ingest_dataframe(dataframe_input, adx_db_name, adx_table_name)
+        ingestion_properties = IngestionProperties(database=adx_db_name,
+                                                   table=adx_table_name,
+                                                   data_format=DataFormat.CSV)
         response = client.ingest_from_dataframe(dataframe_input, ingestion_properties=ingestion_properties)
         return response
     except KustoServiceError as error:
@@ -137,59 +137,268 @@ def ingress_kusto(dataframe_input, adx_db_name, adx_table_name, client):
         print("3. Result size:", len(error.get_partial_results()))
     except Exception as exp:
         print("Error {}", exp)
-    t1 = time.time()
-    logging.info('Ingest took {:.04f} minutes.'.format((t1-t0)/60))
+    finally:
+        # Time to queue the data, not until it is in the table (see ingestion_tracker.py)
+        t1 = time.time()
+        logging.info('Ingest took {:.04f} minutes.'.format((t1-t0)/60))
 
-def main(args):
+def read_csv_file(csv_filename, query_client, adx_db_name, adx_table_name,
+                  use_table_schema=False, timestamp_format=DEFAULT_TIMESTAMP_FORMAT):
+    """Read a csv into a dataframe, parsing first column as dates (or with the
+    table's column types when use_table_schema is set)"""
+    if use_table_schema:
+        # Schema is fetched once per table and reused by later calls
+        columns = fetch_table_schema(query_client, adx_db_name, adx_table_name)
+        try:
+            return read_csv_with_schema(csv_filename, columns, timestamp_format)
+        except ValueError:
+            # The table may have changed since its schema was cached, parse again with a fresh one
+            fetch_table_schema.cache_clear()
+            columns = fetch_table_schema(query_client, adx_db_name, adx_table_name)
+            return read_csv_with_schema(csv_filename, columns, timestamp_format)
+    return pd.read_csv(csv_filename,
+                       sep=',',
+                       header=0,
+                       parse_dates=[0])
+
+def first_date_to_ingest(query_client, adx_db_name, adx_table_name, timestamp_name):
+    """Last timestamp already in the table (None for an empty table)"""
+    last_ingress_date = get_last_ingress_date(query_client,
+                                            adx_db_name,
+                                            adx_table_name,
+                                            timestamp_name)
+    first_date = None
+    if last_ingress_date != None:
+        first_date = pd.to_datetime(last_ingress_date, utc=True)
+    logging.info('Last date in kusto db is {}'.format(first_date))
+    return first_date
+
+def only_new_rows(dataframe, first_date, timestamp_name):
+    """Rows after first_date (compared in UTC), drops rows with NA/None"""
+    if first_date != None:
+        timestamps = pd.to_datetime(dataframe[timestamp_name], utc=True)
+        dataframe = dataframe[timestamps > first_date]
+
+    # Check sizes and drop rows with NA/None
+    print('Dataframe final size before dropna = {}'.format(dataframe.shape))
+    dataframe = dataframe.dropna()
+    print('Dataframe final size after dropna = {}'.format(dataframe.shape))
+    return dataframe
+
+def ingest_csv(csv_filename, adx_cluster, az_region, adx_db_name, adx_table_name, timestamp_name,
+               tracker=None, use_table_schema=False, timestamp_format=DEFAULT_TIMESTAMP_FORMAT,
+               query_client=None, ingest_client=None):
+    """Ingest one csv file into an ADX table, returns the ingestion response
+    (or None if the csv could not be read).  Safe to call many times per process.
+    Pass an IngestionTracker to follow the ingestion through the status queues.
+    With use_table_schema the csv is parsed with the table's column types
+    (see kusto_schema.py) instead of pandas type inference.  query_client and
+    ingest_client replace the cluster clients (e.g. with kusto_simulator.py)."""
     # ADX URLs
-    cluster_ingress_url = f'https://ingest-{args.adx_cluster}.{args.az_region}.kusto.windows.net'
-    cluster_ingress_query_url = f'https://{args.adx_cluster}.{args.az_region}.kusto.windows.net'
+    cluster_ingress_url, cluster_ingress_query_url = kusto_urls(adx_cluster, az_region)
 
     # Authenticate main kusto db
-    client_ingr = authenticate_to_kusto_ingress(cluster_ingress_url)
+    client_ingr = ingest_client or authenticate_to_kusto_ingress(cluster_ingress_url)
 
     # Get last date in sequence in ingress kusto db - use to avoid duplicating data
-    # Logic may be used when reading csv or pulling data from original source
-    # Not used directly in this script, only added as example
-    client_ingr_for_query = authenticate_to_kusto(cluster_ingress_query_url)
-    last_ingress_date = get_last_ingress_date(client_ingr_for_query,
-                                            args.adx_db_name,
-                                            args.adx_table_name,
-                                            args.timestamp_name)
-    first_date = None
-    if last_ingress_date != None:
-        first_date = pd.to_datetime(last_ingress_date)
-    logging.info('Last date in kusto db is {}'.format(first_date))
+    client_ingr_for_query = query_client or authenticate_to_kusto(cluster_ingress_query_url)
+    first_date = first_date_to_ingest(client_ingr_for_query, adx_db_name, adx_table_name, timestamp_name)
 
-    # Example of reading a csv into dataframe, parsing first column as dates
-    # which will populate the index for dataframe.
     try:
-        dataframe_final = pd.read_csv(args.csv_filename,
-                                      sep=',',
-                                      header=0,
-                                      parse_dates=[0])
+        dataframe_final = read_csv_file(csv_filename, client_ingr_for_query, adx_db_name,
+                                        adx_table_name, use_table_schema, timestamp_format)
     except Exception as excp:
         print(f'Exception reading csv file: {excp}')
         return None
 
     # Only ingest new data
-    if first_date != None:
-        dataframe_final = dataframe_final[dataframe_final.index > first_date]
-
-    # Check sizes and drop rows with NA/None
-    print('Dataframe final size before dropna = {}'.format(dataframe_final.shape))
-    dataframe_final.dropna(inplace=True)
-    print('Dataframe final size after dropna = {}'.format(dataframe_final.shape))
+    dataframe_final = only_new_rows(dataframe_final, first_date, timestamp_name)
 
     # Ingress to Kusto db...
     resp = ingress_kusto(dataframe_final,
-                         args.adx_db_name,
-                         args.adx_table_name,
-                         client_ingr)
+                         adx_db_name,
+                         adx_table_name,
+                         client_ingr,
+                         tracker)
+    if resp is None and use_table_schema:
+        # Refetch the schema next time in case the table changed
+        fetch_table_schema.cache_clear()
 
     print(resp)
     return resp
 
+def discover_csv_files(pattern):
+    """csv files of a file, directory or glob pattern, oldest (modification time) first"""
+    if os.path.isdir(pattern):
+        files = glob.glob(os.path.join(pattern, '*.csv'))
+    elif glob.has_magic(pattern):
+        files = glob.glob(pattern, recursive=True)
+    else:
+        files = [pattern]
+    return sorted((f for f in files if os.path.isfile(f)), key=lambda f: (os.path.getmtime(f), f))
+
+def coalesce_files(files, batch_bytes):
+    """Group consecutive files until a group reaches batch_bytes, so small files
+    are ingested together instead of as many tiny ingestions"""
+    batches, batch, size = [], [], 0
+    for filename in files:
+        batch.append(filename)
+        size += os.path.getsize(filename)
+        if size >= batch_bytes:
+            batches.append(batch)
+            batch, size = [], 0
+    if batch:
+        batches.append(batch)
+    return batches
+
+class IngestState:
+    """Per-file completion recorded in a json file, written atomically after
+    every batch, so a rerun skips files that were already ingested (unless they
+    changed since)"""
+
+    def __init__(self, state_file):
+        self.state_file = state_file
+        self.lock = threading.Lock()
+        self.files = {}
+        if state_file and os.path.exists(state_file):
+            with open(state_file) as f:
+                self.files = json.load(f)['files']
+
+    @staticmethod
+    def fingerprint(filename):
+        stat = os.stat(filename)
+        return {'size': stat.st_size, 'mtime': stat.st_mtime}
+
+    def is_done(self, filename):
+        entry = self.files.get(os.path.abspath(filename))
+        return entry is not None and all(entry[k] == v for k, v in self.fingerprint(filename).items())
+
+    def record(self, filenames, status, source_id=None):
+        with self.lock:
+            for filename in filenames:
+                self.files[os.path.abspath(filename)] = dict(self.fingerprint(filename), status=status,
+                                                             source_id=source_id, time=time.time())
+            self.save()
+
+    def forget(self, filenames):
+        with self.lock:
+            for filename in filenames:
+                self.files.pop(os.path.abspath(filename), None)
+            self.save()
+
+    def save(self):
+        if not self.state_file:
+            return
+        tmp = self.state_file + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump({'files': self.files}, f, indent=2)
+        os.replace(tmp, self.state_file)
+
+def ingest_files(pattern, adx_cluster, az_region, adx_db_name, adx_table_name, timestamp_name,
+                 workers=4, state_file=None, batch_mb=64, tracker=None, use_table_schema=False,
+                 timestamp_format=DEFAULT_TIMESTAMP_FORMAT, query_client=None, ingest_client=None,
+                 status_timeout=600):
+    """Ingest every csv of a directory or glob, oldest first, on a pool of workers
+    sharing one set of clients.  Files smaller than batch_mb are coalesced into
+    one ingestion.  Returns {'queued': [...], 'failed': [...], 'skipped': [...]}"""
+    cluster_ingress_url, cluster_ingress_query_url = kusto_urls(adx_cluster, az_region)
+    client_ingr = ingest_client or authenticate_to_kusto_ingress(cluster_ingress_url)
+    client_ingr_for_query = query_client or authenticate_to_kusto(cluster_ingress_query_url)
+
+    state = IngestState(state_file)
+    files = discover_csv_files(pattern)
+    skipped = [f for f in files if state.is_done(f)]
+    batches = coalesce_files([f for f in files if not state.is_done(f)], batch_mb * 2**20)
+    logging.info('{} files, {} already ingested, {} batches to ingest'.format(
+        len(files), len(skipped), len(batches)))
+
+    # Query the last date once, every batch filters against it
+    first_date = first_date_to_ingest(client_ingr_for_query, adx_db_name, adx_table_name, timestamp_name)
+
+    def ingest_batch(batch):
+        dataframe = pd.concat([read_csv_file(f, client_ingr_for_query, adx_db_name, adx_table_name,
+                                             use_table_schema, timestamp_format) for f in batch],
+                              ignore_index=True)
+        dataframe = only_new_rows(dataframe, first_date, timestamp_name)
+        if dataframe.empty:
+            return 'empty'
+        return ingress_kusto(dataframe, adx_db_name, adx_table_name, client_ingr, tracker)
+
+    result = {'queued': [], 'failed': [], 'skipped': skipped}
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(ingest_batch, batch): batch for batch in batches}
+        for future in as_completed(futures):
+            batch = futures[future]
+            try:
+                resp = future.result()
+            except Exception as excp:
+                print(f'Exception ingesting {batch}: {excp}')
+                resp = None
+            if resp is None:
+                result['failed'].extend(batch)
+                continue
+            source_id = getattr(resp, 'source_id', None)
+            state.record(batch, 'empty' if resp == 'empty' else 'queued',
+                         str(source_id) if source_id else None)
+            result['queued'].extend(batch)
+
+    if tracker is not None:
+        # Forget files whose ingestion failed so the next run retries them.  Ingestions
+        # still pending after status_timeout stay recorded as queued, dropping them would
+        # ingest their rows twice once the service completes them.
+        tracker.wait(timeout=status_timeout)
+        failed = set()
+        for filename, entry in list(state.files.items()):
+            batch = tracker.batches.get(entry.get('source_id'))
+            if batch is None:
+                continue
+            if batch.status == 'Succeeded':
+                state.files[filename]['status'] = 'succeeded'
+            elif batch.status == 'Failed':
+                state.files.pop(filename)
+                failed.add(filename)
+        state.save()
+        result['failed'].extend(f for f in result['queued'] if os.path.abspath(f) in failed)
+        result['queued'] = [f for f in result['queued'] if os.path.abspath(f) not in failed]
+    if result['failed'] and use_table_schema:
+        # Refetch the schema next time in case the table changed
+        fetch_table_schema.cache_clear()
+    return result
+
+def main(args):
+    query_client = ingest_client = status_queues = None
+    if args.simulator:
+        # Local SQLite stand-in for the cluster, see kusto_simulator.py
+        from kusto_simulator import KustoSimulator
+        store = KustoSimulator(args.simulator)
+        query_client, ingest_client = store.query_client(), store.ingest_client()
+        status_queues = store.status_queues
+
+    tracker = None
+    if args.track:
+        ingest_url, _ = kusto_urls(args.adx_cluster, args.az_region)
+        tracker = IngestionTracker(ingest_client or get_ingest_client(ingest_url), status_queues)
+
+    if os.path.isdir(args.csv_filename) or glob.has_magic(args.csv_filename):
+        resp = ingest_files(args.csv_filename, args.adx_cluster, args.az_region,
+                            args.adx_db_name, args.adx_table_name, args.timestamp_name,
+                            args.workers, args.state_file, args.batch_mb, tracker,
+                            args.use_table_schema, args.timestamp_format,
+                            query_client, ingest_client, args.status_timeout)
+        print(json.dumps({k: len(v) for k, v in resp.items()}))
+        if tracker is not None:
+            print(json.dumps(tracker.summary(), indent=4))
+        return resp
+
+    resp = ingest_csv(args.csv_filename, args.adx_cluster, args.az_region,
+                      args.adx_db_name, args.adx_table_name, args.timestamp_name,
+                      tracker, args.use_table_schema, args.timestamp_format,
+                      query_client, ingest_client)
+    if tracker is not None:
+        tracker.wait(timeout=args.status_timeout)
+        print(json.dumps(tracker.summary(), indent=4))
+    return resp
+
 if __name__ == '__main__':
     """Main"""
     # For command line options
@@ -197,7 +406,7 @@ if __name__ == '__main__':
 
     parser.add_argument(
         '--csv', type=str, dest='csv_filename',
-        help='CSV timeseries file', required=True
+        help='CSV timeseries file, or a directory or (quoted) glob of csv files', required=True
     )
     parser.add_argument(
         '--cluster', type=str, dest='adx_cluster',
@@ -220,5 +429,38 @@ if __name__ == '__main__':
         help='Name of timestamp column (case sensitive)', required=True
     )
 
+    parser.add_argument(
+        '--track', action='store_true',
+        help='Report ingestion status and wait for it (rows/s, bytes/s, queue latency)'
+    )
+    parser.add_argument(
+        '--status-timeout', type=int, dest='status_timeout', default=600,
+        help='Seconds to wait for the ingestion status with --track'
+    )
+    parser.add_argument(
+        '--use-table-schema', action='store_true', dest='use_table_schema',
+        help='Parse the csv with the column types of the target table (pyarrow)'
+    )
+    parser.add_argument(
+        '--timestamp-format', type=str, dest='timestamp_format', default=DEFAULT_TIMESTAMP_FORMAT,
+        help='strptime format of datetime columns with --use-table-schema'
+    )
+    parser.add_argument(
+        '--workers', type=int, default=4,
+        help='Concurrent ingestions for a directory or glob'
+    )
+    parser.add_argument(
+        '--state-file', type=str, dest='state_file', default='ingest_state.json',
+        help='Json file recording ingested files, so reruns skip them'
+    )
+    parser.add_argument(
+        '--batch-mb', type=float, dest='batch_mb', default=64,
+        help='Small files are combined into ingestions of about this size'
+    )
+    parser.add_argument(
+        '--simulator', type=str, default=None,
+        help='SQLite file of a local simulated cluster (kusto_simulator.py) to use instead of ADX'
+    )
+
     args = parser.parse_args()
     main(args)
@@ -0,0 +1,85 @@
+"""
+Schema-aware csv parsing for Kusto/ADX ingestion.
+
+Fetches the target table schema once (`.show table T cslschema`), maps the
+Kusto column types to pyarrow types and parses the csv with pyarrow using
+those types and a fixed timestamp format, instead of letting pandas infer
+every column.  Columns are matched to the table by position (as Kusto csv
+ingestion does) and renamed to the table's column names.  A value that does
+not fit its column type fails the parse instead of being ingested wrongly.
+
+To run you will need to pip install the following Python packages:
+
+pandas>=2.0.0
+pyarrow>=12.0.0
+"""
+from functools import lru_cache
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pv
+
+# Kusto scalar type -> pyarrow type.  timespan, guid and dynamic stay strings
+# (Kusto parses their text on ingestion), decimal is read as float64.
+KUSTO_TO_ARROW = {
+    'bool': pa.bool_(),
+    'boolean': pa.bool_(),
+    'datetime': pa.timestamp('ns', tz='UTC'),
+    'date': pa.timestamp('ns', tz='UTC'),
+    'int': pa.int32(),
+    'long': pa.int64(),
+    'real': pa.float64(),
+    'double': pa.float64(),
+    'decimal': pa.float64(),
+    'string': pa.string(),
+    'guid': pa.string(),
+    'uuid': pa.string(),
+    'timespan': pa.string(),
+    'time': pa.string(),
+    'dynamic': pa.string(),
+}
+
+# ISO 8601 with a UTC offset, e.g. 2022-01-05T00:05:09+01:00
+DEFAULT_TIMESTAMP_FORMAT = '%Y-%m-%dT%H:%M:%S%z'
+
+
+def parse_cslschema(cslschema):
+    """'timestamp:datetime,id:int' -> [('timestamp', 'datetime'), ('id', 'int')]"""
+    columns = []
+    for column in cslschema.split(','):
+        name, kusto_type = column.strip().rsplit(':', 1)
+        # Names that need quoting come back as ['name'] or ["name"]
+        name = name.strip()
+        if name.startswith('[') and name.endswith(']'):
+            name = name[2:-2]
+        columns.append((name, kusto_type.strip().lower()))
+    return columns
+
+
+@lru_cache(maxsize=None)
+def fetch_table_schema(client, adx_db_name, adx_table_name):
+    """[(column name, kusto type)] of a table, queried once per client and table.
+    Call fetch_table_schema.cache_clear() after the table changes (ingress_to_kusto.py
+    does on a failed parse or ingestion)"""
+    response = client.execute_mgmt(adx_db_name, '.show table {} cslschema'.format(adx_table_name))
+    return parse_cslschema(response.primary_results[0][0]['Schema'])
+
+
+def arrow_schema(columns):
+    """pyarrow schema for [(column name, kusto type)]"""
+    try:
+        return pa.schema([(name, KUSTO_TO_ARROW[kusto_type]) for name, kusto_type in columns])
+    except KeyError as err:
+        raise ValueError('No pyarrow type for Kusto type {}'.format(err))
+
+
+def read_csv_with_schema(csv_filename, columns, timestamp_format=DEFAULT_TIMESTAMP_FORMAT,
+                         header=True):
+    """Parse a csv into a pyarrow-backed DataFrame with the table's column types"""
+    schema = arrow_schema(columns)
+    table = pv.read_csv(
+        csv_filename,
+        read_options=pv.ReadOptions(column_names=schema.names, skip_rows=1 if header else 0),
+        convert_options=pv.ConvertOptions(column_types=schema,
+                                          timestamp_parsers=[timestamp_format] if timestamp_format else None))
+    return table.to_pandas(types_mapper=pd.ArrowDtype)
@@ -0,0 +1,102 @@
+"""
+Parse time and memory of a large synthetic csv read the default way
+(pd.read_csv with parse_dates=[0] and type inference, as in
+ingress_to_kusto.py) against schema-aware parsing with kusto_schema.py.
+Each parse runs in a fresh process so peak RSS (Linux /proc) is measured
+per method.
+No Kusto cluster is needed, the schema is given with --schema.
+
+usage: kusto_schema_benchmark.py --rows 2000000 --string-columns 4 --numeric-columns 16
+"""
+import argparse
+import multiprocessing
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+from kusto_schema import DEFAULT_TIMESTAMP_FORMAT, parse_cslschema, read_csv_with_schema
+
+
+def write_csv(csv_filename, rows, string_columns, numeric_columns, chunk_rows=500000):
+    """Write a csv like sample_data/kusto_test.csv, returns its cslschema"""
+    rng = np.random.default_rng(0)
+    names = np.array(['abc', 'cde', 'fgh', 'ijk', 'lmn', 'opq'])
+    start = pd.Timestamp('2022-01-05T00:00:00+01:00')
+    for offset in range(0, rows, chunk_rows):
+        n = min(chunk_rows, rows - offset)
+        columns = {'timestamp': (start + pd.to_timedelta(np.arange(offset, offset + n), unit='s'))
+                   .strftime('%Y-%m-%dT%H:%M:%S%z').str.replace(r'(\d\d)(\d\d)$', r'\1:\2', regex=True),
+                   'id': np.arange(offset, offset + n)}
+        for i in range(string_columns):
+            columns['name{}'.format(i)] = names[rng.integers(len(names), size=n)]
+        for i in range(numeric_columns):
+            columns['value{}'.format(i)] = rng.normal(50, 20, size=n).round(2)
+        pd.DataFrame(columns).to_csv(csv_filename, mode='w' if offset == 0 else 'a',
+                                     header=offset == 0, index=False)
+    return ','.join(['timestamp:datetime', 'id:long'] +
+                    ['name{}:string'.format(i) for i in range(string_columns)] +
+                    ['value{}:real'.format(i) for i in range(numeric_columns)])
+
+
+def peak_rss_mb():
+    """High-water RSS of this process (VmHWM, unlike ru_maxrss not inherited across fork/exec)"""
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith('VmHWM:'):
+                return int(line.split()[1]) / 1024
+
+
+def parse(method, csv_filename, cslschema, timestamp_format, results):
+    baseline = peak_rss_mb()
+    t0 = time.perf_counter()
+    if method == 'inferred':
+        dataframe = pd.read_csv(csv_filename, sep=',', header=0, parse_dates=[0])
+    else:
+        dataframe = read_csv_with_schema(csv_filename, parse_cslschema(cslschema), timestamp_format)
+    seconds = time.perf_counter() - t0
+    peak = peak_rss_mb() - baseline
+    results.put((seconds, peak, dataframe.memory_usage(deep=True).sum() / 2**20,
+                 str(dataframe.dtypes.iloc[0])))
+
+
+def main(args):
+    if not os.path.exists(args.csv_filename) or args.overwrite:
+        print('Writing {} rows to {}'.format(args.rows, args.csv_filename))
+        cslschema = write_csv(args.csv_filename, args.rows, args.string_columns, args.numeric_columns)
+    else:
+        cslschema = args.schema
+    if not cslschema:
+        raise SystemExit('--schema is required for an existing csv')
+    print('File size: {:.1f} MB'.format(os.path.getsize(args.csv_filename) / 2**20))
+
+    ctx = multiprocessing.get_context('spawn')
+    print('{:<10} {:>10} {:>14} {:>14}  {}'.format('method', 'seconds', 'peak RSS MB', 'frame MB', 'first column dtype'))
+    for method in ('inferred', 'schema'):
+        results = ctx.Queue()
+        process = ctx.Process(target=parse, args=(method, args.csv_filename, cslschema,
+                                                  args.timestamp_format, results))
+        process.start()
+        seconds, peak, frame, dtype = results.get()
+        process.join()
+        print('{:<10} {:>10.2f} {:>14.1f} {:>14.1f}  {}'.format(method, seconds, peak, frame, dtype))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--csv', type=str, dest='csv_filename', default='kusto_schema_benchmark.csv',
+                        help='Csv file, written first if it does not exist')
+    parser.add_argument('--overwrite', action='store_true', help='Rewrite the csv even if it exists')
+    parser.add_argument('--rows', type=int, default=2000000, help='Rows of the synthetic csv')
+    parser.add_argument('--string-columns', type=int, dest='string_columns', default=4,
+                        help='String columns of the synthetic csv')
+    parser.add_argument('--numeric-columns', type=int, dest='numeric_columns', default=16,
+                        help='Real columns of the synthetic csv')
+    parser.add_argument('--schema', type=str, default=None,
+                        help='cslschema of an existing csv, e.g. timestamp:datetime,id:int,name:string,value:real')
+    parser.add_argument('--timestamp-format', type=str, dest='timestamp_format',
+                        default=DEFAULT_TIMESTAMP_FORMAT, help='strptime format of datetime columns')
+
+    args = parser.parse_args()
+    main(args)
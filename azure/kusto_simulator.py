@@ -0,0 +1,393 @@
+"""
+Local stand-in for a Kusto/ADX cluster, backed by SQLite, for running and
+load-testing ingress_to_kusto.py without a cluster (e.g. in CI).
+
+It implements the client surfaces used by the scripts in this folder:
+- SimulatedKustoClient.execute(db, query) and execute_mgmt(db, command) for
+  queries of the form `T | order by C desc | limit N` (also `sort by`,
+  `take`, `count`) and the `.create table`, `.drop table` and
+  `.show table T cslschema` commands.  Responses have `primary_results`
+  tables built like the SDK's from a v1 response table, so they are real
+  KustoResultTables (dataframe_from_result_table checks the type) when
+  azure-kusto-data is installed, and SimulatedResultTables with the same
+  `columns`, `raw_rows` and rows indexable by position or name otherwise.
+- SimulatedIngestClient.ingest_from_dataframe/file/stream/blob,
+  queued like QueuedIngestClient: the call returns once the data is written
+  (dataframes are serialized to a gzipped csv as the SDK does) and a
+  background thread ingests it into SQLite after `ingestion_delay` seconds.
+  Success/failure messages go to `status_queues`, a local fake of
+  KustoIngestStatusQueues honouring the ingestion properties' report level.
+
+Csv data is matched to the table's columns by position and values that do
+not parse become nulls, as in Kusto.  Datetimes are stored as integer
+microseconds since the epoch (cheap to convert and sortable) and returned as
+ISO 8601 UTC strings, as in Kusto query results.
+
+No Azure packages are needed for this module itself.
+
+Example:
+
+    store = KustoSimulator('sim.db')
+    client, ingest_client = store.query_client(), store.ingest_client()
+    client.execute_mgmt('db', ".create table T (timestamp:datetime, value:real)")
+"""
+import gzip
+import io
+import os
+import queue
+import re
+import sqlite3
+import tempfile
+import threading
+import time
+import urllib.request
+import uuid
+from datetime import datetime, timezone
+from types import SimpleNamespace
+
+import pandas as pd
+
+from kusto_schema import parse_cslschema
+
+# Kusto type -> SQLite column type
+SQLITE_TYPES = {
+    'bool': 'INTEGER', 'boolean': 'INTEGER', 'int': 'INTEGER', 'long': 'INTEGER',
+    'real': 'REAL', 'double': 'REAL', 'decimal': 'REAL',
+    'datetime': 'INTEGER', 'date': 'INTEGER',
+}
+
+CREATE_TABLE = re.compile(r"^\.create(?:-merge)?\s+table\s+\[?'?([\w.-]+)'?\]?\s*\((.*)\)\s*$", re.S | re.I)
+DROP_TABLE = re.compile(r"^\.drop\s+table\s+\[?'?([\w.-]+)'?\]?(\s+ifexists)?\s*$", re.I)
+SHOW_SCHEMA = re.compile(r"^\.show\s+table\s+\[?'?([\w.-]+)'?\]?\s+cslschema\s*$", re.I)
+ORDER_BY = re.compile(r"^(?:order|sort)\s+by\s+\[?'?(\w+)'?\]?(?:\s+(asc|desc))?$", re.I)
+LIMIT = re.compile(r"^(?:limit|take)\s+(\d+)$", re.I)
+
+
+class KustoSimulatorError(Exception):
+    """Unsupported query or command, or a missing table"""
+
+
+class SimulatedResultRow(list):
+    """Row indexable by position or column name, like KustoResultRow"""
+
+    def __init__(self, columns, values):
+        super().__init__(values)
+        self._names = {column.column_name: i for i, column in enumerate(columns)}
+
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            key = self._names[key]
+        return super().__getitem__(key)
+
+
+class SimulatedResultTable:
+    """The parts of KustoResultTable used by the scripts, without azure-kusto-data"""
+
+    def __init__(self, columns, raw_rows):
+        self.columns = [SimpleNamespace(column_name=name, column_type=kusto_type)
+                        for name, kusto_type in columns]
+        self.raw_rows = [list(row) for row in raw_rows]
+        self.rows = [SimulatedResultRow(self.columns, row) for row in self.raw_rows]
+        self.rows_count = len(self.rows)
+        self.columns_count = len(self.columns)
+
+    def __len__(self):
+        return self.rows_count
+
+    def __iter__(self):
+        return iter(self.rows)
+
+    def __getitem__(self, index):
+        return self.rows[index]
+
+
+class SimulatedStatusQueue:
+    """Thread-safe stand-in for a status queue of KustoIngestStatusQueues"""
+
+    def __init__(self):
+        self.messages = []
+        self.lock = threading.Lock()
+
+    def put(self, message):
+        with self.lock:
+            self.messages.append(message)
+
+    def pop(self, n=1):
+        with self.lock:
+            popped, self.messages = self.messages[:n], self.messages[n:]
+        return popped
+
+    def peek(self, n=1):
+        with self.lock:
+            return self.messages[:n]
+
+    def is_empty(self):
+        with self.lock:
+            return not self.messages
+
+
+class KustoSimulator:
+    """SQLite store shared by the simulated query and ingest clients.  Tables of
+    different databases are kept apart as "<db>.<table>" SQLite tables."""
+
+    def __init__(self, path=':memory:', ingestion_delay=0.0):
+        self.path = path
+        self.ingestion_delay = ingestion_delay
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=OFF')
+        self.connection.execute('CREATE TABLE IF NOT EXISTS _kusto_schemas '
+                                '(db TEXT, name TEXT, cslschema TEXT, PRIMARY KEY (db, name))')
+        self.lock = threading.Lock()
+        self.status_queues = SimpleNamespace(success=SimulatedStatusQueue(),
+                                             failure=SimulatedStatusQueue())
+
+    def query_client(self):
+        return SimulatedKustoClient(self)
+
+    def ingest_client(self):
+        return SimulatedIngestClient(self)
+
+    def schema(self, db, table):
+        """[(column name, kusto type)] of a table"""
+        with self.lock:
+            row = self.connection.execute('SELECT cslschema FROM _kusto_schemas WHERE db=? AND name=?',
+                                          (db, table)).fetchone()
+        if row is None:
+            raise KustoSimulatorError("Table '{}' not found in database '{}'".format(table, db))
+        return parse_cslschema(row[0])
+
+    def create_table(self, db, table, columns):
+        sql_columns = ', '.join('"{}" {}'.format(name, SQLITE_TYPES.get(kusto_type, 'TEXT'))
+                                for name, kusto_type in columns)
+        cslschema = ','.join('{}:{}'.format(name, kusto_type) for name, kusto_type in columns)
+        with self.lock, self.connection:
+            self.connection.execute('CREATE TABLE IF NOT EXISTS "{}.{}" ({})'.format(db, table, sql_columns))
+            self.connection.execute('INSERT OR REPLACE INTO _kusto_schemas VALUES (?, ?, ?)',
+                                    (db, table, cslschema))
+
+    def drop_table(self, db, table):
+        with self.lock, self.connection:
+            self.connection.execute('DROP TABLE IF EXISTS "{}.{}"'.format(db, table))
+            self.connection.execute('DELETE FROM _kusto_schemas WHERE db=? AND name=?', (db, table))
+
+    def select(self, sql, params=()):
+        with self.lock:
+            return self.connection.execute(sql, params).fetchall()
+
+    def insert(self, db, table, dataframe):
+        """Append a dataframe already converted to the table's columns, returns rows inserted"""
+        placeholders = ', '.join('?' * dataframe.shape[1])
+        # Column-wise to Python values (None for nulls), then rows
+        rows = zip(*[column.astype(object).where(column.notna(), None).tolist()
+                     for _, column in dataframe.items()])
+        with self.lock, self.connection:
+            cursor = self.connection.executemany(
+                'INSERT INTO "{}.{}" VALUES ({})'.format(db, table, placeholders), rows)
+        return cursor.rowcount
+
+
+def to_table_columns(dataframe, columns):
+    """Positional csv columns -> the table's columns and storage types (bad values become null)"""
+    converted = {}
+    for i, (name, kusto_type) in enumerate(columns):
+        values = dataframe.iloc[:, i]
+        if kusto_type in ('datetime', 'date'):
+            values = pd.to_datetime(values, errors='coerce', utc=True, format='ISO8601')
+            values = values.astype('datetime64[us, UTC]').astype('int64').where(values.notna())
+        elif kusto_type in ('int', 'long'):
+            values = pd.to_numeric(values, errors='coerce').astype('Int64')
+        elif kusto_type in ('real', 'double', 'decimal'):
+            values = pd.to_numeric(values, errors='coerce')
+        elif kusto_type in ('bool', 'boolean'):
+            values = values.astype(str).str.lower().map({'true': 1, 'false': 0, '1': 1, '0': 0})
+        else:
+            values = values.astype('string')
+        converted[name] = values
+    return pd.DataFrame(converted)
+
+
+def from_storage(row, columns):
+    """Stored values -> the values Kusto returns (bools, ISO 8601 datetimes)"""
+    values = list(row)
+    for i, (_, kusto_type) in enumerate(columns):
+        if values[i] is None:
+            continue
+        if kusto_type in ('bool', 'boolean'):
+            values[i] = bool(values[i])
+        elif kusto_type in ('datetime', 'date'):
+            values[i] = pd.Timestamp(values[i], unit='us', tz='UTC').strftime('%Y-%m-%dT%H:%M:%S.%fZ')
+    return values
+
+
+class SimulatedKustoClient:
+    """KustoClient.execute/execute_query/execute_mgmt against a KustoSimulator"""
+
+    def __init__(self, store):
+        self.store = store
+
+    def execute(self, database, query, properties=None):
+        if query.strip().startswith('.'):
+            return self.execute_mgmt(database, query, properties)
+        return self.execute_query(database, query, properties)
+
+    def execute_mgmt(self, database, command, properties=None):
+        command = command.strip()
+        match = SHOW_SCHEMA.match(command)
+        if match:
+            table = match.group(1)
+            cslschema = ','.join('{}:{}'.format(*column) for column in self.store.schema(database, table))
+            return self._response([('TableName', 'string'), ('Schema', 'string'), ('DatabaseName', 'string'),
+                                   ('Folder', 'string'), ('DocString', 'string')],
+                                  [[table, cslschema, database, None, None]])
+        match = CREATE_TABLE.match(command)
+        if match:
+            columns = parse_cslschema(match.group(2))
+            self.store.create_table(database, match.group(1), columns)
+            return self._response([('TableName', 'string'), ('Schema', 'string')],
+                                  [[match.group(1), match.group(2)]])
+        match = DROP_TABLE.match(command)
+        if match:
+            self.store.drop_table(database, match.group(1))
+            return self._response([('TableName', 'string')], [[match.group(1)]])
+        raise KustoSimulatorError('Unsupported command: {}'.format(command))
+
+    def execute_query(self, database, query, properties=None):
+        """`T | order by C [asc|desc] | limit N` style queries, plus `| count`"""
+        parts = [part.strip() for part in query.strip().split('|')]
+        table = parts[0].strip("[]'\" ")
+        columns = self.store.schema(database, table)
+        sql, order, limit = 'SELECT * FROM "{}.{}"'.format(database, table), '', ''
+        for part in parts[1:]:
+            order_match, limit_match = ORDER_BY.match(part), LIMIT.match(part)
+            if order_match:
+                # Kusto sorts descending by default
+                order = ' ORDER BY "{}" {} NULLS LAST'.format(order_match.group(1),
+                                                            (order_match.group(2) or 'desc').upper())
+            elif limit_match:
+                limit = ' LIMIT {}'.format(int(limit_match.group(1)))
+            elif part.lower() == 'count':
+                count = self.store.select('SELECT COUNT(*) FROM ({}{}{})'.format(sql, order, limit))
+                return self._response([('Count', 'long')], count)
+            else:
+                raise KustoSimulatorError('Unsupported query operator: {}'.format(part))
+        rows = self.store.select(sql + order + limit)
+        return self._response(columns, [from_storage(row, columns) for row in rows])
+
+    @staticmethod
+    def _response(columns, rows):
+        try:
+            from azure.kusto.data._models import KustoResultTable
+        except ImportError:
+            return SimpleNamespace(primary_results=[SimulatedResultTable(columns, rows)])
+        table = KustoResultTable({'TableName': 'PrimaryResult', 'TableKind': 'PrimaryResult',
+                                  'Columns': [{'ColumnName': name, 'ColumnType': kusto_type}
+                                              for name, kusto_type in columns],
+                                  'Rows': [list(row) for row in rows]})
+        return SimpleNamespace(primary_results=[table])
+
+    def close(self):
+        pass
+
+
+class SimulatedIngestClient:
+    """QueuedIngestClient surface against a KustoSimulator, ingesting on a background thread"""
+
+    def __init__(self, store):
+        self.store = store
+        self.status_queues = store.status_queues
+        self.pending = queue.Queue()
+        self.worker = threading.Thread(target=self._ingest_loop, daemon=True)
+        self.worker.start()
+
+    def ingest_from_dataframe(self, df, ingestion_properties):
+        # Like the SDK: write a gzipped csv without header, then ingest the file
+        fd, path = tempfile.mkstemp(suffix='.csv.gz')
+        os.close(fd)
+        df.to_csv(path, index=False, header=False, compression='gzip')
+        return self._queue(path, ingestion_properties, source_id=None, delete=True)
+
+    def ingest_from_file(self, file_descriptor, ingestion_properties):
+        # Read during the call, as the SDK uploads the file before returning
+        path = getattr(file_descriptor, 'path', file_descriptor)
+        with open(path, 'rb') as f:
+            data = io.BytesIO(f.read())
+        return self._queue(data, ingestion_properties, getattr(file_descriptor, 'source_id', None))
+
+    def ingest_from_stream(self, stream_descriptor, ingestion_properties):
+        stream = getattr(stream_descriptor, 'stream', stream_descriptor)
+        data = stream.read()
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        return self._queue(io.BytesIO(data), ingestion_properties,
+                           getattr(stream_descriptor, 'source_id', None))
+
+    def ingest_from_blob(self, blob_descriptor, ingestion_properties):
+        """Like the service, the blob is fetched at ingestion time (http(s) urls
+        with a SAS token, e.g. from Azurite, or file:// urls)"""
+        uri = getattr(blob_descriptor, 'path', blob_descriptor)
+        return self._queue(uri, ingestion_properties, getattr(blob_descriptor, 'source_id', None))
+
+    def _queue(self, source, ingestion_properties, source_id, delete=False):
+        source_id = source_id or uuid.uuid4()
+        self.pending.put((source, ingestion_properties, source_id, delete, time.time()))
+        return SimpleNamespace(status='Queued', database=ingestion_properties.database,
+                               table=ingestion_properties.table, source_id=source_id,
+                               blob_uri='sqlite://{}'.format(self.store.path))
+
+    def flush(self):
+        """Block until everything queued so far has been ingested"""
+        self.pending.join()
+
+    def _ingest_loop(self):
+        while True:
+            source, properties, source_id, delete, queued_at = self.pending.get()
+            try:
+                time.sleep(max(queued_at + self.store.ingestion_delay - time.time(), 0))
+                self._ingest(source, properties, source_id)
+            finally:
+                if delete:
+                    os.remove(source)
+                self.pending.task_done()
+
+    def _ingest(self, source, properties, source_id):
+        database, table = properties.database, properties.table
+        try:
+            columns = self.store.schema(database, table)
+            if isinstance(source, str) and source.startswith(('http://', 'https://', 'file://')):
+                with urllib.request.urlopen(source) as response:
+                    source = io.BytesIO(response.read())
+            compression = 'gzip' if isinstance(source, str) and source.endswith('.gz') else 'infer'
+            if not isinstance(source, str) and source.getvalue()[:2] == b'\x1f\x8b':
+                source = io.BytesIO(gzip.decompress(source.getvalue()))
+            dataframe = pd.read_csv(source, header=None, dtype=str, keep_default_na=False,
+                                    na_values=[''], compression=compression,
+                                    skiprows=1 if getattr(properties, 'ignore_first_record', False) else 0)
+            if dataframe.shape[1] != len(columns):
+                raise KustoSimulatorError('Stream_InputStreamColumnsMismatch: {} columns, table has {}'.format(
+                    dataframe.shape[1], len(columns)))
+            self.store.insert(database, table, to_table_columns(dataframe, columns))
+        except Exception as err:
+            self._report(properties, 'failure', source_id, error=err)
+        else:
+            self._report(properties, 'success', source_id)
+
+    def _report(self, properties, outcome, source_id, error=None):
+        level = getattr(getattr(properties, 'report_level', None), 'name', 'FailuresOnly')
+        if level == 'DoNotReport' or (outcome == 'success' and level != 'FailuresAndSuccesses'):
+            return
+        now = datetime.now(timezone.utc).isoformat()
+        message = SimpleNamespace(IngestionSourceId=str(source_id), Database=properties.database,
+                                  Table=properties.table, IngestionSourcePath=str(source_id))
+        if outcome == 'success':
+            message.SucceededOn = now
+            self.status_queues.success.put(message)
+        else:
+            message.FailedOn = now
+            message.Details = str(error)
+            message.ErrorCode = type(error).__name__
+            message.FailureStatus = 'Permanent'
+            self.status_queues.failure.put(message)
+
+    def close(self):
+        self.flush()
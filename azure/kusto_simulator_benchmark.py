@@ -0,0 +1,94 @@
+"""
+Load test of the ingress_to_kusto.py client pipeline against the local
+SQLite cluster simulator (kusto_simulator.py), no ADX cluster needed.
+
+Synthetic time series batches are pushed through ingress_kusto (the same
+IngestionProperties and ingest_from_dataframe calls as against ADX) until
+--gb of csv data was submitted.  Reports client-side submit throughput,
+end-to-end throughput and queue latency from the IngestionTracker, and
+checks the data with get_last_ingress_date and a count query.
+
+usage: kusto_simulator_benchmark.py --gb 2 --batch-mb 64 --db-path /tmp/kusto_sim.db
+
+Needs the packages listed in ingress_to_kusto.py (the SDK's IngestionProperties
+are used), but no credentials.
+"""
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+from ingestion_tracker import IngestionTracker
+from ingress_to_kusto import get_last_ingress_date, ingress_kusto, query_kusto
+from kusto_simulator import KustoSimulator
+
+TABLE_SCHEMA = '(timestamp:datetime, id:long, name:string, value:real)'
+
+
+def synthetic_batch(start_row, rows, rng):
+    return pd.DataFrame({
+        'timestamp': pd.Timestamp('2022-01-05', tz='UTC') + pd.to_timedelta(
+            np.arange(start_row, start_row + rows), unit='s'),
+        'id': np.arange(start_row, start_row + rows),
+        'name': rng.choice(['abc', 'cde', 'fgh'], size=rows),
+        'value': rng.normal(50, 20, size=rows).round(3),
+    })
+
+
+def main(args):
+    if os.path.exists(args.db_path):
+        os.remove(args.db_path)
+    store = KustoSimulator(args.db_path, ingestion_delay=args.ingestion_delay)
+    query_client, ingest_client = store.query_client(), store.ingest_client()
+    query_client.execute_mgmt(args.db, '.create table {} {}'.format(args.table, TABLE_SCHEMA))
+    tracker = IngestionTracker(ingest_client, store.status_queues)
+
+    rng = np.random.default_rng(0)
+    # Size batches from the csv size of a sample row block
+    sample = synthetic_batch(0, 10000, rng)
+    bytes_per_row = len(sample.to_csv(index=False, header=False)) / len(sample)
+    batch_rows = int(args.batch_mb * 2**20 / bytes_per_row)
+    total_rows = int(args.gb * 2**30 / bytes_per_row)
+    print('{} rows in batches of {} (~{:.0f} bytes/row as csv)'.format(total_rows, batch_rows, bytes_per_row))
+
+    submit_seconds, t0 = 0, time.time()
+    for start_row in range(0, total_rows, batch_rows):
+        batch = synthetic_batch(start_row, min(batch_rows, total_rows - start_row), rng)
+        t1 = time.time()
+        ingress_kusto(batch, args.db, args.table, ingest_client, tracker)
+        submit_seconds += time.time() - t1
+    tracker.wait(timeout=args.status_timeout, interval=0.5)
+    elapsed = time.time() - t0
+
+    summary = tracker.summary()
+    csv_mb = total_rows * bytes_per_row / 2**20
+    print('Submitted {:.0f} MB in {:.1f} s of ingest calls ({:.1f} MB/s, {:.0f} rows/s client side)'.format(
+        csv_mb, submit_seconds, csv_mb / submit_seconds, total_rows / submit_seconds))
+    print('End to end {:.1f} s ({:.1f} MB/s csv)'.format(elapsed, csv_mb / elapsed))
+    print(json.dumps(summary, indent=4))
+
+    count = query_kusto('{} | count'.format(args.table), args.db, query_client)
+    print('Rows in table: {}'.format(int(count['Count'][0]) if not count.empty else 0))
+    print('Last timestamp: {}'.format(get_last_ingress_date(query_client, args.db, args.table, 'timestamp')))
+    return summary
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--gb', type=float, default=1., help='GB of csv data to ingest')
+    parser.add_argument('--batch-mb', type=float, dest='batch_mb', default=64.,
+                        help='MB of csv data per ingest call')
+    parser.add_argument('--db-path', type=str, dest='db_path', default='kusto_simulator.db',
+                        help='SQLite file of the simulator (recreated)')
+    parser.add_argument('--db', type=str, default='benchmark', help='Database name')
+    parser.add_argument('--table', type=str, default='IngestTest', help='Table name')
+    parser.add_argument('--ingestion-delay', type=float, dest='ingestion_delay', default=0.,
+                        help='Seconds the simulator waits before ingesting a queued batch')
+    parser.add_argument('--status-timeout', type=int, dest='status_timeout', default=3600,
+                        help='Seconds to wait for all ingestions to complete')
+
+    args = parser.parse_args()
+    main(args)
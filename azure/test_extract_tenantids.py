@@ -0,0 +1,110 @@
+"""
+Offline tests of extract_tenantids.py: `az login` is replaced by a fake CLI
+script (--az-command) printing the same json for known users.
+
+usage: python -m pytest test_extract_tenantids.py
+"""
+import csv
+import json
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from extract_tenantids import TenantResolver, main
+
+FAKE_AZ = '''
+import json, sys
+user = sys.argv[sys.argv.index('-u') + 1]
+with open({log!r}, 'a') as f:
+    f.write(user + '\\n')
+tenants = {tenants!r}
+if user in tenants:
+    print(json.dumps([{{"tenantId": tenants[user], "user": {{"name": user}}}}]))
+else:
+    sys.exit(1)
+'''
+
+FIELDS = ['Team Account Log-In', 'Team Account Password ', ' CSP Subscription Id',
+          'Azure DisplayName', 'Azure Account Log-In', 'Azure Account Password']
+
+
+@pytest.fixture
+def fake_az(tmp_path):
+    """Returns (az_command, logins) for a fake CLI knowing the given users"""
+    def make(tenants):
+        log = tmp_path / 'logins.txt'
+        script = tmp_path / 'fake_az.py'
+        script.write_text(FAKE_AZ.format(log=str(log), tenants=tenants))
+        return '{} {}'.format(sys.executable, script), lambda: log.read_text().split() if log.exists() else []
+    return make
+
+
+def write_csv(path, teams):
+    """teams: [[(user, subscription), ...], ...], separated by blank rows"""
+    with open(path, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=FIELDS)
+        writer.writeheader()
+        for i, team in enumerate(teams):
+            if i:
+                writer.writerow({})
+            for user, subscription in team:
+                writer.writerow({' CSP Subscription Id': ' CSP Subscription Id: ' + subscription,
+                                 'Azure Account Log-In': ' Azure UserName: ' + user,
+                                 'Azure Account Password': ' Azure Password: secret'})
+    return str(path)
+
+
+def test_successful_logins_once_per_subscription(tmp_path, fake_az):
+    az_command, logins = fake_az({'a1@x.com': 'tenant-a', 'b1@x.com': 'tenant-b'})
+    csv_file = write_csv(tmp_path / 'subs.csv', [[('a1@x.com', 'sub-a'), ('a2@x.com', 'sub-a')],
+                                                 [('b1@x.com', 'sub-b')]])
+
+    tenantids_str, _ = main(csv_file, False, az_command, workers=4, timeout=30)
+
+    assert sorted(tenantids_str.split(',\n')) == ['"tenant-a"', '"tenant-b"']
+    assert sorted(logins()) == ['a1@x.com', 'b1@x.com']
+
+
+def test_failed_login_falls_back_to_next_user(tmp_path, fake_az):
+    az_command, logins = fake_az({'a2@x.com': 'tenant-a'})
+    csv_file = write_csv(tmp_path / 'subs.csv', [[('a1@x.com', 'sub-a'), ('a2@x.com', 'sub-a')]])
+
+    tenantids_str, _ = main(csv_file, False, az_command, workers=2, timeout=30)
+
+    assert tenantids_str == '"tenant-a"'
+    assert logins() == ['a1@x.com', 'a2@x.com']
+
+
+def test_fallback_submitted_after_failed_resolve(fake_az):
+    az_command, _ = fake_az({'a2@x.com': 'tenant-a'})
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        resolver = TenantResolver(executor, az_command, timeout=30)
+        resolver.submit('sub-a', 'a1@x.com', 'secret')
+        # The first login has failed before the fallback user is known
+        assert resolver.latest['sub-a'].result() is None
+        resolver.submit('sub-a', 'a2@x.com', 'secret')
+
+        assert list(resolver.as_completed()) == [('sub-a', 'tenant-a')]
+
+
+def test_unknown_users_give_no_tenant(tmp_path, fake_az):
+    az_command, _ = fake_az({})
+    csv_file = write_csv(tmp_path / 'subs.csv', [[('a1@x.com', 'sub-a')]])
+
+    tenantids_str, _ = main(csv_file, False, az_command, workers=2, timeout=30)
+
+    assert tenantids_str == ''
+
+
+def test_teaminfo(tmp_path, fake_az):
+    az_command, _ = fake_az({'a1@x.com': 'tenant-a', 'b1@x.com': 'tenant-b'})
+    csv_file = write_csv(tmp_path / 'subs.csv', [[('a1@x.com', 'sub-a'), ('a2@x.com', 'sub-a')],
+                                                 [('b1@x.com', 'sub-b')]])
+
+    _, teaminfo_str = main(csv_file, True, az_command, workers=4, timeout=30)
+
+    assert json.loads(teaminfo_str) == [
+        {'SubscriptionId': 'sub-a', 'Usernames': ['a1@x.com', 'a2@x.com'], 'TeamName': 'Team One'},
+        {'SubscriptionId': 'sub-b', 'Usernames': ['b1@x.com'], 'TeamName': 'Team Two'},
+    ]
@@ -0,0 +1,107 @@
+"""
+Tests of ingestion_tracker.py against the local status queues of
+kusto_simulator.py, no cluster needed.
+
+usage: python -m pytest test_ingestion_tracker.py
+"""
+from types import SimpleNamespace
+
+import pandas as pd
+import pytest
+
+pytest.importorskip('azure.kusto.ingest')
+
+from ingestion_tracker import IngestionTracker, message_time
+from kusto_simulator import KustoSimulator
+
+
+@pytest.fixture
+def store(tmp_path):
+    def make(ingestion_delay=0.):
+        store = KustoSimulator(str(tmp_path / 'kusto.db'), ingestion_delay=ingestion_delay)
+        store.query_client().execute_mgmt('db', '.create table T (timestamp:datetime, id:long, value:real)')
+        return store
+    return make
+
+
+def dataframe(rows=100):
+    return pd.DataFrame({'timestamp': pd.date_range('2022-01-05', periods=rows, freq='s', tz='UTC'),
+                         'id': range(rows), 'value': [1.5] * rows})
+
+
+def count_rows(store):
+    return store.query_client().execute_query('db', 'T | count').primary_results[0][0][0]
+
+
+def test_success_is_tracked(store):
+    store = store()
+    tracker = IngestionTracker(store.ingest_client(), store.status_queues)
+    df = dataframe()
+    batch = tracker.ingest_dataframe(df, 'db', 'T')
+
+    assert tracker.wait(timeout=30, interval=0.1) == []
+    assert batch.status == 'Succeeded'
+    assert batch.rows == 100
+    assert count_rows(store) == 100
+    summary = tracker.summary()
+    assert (summary['succeeded'], summary['failed'], summary['pending']) == (1, 0, 0)
+
+
+def test_bytes_are_the_serialized_csv(store):
+    store = store()
+    tracker = IngestionTracker(store.ingest_client(), store.status_queues)
+    df = dataframe()
+    batch = tracker.ingest_dataframe(df, 'db', 'T')
+
+    assert batch.bytes == len(df.to_csv(index=False, header=False).encode())
+
+
+def test_latency_does_not_depend_on_poll_interval(store):
+    store = store(ingestion_delay=0.3)
+    tracker = IngestionTracker(store.ingest_client(), store.status_queues)
+    batch = tracker.ingest_dataframe(dataframe(), 'db', 'T')
+    # First poll finds nothing, the next one is 3 s later
+    tracker.wait(timeout=30, interval=3)
+
+    assert batch.status == 'Succeeded'
+    assert 0.3 <= batch.queue_latency < 2
+
+
+def test_failure_is_tracked(store):
+    store = store()
+    tracker = IngestionTracker(store.ingest_client(), store.status_queues)
+    batch = tracker.ingest_dataframe(dataframe(), 'db', 'Missing')
+
+    assert tracker.wait(timeout=30, interval=0.1) == []
+    assert batch.status == 'Failed'
+    assert batch.error
+    assert tracker.summary()['failed'] == 1
+
+
+def test_pending_after_timeout(store):
+    store = store(ingestion_delay=2)
+    tracker = IngestionTracker(store.ingest_client(), store.status_queues)
+    batch = tracker.ingest_dataframe(dataframe(), 'db', 'T')
+
+    assert tracker.wait(timeout=0.2, interval=0.1) == [batch]
+    assert batch.status == 'Queued'
+    assert tracker.summary()['pending'] == 1
+
+
+def test_untracked_messages_are_ignored(store):
+    store = store()
+    tracker = IngestionTracker(store.ingest_client(), store.status_queues)
+    store.status_queues.success.put(SimpleNamespace(IngestionSourceId='not-ours',
+                                                    SucceededOn='2022-01-05T00:00:00Z'))
+
+    assert tracker.poll() == []
+
+
+@pytest.mark.parametrize('value, expected', [
+    ('2022-01-05T10:00:01.1234567Z', 1641376801.123456),
+    ('2022-01-05T10:00:01+00:00', 1641376801.0),
+    ('2022-01-05 10:00:01', 1641376801.0),
+    ('not a time', None),
+])
+def test_message_time(value, expected):
+    assert message_time(SimpleNamespace(SucceededOn=value)) == expected
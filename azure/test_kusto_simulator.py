@@ -0,0 +1,51 @@
+"""
+Tests of the query side of kusto_simulator.py through the helpers of
+ingress_to_kusto.py, no cluster needed.
+
+usage: python -m pytest test_kusto_simulator.py
+"""
+import pandas as pd
+import pytest
+
+pytest.importorskip('azure.kusto.ingest')
+
+from ingestion_tracker import IngestionTracker
+from ingress_to_kusto import get_last_ingress_date, query_kusto, read_csv_file
+from kusto_simulator import KustoSimulator
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = KustoSimulator(str(tmp_path / 'kusto.db'))
+    store.query_client().execute_mgmt('db', '.create table T (timestamp:datetime, id:long, value:real)')
+    tracker = IngestionTracker(store.ingest_client(), store.status_queues)
+    tracker.ingest_dataframe(pd.DataFrame({'timestamp': pd.date_range('2022-01-05', periods=10, freq='s', tz='UTC'),
+                                           'id': range(10), 'value': [1.5] * 10}), 'db', 'T')
+    assert tracker.wait(timeout=30, interval=0.1) == []
+    return store
+
+
+def test_query_kusto_count(store):
+    count = query_kusto('T | count', 'db', store.query_client())
+
+    assert int(count['Count'][0]) == 10
+
+
+def test_get_last_ingress_date(store):
+    last = get_last_ingress_date(store.query_client(), 'db', 'T', 'timestamp')
+
+    assert last == pd.Timestamp('2022-01-05 00:00:09', tz='UTC')
+
+
+def test_schema_is_refetched_after_table_change(store, tmp_path):
+    client = store.query_client()
+    csv_filename = tmp_path / 'data.csv'
+    csv_filename.write_text('timestamp,id,value\n2022-01-05T00:00:10+00:00,10,2.5\n')
+    assert read_csv_file(str(csv_filename), client, 'db', 'T', use_table_schema=True)['id'].tolist() == [10]
+
+    client.execute_mgmt('db', '.drop table T')
+    client.execute_mgmt('db', '.create table T (timestamp:datetime, name:string, value:real)')
+    csv_filename.write_text('timestamp,name,value\n2022-01-05T00:00:10+00:00,abc,2.5\n')
+    dataframe = read_csv_file(str(csv_filename), client, 'db', 'T', use_table_schema=True)
+
+    assert dataframe['name'].tolist() == ['abc']
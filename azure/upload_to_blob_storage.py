@@ -4,11 +4,31 @@ Python script to upload data to blob storage (tested with azure-storage-blob==12
 Make sure to set the environment variables before running:
 - STORAGE_CONNECTION_STRING
 - STORAGE_CONTAINER_NAME
+
+The blob service client is shared and cached by azure_clients.py, so
+upload_directory can be called repeatedly (e.g. from a long-lived worker)
+without new connections each time.
+
+Files of at least --large-file-mb (videos, model checkpoints) are uploaded
+as staged blocks of --block-size-mb, --max-concurrency at a time, and then
+committed.  Block ids are derived from the file's size and modification time,
+so rerunning an interrupted upload only stages the blocks that are missing
+from the blob's uncommitted block list.
 """
 import os
-from azure.storage.blob import BlobServiceClient
 import argparse
+import base64
 import glob
+import hashlib
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from azure.core.exceptions import ResourceNotFoundError
+from azure.storage.blob import BlobBlock
+
+from azure_clients import get_container_client
+from blob_shards import upload_shards
 
 def arg_parse():
     """
@@ -16,40 +36,136 @@ def arg_parse():
     """
     parser = argparse.ArgumentParser(description='This script is for uploading a directory to Azure Blob Storage.')
     parser.add_argument("--dir", dest='directory', help="The directory to upload")
+    parser.add_argument("--manifest", dest='manifest', default=None,
+                        help="Write the uploaded blob URIs and sizes as json lines (input of blob_to_kusto.py)")
+    parser.add_argument("--block-size-mb", dest='block_size_mb', type=float, default=8,
+                        help="Block size of staged uploads of large files")
+    parser.add_argument("--max-concurrency", dest='max_concurrency', type=int, default=4,
+                        help="Parallel block uploads per file")
+    parser.add_argument("--large-file-mb", dest='large_file_mb', type=float, default=64,
+                        help="Files of at least this size are uploaded as resumable staged blocks")
+    parser.add_argument("--pack", dest='pack', action='store_true',
+                        help="Upload the directory as tar shards plus an index (see blob_shards.py) instead of one blob per file")
+    parser.add_argument("--shard-mb", dest='shard_mb', type=float, default=256, help="Target shard size in MB with --pack")
+    parser.add_argument("--prefix", dest='prefix', default=None,
+                        help="Blob name prefix of the shards with --pack (default the directory name)")
     return parser.parse_args()
 
-args = arg_parse()
-
-CONN_STRING = os.getenv("STORAGE_CONNECTION_STRING", "")
-CONTAINER = os.getenv("STORAGE_CONTAINER_NAME", "")
-
-# Instantiate a BlobServiceClient using a connection string
-blob_service_client = BlobServiceClient.from_connection_string(CONN_STRING)
-
-# Instantiate a ContainerClient
-container_client = blob_service_client.get_container_client(CONTAINER) 
-
-# Create new Container
-try:
-    container_client.create_container()
-except Exception as err:
-    print("WARNING: problem creating new container (the container may already exist)")
-    pass
-
-for filename in glob.iglob(os.path.join(args.directory, '**', '*'), recursive=True):
-    if os.path.isfile(filename):
-
-        # Upload a blob to the container
-        with open(filename, "rb") as data:
-            try:
-                print('Uploading ', filename)
-                container_client.upload_blob(name=filename, data=data)
-            except Exception as err:
-                print("WARNING: issue uploading (the file may already exist)")
-                pass
-
-# Check that the files uploaded correctly to blob
-generator = container_client.list_blobs()
-print('Current Blobs in Azure for this folder: ')
-for blob in generator:
-    print("  Blob/file: " + blob.name)
\ No newline at end of file
+def create_container(container_client):
+    """Create the container if it does not exist yet"""
+    try:
+        container_client.create_container()
+    except Exception as err:
+        print("WARNING: problem creating new container (the container may already exist): {}".format(err))
+
+def block_ids(filename, block_size):
+    """Deterministic, equal-length block ids of a file, changing with its size and mtime"""
+    stat = os.stat(filename)
+    fingerprint = hashlib.md5('{}-{}-{}'.format(stat.st_size, stat.st_mtime_ns, block_size).encode()).hexdigest()[:16]
+    count = max(1, -(-stat.st_size // block_size))
+    return [base64.b64encode('{}-{:08d}'.format(fingerprint, i).encode()).decode() for i in range(count)]
+
+def print_progress(blob_name, done_bytes, total_bytes, mb_per_second):
+    """Default progress callback of upload_large_file"""
+    print('  {}: {:.0f}/{:.0f} MB ({:.1f} MB/s)'.format(blob_name, done_bytes / 2**20, total_bytes / 2**20,
+                                                        mb_per_second))
+
+def upload_large_file(container_client, filename, blob_name, block_size=8 * 2**20, max_concurrency=4,
+                      progress=print_progress):
+    """Stage the blocks of a file in parallel and commit them, skipping blocks
+    already staged by an interrupted run; returns the blob client"""
+    blob_client = container_client.get_blob_client(blob_name)
+    ids = block_ids(filename, block_size)
+    try:
+        _, uncommitted = blob_client.get_block_list('uncommitted')
+        staged = {block.id: block.size for block in uncommitted}
+    except ResourceNotFoundError:
+        staged = {}
+    total_bytes = os.path.getsize(filename)
+    todo = [(i, block_id) for i, block_id in enumerate(ids)
+            if staged.get(block_id) != min(block_size, total_bytes - i * block_size)]
+    done_bytes = total_bytes - sum(min(block_size, total_bytes - i * block_size) for i, _ in todo)
+    if done_bytes:
+        print('  {}: resuming, {} of {} blocks already staged'.format(blob_name, len(ids) - len(todo), len(ids)))
+    resumed_bytes, t0 = done_bytes, time.time()
+
+    def stage(block):
+        i, block_id = block
+        # Each worker reads only its own block, at most max_concurrency blocks in memory
+        with open(filename, 'rb') as f:
+            f.seek(i * block_size)
+            data = f.read(block_size)
+        blob_client.stage_block(block_id, data, length=len(data))
+        return len(data)
+
+    with ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+        for size in executor.map(stage, todo):
+            done_bytes += size
+            if progress:
+                progress(blob_name, done_bytes, total_bytes,
+                         (done_bytes - resumed_bytes) / 2**20 / max(time.time() - t0, 1e-9))
+    blob_client.commit_block_list([BlobBlock(block_id=block_id) for block_id in ids])
+    return blob_client
+
+def upload_directory(directory, container=None, connection_string=None, manifest=None, block_size_mb=8,
+                     max_concurrency=4, large_file_mb=64):
+    """Upload every file under directory (blob names are the local paths),
+    returns the names uploaded.  With manifest, the blob URIs and sizes are
+    appended to that file as json lines for blob_to_kusto.py"""
+    # Instantiate a ContainerClient from the shared BlobServiceClient
+    container_client = get_container_client(container or os.getenv("STORAGE_CONTAINER_NAME", ""),
+                                            connection_string)
+
+    # Create new Container
+    create_container(container_client)
+
+    uploaded = []
+    for filename in glob.iglob(os.path.join(directory, '**', '*'), recursive=True):
+        if os.path.isfile(filename):
+
+            # Upload a blob to the container
+            with open(filename, "rb") as data:
+                try:
+                    print('Uploading ', filename)
+                    if os.path.getsize(filename) >= large_file_mb * 2**20:
+                        if container_client.get_blob_client(filename).exists():
+                            raise ValueError('{} already exists'.format(filename))
+                        blob_client = upload_large_file(container_client, filename, filename,
+                                                        int(block_size_mb * 2**20), max_concurrency)
+                    else:
+                        blob_client = container_client.upload_blob(name=filename, data=data,
+                                                                   max_concurrency=max_concurrency)
+                    uploaded.append(filename)
+                    if manifest:
+                        with open(manifest, 'a') as f:
+                            f.write(json.dumps({'uri': blob_client.url,
+                                                'size': os.path.getsize(filename)}) + '\n')
+                except Exception as err:
+                    # Staged blocks are kept, a rerun of a large file only uploads the missing ones
+                    print("WARNING: issue uploading {}: {} (a rerun resumes large files)".format(filename, err))
+    return uploaded
+
+def list_container(container=None, connection_string=None):
+    """Print the blobs currently in the container"""
+    container_client = get_container_client(container or os.getenv("STORAGE_CONTAINER_NAME", ""),
+                                            connection_string)
+    # Check that the files uploaded correctly to blob
+    generator = container_client.list_blobs()
+    print('Current Blobs in Azure for this folder: ')
+    for blob in generator:
+        print("  Blob/file: " + blob.name)
+
+def main(args):
+    if args.pack:
+        # Blob names relative to the directory, under the prefix
+        container_client = get_container_client(os.getenv("STORAGE_CONTAINER_NAME", ""))
+        create_container(container_client)
+        upload_shards(args.directory, container_client, args.prefix, args.shard_mb,
+                      max_concurrency=args.max_concurrency)
+        return
+    upload_directory(args.directory, manifest=args.manifest, block_size_mb=args.block_size_mb,
+                     max_concurrency=args.max_concurrency, large_file_mb=args.large_file_mb)
+    list_container()
+
+if __name__ == '__main__':
+    main(arg_parse())
@@ -0,0 +1,114 @@
+"""
+Runtime and peak memory (tracemalloc) of the exact Ward linkage in
+cluster_time_series_image.py against the scalable pre-clustering mode, for
+a growing number of series.  Series are noisy copies of a few random walks,
+as uint8 like the images from sequential_data_to_image.py.
+
+Usage example:
+python cluster_benchmark.py --n-series 1000,5000,20000,50000 --max-exact 20000 --output cluster_benchmark.png
+"""
+import time
+import tracemalloc
+import argparse
+
+import numpy as np
+import matplotlib.pyplot as plt
+from scipy.cluster.hierarchy import linkage
+
+from cluster_time_series_image import scalable_linkage
+
+
+def make_series(n_series, n_steps, n_groups=8, random_state=0):
+    rng = np.random.default_rng(random_state)
+    walks = np.cumsum(rng.normal(size=(n_groups, n_steps)), axis=1)
+    walks = (walks - walks.min()) / (walks.max() - walks.min()) * 200
+    series = walks[rng.integers(n_groups, size=n_series)] + rng.normal(0, 20, size=(n_series, n_steps))
+    return np.clip(series, 0, 255).astype(np.uint8)
+
+
+def measure(func, *args, **kwargs):
+    """Returns (seconds, peak MB) of one call"""
+    tracemalloc.start()
+    t0 = time.perf_counter()
+    func(*args, **kwargs)
+    seconds = time.perf_counter() - t0
+    peak = tracemalloc.get_traced_memory()[1] / 2**20
+    tracemalloc.stop()
+    return seconds, peak
+
+
+def main(args):
+    n_series = [int(n) for n in args.n_series.split(',')]
+    methods = ['exact', 'scalable']
+    results = {method: [] for method in methods}
+    print('{:>9} {:<9} {:>9} {:>10}'.format('series', 'method', 'seconds', 'peak MB'))
+    for n in n_series:
+        data = make_series(n, args.n_steps)
+        for method in methods:
+            if method == 'exact':
+                if n > args.max_exact:
+                    results[method].append((n, np.nan, np.nan))
+                    continue
+                seconds, peak = measure(linkage, data, method='ward', metric='euclidean')
+            else:
+                seconds, peak = measure(scalable_linkage, data, args.reduce, args.n_components,
+                                        args.algorithm, args.n_clusters)
+            results[method].append((n, seconds, peak))
+            print('{:>9} {:<9} {:>9.2f} {:>10.1f}'.format(n, method, seconds, peak))
+
+    fig, (ax1, ax2) = plt.subplots(1, 2, figsize=(10, 4))
+    for method, rows in results.items():
+        rows = np.array(rows)
+        ax1.plot(rows[:, 0], rows[:, 1], marker='o', label=method)
+        ax2.plot(rows[:, 0], rows[:, 2], marker='o', label=method)
+    for ax, ylabel in ((ax1, 'Runtime (s)'), (ax2, 'Peak memory (MB)')):
+        ax.set_xscale('log')
+        ax.set_yscale('log')
+        ax.set_xlabel('Number of series')
+        ax.set_ylabel(ylabel)
+        ax.legend()
+    plt.tight_layout()
+    fig.savefig(args.output)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--n-series', help="Comma separated numbers of series.",
+                        required=False,
+                        type=str,
+                        default='1000,2000,5000,10000,20000,50000',
+                        dest='n_series')
+    parser.add_argument('--n-steps', help="Time steps per series.",
+                        required=False,
+                        type=int,
+                        default=365,
+                        dest='n_steps')
+    parser.add_argument('--max-exact', help="Largest number of series run with exact linkage.",
+                        required=False,
+                        type=int,
+                        default=10000,
+                        dest='max_exact')
+    parser.add_argument('--n-clusters', help="Pre-clusters in scalable mode.",
+                        required=False,
+                        type=int,
+                        default=256,
+                        dest='n_clusters')
+    parser.add_argument('--reduce', help="Row reduction in scalable mode.",
+                        required=False,
+                        choices=['pca', 'random', 'none'],
+                        default='pca')
+    parser.add_argument('--n-components', help="Dimensions kept by --reduce.",
+                        required=False,
+                        type=int,
+                        default=32,
+                        dest='n_components')
+    parser.add_argument('--algorithm', help="Pre-clustering algorithm.",
+                        required=False,
+                        choices=['minibatch', 'birch'],
+                        default='minibatch')
+    parser.add_argument('--output', '-o', help="Chart of runtime and peak memory.",
+                        required=False,
+                        type=str,
+                        default='cluster_benchmark.png')
+    args = parser.parse_args()
+
+    main(args)
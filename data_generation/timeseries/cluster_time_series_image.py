@@ -1,24 +1,120 @@
 """
-Hierarchical clustering of time series that is represented by an 
+Hierarchical clustering of time series that is represented by an
 image generated by:
 
 1) "time_series_gen.py"
 2) "sequential_data_to_image.py"
+
+Ward linkage on every row needs O(n^2) memory and time.  With --n-clusters
+the rows are instead (optionally) reduced with PCA or a random projection,
+pre-clustered with mini-batch k-means or BIRCH, and Ward linkage is run on
+the cluster centroids only.  The heatmap shows every row, grouped by cluster
+in dendrogram order, and the dendrogram has one leaf per cluster.
 """
 import numpy as np
 import matplotlib.pyplot as plt
 from scipy.cluster.hierarchy import dendrogram, linkage
+from scipy.spatial.distance import cdist
+from sklearn.cluster import Birch, MiniBatchKMeans
+from sklearn.decomposition import PCA
+from sklearn.random_projection import GaussianRandomProjection
 from PIL import Image
 import argparse
 
 
-def main(input_file, output_file):
+def reduce_rows(data, method='pca', n_components=32, sample_rows=10000,
+                batch_rows=10000, random_state=0):
+    """Project rows to n_components dims, fitting on a sample and transforming in batches.
+    n_components is capped by the sample size and the row length (PCA needs both)"""
+    sample_rows = min(sample_rows, len(data))
+    n_components = max(1, min(n_components, sample_rows, data.shape[1]))
+    if method == 'pca':
+        reducer = PCA(n_components=n_components, svd_solver='randomized', random_state=random_state)
+    elif method == 'random':
+        reducer = GaussianRandomProjection(n_components=n_components, random_state=random_state)
+    else:
+        raise ValueError('Unknown reduction {}'.format(method))
+
+    rng = np.random.default_rng(random_state)
+    sample = rng.choice(len(data), size=sample_rows, replace=False)
+    reducer.fit(data[np.sort(sample)].astype(np.float32))
+
+    reduced = np.empty((len(data), n_components), dtype=np.float32)
+    for start in range(0, len(data), batch_rows):
+        reduced[start:start + batch_rows] = reducer.transform(
+            data[start:start + batch_rows].astype(np.float32))
+    return reduced
+
+
+def nearest_neighbor_distance(features, sample_rows=2000, random_state=0):
+    """Median distance of sampled rows to their nearest sampled neighbor, used as the
+    BIRCH subcluster threshold (the default of 0.5 makes nearly every row a subcluster)"""
+    rng = np.random.default_rng(random_state)
+    sample = features[rng.choice(len(features), size=min(sample_rows, len(features)), replace=False)]
+    distances = cdist(sample, sample)
+    np.fill_diagonal(distances, np.inf)
+    return float(np.median(distances.min(axis=1)))
+
+
+def precluster(features, algorithm='minibatch', n_clusters=256, random_state=0):
+    """Returns (labels, centroids) with centroids of the non-empty clusters only"""
+    if algorithm == 'minibatch':
+        model = MiniBatchKMeans(n_clusters=n_clusters, batch_size=4096, n_init=3,
+                                random_state=random_state)
+    elif algorithm == 'birch':
+        model = Birch(threshold=nearest_neighbor_distance(features, random_state=random_state),
+                      n_clusters=n_clusters)
+    else:
+        raise ValueError('Unknown pre-clustering algorithm {}'.format(algorithm))
+    labels = model.fit_predict(features)
+
+    # Relabel 0..k-1 and average the rows, so both algorithms give the same centroids
+    used, labels = np.unique(labels, return_inverse=True)
+    counts = np.bincount(labels)
+    centroids = np.zeros((len(used), features.shape[1]), dtype=np.float64)
+    np.add.at(centroids, labels, features)
+    centroids /= counts[:, None]
+    return labels, centroids
+
+
+def scalable_linkage(data, reduce='pca', n_components=32, algorithm='minibatch',
+                     n_clusters=256, random_state=0):
+    """Ward linkage of cluster centroids, returns (linkage_matrix, labels).
+    Images with at most n_clusters rows, or rows that fall in a single
+    cluster, get exact linkage of the rows with one label per row"""
+    if n_clusters < 2:
+        raise ValueError('n_clusters must be at least 2, got {}'.format(n_clusters))
+    if len(data) <= n_clusters:
+        return linkage(data, method='ward', metric='euclidean'), np.arange(len(data))
+    features = data
+    if reduce != 'none' and n_components < data.shape[1]:
+        features = reduce_rows(data, reduce, n_components, random_state=random_state)
+    labels, centroids = precluster(features.astype(np.float32, copy=False), algorithm,
+                                   n_clusters, random_state)
+    if len(centroids) < 2:
+        return linkage(data, method='ward', metric='euclidean'), np.arange(len(data))
+    return linkage(centroids, method='ward', metric='euclidean'), labels
+
+
+def rows_in_leaf_order(leaves, labels):
+    """Row indices grouped by cluster, clusters in dendrogram leaf order"""
+    rank = np.empty(len(leaves), dtype=np.int64)
+    rank[leaves] = np.arange(len(leaves))
+    return np.argsort(rank[labels], kind='stable')
+
+
+def main(input_file, output_file, n_clusters=None, reduce='pca', n_components=32,
+         algorithm='minibatch'):
     data = Image.open(input_file).convert('L')
     data = np.array(data)
-    linkage_matrix = linkage(data, method='ward', metric='euclidean')
+    labels = None
+    if n_clusters:
+        linkage_matrix, labels = scalable_linkage(data, reduce, n_components, algorithm, n_clusters)
+    else:
+        linkage_matrix = linkage(data, method='ward', metric='euclidean')
 
-    fig, (ax1, ax2) = plt.subplots(1, 2, 
-                                   figsize=(12, 3), 
+    fig, (ax1, ax2) = plt.subplots(1, 2,
+                                   figsize=(12, 3),
                                    gridspec_kw={'width_ratios': [1, 15]})
 
     dendro = dendrogram(linkage_matrix,
@@ -27,11 +123,13 @@ def main(input_file, output_file):
                show_leaf_counts=False,
                ax=ax1)
     ax1.set_title('Dendrogram')
-    ax1.set_ylabel('Sample Index')
+    ax1.set_ylabel('Cluster Index' if n_clusters else 'Sample Index')
     ax1.set_xlabel('Distance')
     ax1.tick_params(axis='y', which='both', labelsize=8)
 
     reordered_indices = dendro['leaves']
+    if labels is not None:
+        reordered_indices = rows_in_leaf_order(reordered_indices, labels)
     clustered_data = data[reordered_indices, :]
 
     ax2.imshow(clustered_data, aspect='auto', cmap='viridis', origin='lower')
@@ -53,6 +151,27 @@ if __name__ == '__main__':
                         required=True,
                         type=str,
                         dest='output_file')
+    parser.add_argument('--n-clusters', help="Pre-cluster rows and link only the centroids (scalable mode).",
+                        required=False,
+                        type=int,
+                        default=None,
+                        dest='n_clusters')
+    parser.add_argument('--reduce', help="Row reduction before pre-clustering.",
+                        required=False,
+                        choices=['pca', 'random', 'none'],
+                        default='pca')
+    parser.add_argument('--n-components', help="Dimensions kept by --reduce.",
+                        required=False,
+                        type=int,
+                        default=32,
+                        dest='n_components')
+    parser.add_argument('--algorithm', help="Pre-clustering algorithm.",
+                        required=False,
+                        choices=['minibatch', 'birch'],
+                        default='minibatch')
     args = parser.parse_args()
+    if args.n_clusters is not None and args.n_clusters < 2:
+        parser.error('--n-clusters must be at least 2')
 
-    main(args.input_file, args.output_file)
\ No newline at end of file
+    main(args.input_file, args.output_file, args.n_clusters, args.reduce,
+         args.n_components, args.algorithm)
@@ -1,29 +1,155 @@
 """
 Convert sequential data in a csv file to a RGB image with same
 basename, but '.png' instead.
+
+With --fast the csv is streamed into a preallocated uint8 array and colored
+with a 256 entry lookup table, without building a DataFrame or going through
+matplotlib rendering.  Values are scaled to the colormap as plt.imsave does,
+from the data min/max (an extra pass over the csv) unless --value-range is
+given, e.g. 0 255 for the output of time_series_gen.py.  Images wider than
+--max-width are written as tiles '<name>_tile000.png', '<name>_tile001.png',
+... along the time axis.  If --input is a directory every csv in it is
+converted, in --workers processes.
 """
-import pandas as pd
-import matplotlib.pyplot as plt
+from concurrent.futures import ProcessPoolExecutor
+import glob
+import itertools
 import os
 import argparse
 
+import numpy as np
+import pandas as pd
+import matplotlib.pyplot as plt
+from PIL import Image
+
+
+def colormap_lut(cmap='viridis'):
+    """(256, 3) uint8 RGB lookup table of a matplotlib colormap, the bytes plt.imsave writes"""
+    return plt.get_cmap(cmap)(np.arange(256), bytes=True)[:, :3]
 
-def main(csvfile):
+
+def count_lines(csvfile):
+    with open(csvfile, 'rb') as f:
+        return sum(block.count(b'\n') for block in iter(lambda: f.read(1 << 20), b'')) + 1
+
+
+def iter_csv_blocks(f, n_columns, block_rows=8192):
+    """float32 (rows, columns) blocks of the remaining csv lines, index column dropped"""
+    while True:
+        lines = list(itertools.islice(f, block_rows))
+        if not lines:
+            return
+        yield np.loadtxt(lines, delimiter=',', usecols=range(1, n_columns + 1),
+                         dtype=np.float32, ndmin=2)
+
+
+def csv_value_range(csvfile, block_rows=8192):
+    """(min, max) of the csv values, ignoring the index column"""
+    vmin, vmax = np.inf, -np.inf
     with open(csvfile, 'r') as f:
-        sequencesdata = pd.read_csv(csvfile, index_col=0)
-        sequencesdata = sequencesdata.T
-        
-    imgfile = '.'.join(os.path.basename(csvfile).split('.')[:-1]) + '.png'
+        n_columns = len(next(f).split(',')) - 1
+        for values in iter_csv_blocks(f, n_columns, block_rows):
+            if values.size:
+                vmin, vmax = min(vmin, np.nanmin(values)), max(vmax, np.nanmax(values))
+    return float(vmin), float(vmax)
+
+
+def read_csv_uint8(csvfile, value_range=None, block_rows=8192):
+    """Stream csv rows (first column is the index) into a (rows, columns) uint8 array
+    of colormap indices, normalized to value_range (default the data min/max) the
+    way matplotlib picks colors: floor(x * 256), with the top value at 255"""
+    vmin, vmax = value_range or csv_value_range(csvfile, block_rows)
+    scale = 256. / (vmax - vmin) if vmax > vmin else 0.
+    with open(csvfile, 'r') as f:
+        n_columns = len(next(f).split(',')) - 1
+        data = np.empty((count_lines(csvfile), n_columns), dtype=np.uint8)
+        n = 0
+        for values in iter_csv_blocks(f, n_columns, block_rows):
+            np.clip(values, vmin, vmax, out=values)
+            values -= vmin
+            values *= scale
+            # Non-negative, so the uint8 cast is the floor
+            np.minimum(values, 255, out=values)
+            data[n:n + len(values)] = values
+            n += len(values)
+    return data[:n]
+
+
+def fast_convert(csvfile, output_dir='.', cmap='viridis', value_range=None, max_width=32768):
+    """Write the csv as one png (or tiles when wider than max_width), returns the files written"""
+    data = read_csv_uint8(csvfile, value_range)
+    lut = colormap_lut(cmap)
+    name = '.'.join(os.path.basename(csvfile).split('.')[:-1])
+    n_tiles = max(1, -(-len(data) // max_width))
+
+    written = []
+    for tile in range(n_tiles):
+        # Series as rows, time steps as columns (same orientation as main)
+        rgb = lut[data[tile * max_width:(tile + 1) * max_width].T]
+        if n_tiles == 1:
+            imgfile = os.path.join(output_dir, name + '.png')
+        else:
+            imgfile = os.path.join(output_dir, '{}_tile{:03d}.png'.format(name, tile))
+        Image.fromarray(rgb).save(imgfile, compress_level=1)
+        written.append(imgfile)
+    return written
+
+
+def main(csvfile, output_dir='.'):
+    sequencesdata = pd.read_csv(csvfile, index_col=0)
+    sequencesdata = sequencesdata.T
+
+    imgfile = os.path.join(output_dir, '.'.join(os.path.basename(csvfile).split('.')[:-1]) + '.png')
 
     plt.imsave(imgfile, sequencesdata)
+    return [imgfile]
+
+
+def convert(csvfile, args):
+    if args.fast:
+        return fast_convert(csvfile, args.output_dir, args.cmap, args.value_range, args.max_width)
+    return main(csvfile, args.output_dir)
+
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
-    parser.add_argument('--input', '-i', help="Input csv.",
+    parser.add_argument('--input', '-i', help="Input csv, or a directory of csv files.",
                         required=True,
                         type=str)
+    parser.add_argument('--output-dir', help="Directory for the images.",
+                        required=False,
+                        type=str,
+                        default='.',
+                        dest='output_dir')
+    parser.add_argument('--fast', help="Stream the csv into uint8 and color with a lookup table.",
+                        required=False,
+                        action='store_true')
+    parser.add_argument('--cmap', help="Colormap used with --fast.",
+                        required=False,
+                        type=str,
+                        default='viridis')
+    parser.add_argument('--value-range', help="Values mapped to the colormap ends with --fast (default the data min/max).",
+                        required=False,
+                        type=float,
+                        nargs=2,
+                        default=None,
+                        dest='value_range')
+    parser.add_argument('--max-width', help="Wider images are written as tiles with --fast.",
+                        required=False,
+                        type=int,
+                        default=32768,
+                        dest='max_width')
+    parser.add_argument('--workers', help="Processes used for a directory of csv files.",
+                        required=False,
+                        type=int,
+                        default=os.cpu_count())
     args = parser.parse_args()
 
-    main(args.input)
-
-    
+    if os.path.isdir(args.input):
+        csvfiles = sorted(glob.glob(os.path.join(args.input, '*.csv')))
+        with ProcessPoolExecutor(max_workers=args.workers) as executor:
+            for csvfile, written in zip(csvfiles, executor.map(convert, csvfiles,
+                                                               [args] * len(csvfiles))):
+                print('{} -> {}'.format(csvfile, ', '.join(written)))
+    else:
+        convert(args.input, args)
@@ -1,9 +1,20 @@
 """
 Timeseries dataset generation as a csv file.
+
+With --chunk-rows the series is generated chunk by chunk instead of in one
+make_regression call, so the output can be far larger than memory.  Every
+chunk has its own RNG stream spawned from --seed, so the output is identical
+whatever the number of --workers.  Chunks are written incrementally as CSV,
+Parquet (needs pyarrow) or a raw .npy array, as uint8 or float32.  The
+DateTime index steps by --freq from 2018-01-01 and must stay before
+pd.Timestamp.max (2262), so very long series need a short --freq, e.g. 's'.
 """
 import numpy as np
 from sklearn.datasets import make_regression
 from dataclasses import dataclass
+from concurrent.futures import ProcessPoolExecutor
+import collections
+import os
 import pandas as pd
 import argparse
 
@@ -61,15 +72,156 @@ class RegressionDataGenerator:
     
         return df
 
+class ChunkedRegressionDataGenerator:
+    """Same shape of data as RegressionDataGenerator (|X| * 255 clipped to 0-255
+    features, optional noise and nonlinear term) generated in independent chunks."""
+    start = pd.Timestamp('2018-01-01')
+
+    def __init__(self, config: RegressionDataConfig, chunk_rows=100_000,
+                 dtype='float32', add_nonlinearity=False, add_extra_noise=False, freq='D'):
+        self.config = config
+        self.chunk_rows = chunk_rows
+        self.dtype = np.dtype(dtype)
+        if self.dtype == np.uint8 and add_nonlinearity:
+            raise ValueError('NonLinearTerm does not fit in uint8, use float32')
+        self.freq = freq
+        try:
+            self.step_ns = pd.tseries.frequencies.to_offset(freq).nanos
+        except ValueError:
+            raise ValueError(f'Frequency {freq} is not a fixed step (use e.g. D, h, min, s)')
+        # Check up front instead of failing partway through the output
+        last_ns = self.start.value + (config.n_time_steps - 1) * self.step_ns
+        if last_ns > pd.Timestamp.max.value:
+            raise ValueError(f'{config.n_time_steps} steps of {freq} from {self.start.date()} go past '
+                             f'{pd.Timestamp.max.date()}, use a shorter frequency')
+        self.add_nonlinearity = add_nonlinearity
+        self.add_extra_noise = add_extra_noise
+        self.n_chunks = -(-config.n_time_steps // chunk_rows)
+
+        seed = np.random.SeedSequence(config.random_state)
+        coef_seed, *self.chunk_seeds = seed.spawn(self.n_chunks + 1)
+        # Ground truth coefficients shared by all chunks, as in make_regression
+        n_informative = min(10, config.n_features)
+        self.coef = np.zeros(config.n_features, dtype=np.float32)
+        self.coef[:n_informative] = 100 * np.random.default_rng(coef_seed).uniform(size=n_informative)
+
+    @property
+    def columns(self):
+        cols = [f'Feature{i+1}' for i in range(self.config.n_features)]
+        if self.add_nonlinearity:
+            cols.append('NonLinearTerm')
+        return cols
+
+    def chunk_start(self, index):
+        return index * self.chunk_rows
+
+    def generate_chunk(self, index):
+        """Values of one chunk as a (rows, columns) array of self.dtype"""
+        rng = np.random.default_rng(self.chunk_seeds[index])
+        start = self.chunk_start(index)
+        rows = min(self.chunk_rows, self.config.n_time_steps - start)
+        X = rng.standard_normal((rows, self.config.n_features), dtype=np.float32)
+
+        # Make all numerical vals pos, int, and range 0-255 (in place)
+        values = np.empty((rows, len(self.columns)), dtype=np.float32)
+        features = values[:, :self.config.n_features]
+        np.abs(X, out=features)
+        features *= 255
+        np.floor(features, out=features)
+        np.clip(features, 0, 255, out=features)
+
+        if self.add_extra_noise:
+            features += rng.normal(0, self.config.noise, size=features.shape).astype(np.float32)
+        if self.add_nonlinearity:
+            y = X @ self.coef + self.config.bias
+            y += rng.normal(0, self.config.noise, size=rows).astype(np.float32)
+            # Add polynomial terms
+            values[:, -1] = y + 0.3 * np.square(X).sum(axis=1)
+
+        if self.dtype == np.uint8:
+            # Only features, NonLinearTerm is rejected for uint8 in __init__
+            np.clip(values, 0, 255, out=values)
+        return values.astype(self.dtype, copy=False)
+
+    def chunks(self, workers=1):
+        """Yield (index, values) in order, generating up to 2*workers chunks ahead"""
+        if workers <= 1:
+            for index in range(self.n_chunks):
+                yield index, self.generate_chunk(index)
+            return
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            pending = collections.deque()
+            for index in range(self.n_chunks):
+                pending.append((index, executor.submit(self.generate_chunk, index)))
+                if len(pending) >= 2 * workers:
+                    done_index, future = pending.popleft()
+                    yield done_index, future.result()
+            for done_index, future in pending:
+                yield done_index, future.result()
+
+    def time_index(self, index, rows):
+        start = pd.Timestamp(self.start.value + self.chunk_start(index) * self.step_ns)
+        return pd.date_range(start=start, periods=rows, freq=self.freq, name='DateTime')
+
+    def write(self, out_filename, out_format=None, workers=1):
+        """Write all chunks to csv, parquet or npy, returns the number of rows"""
+        out_format = out_format or os.path.splitext(out_filename)[1].lstrip('.') or 'csv'
+        writer = None
+        if out_format == 'npy':
+            array = np.lib.format.open_memmap(out_filename, mode='w+', dtype=self.dtype,
+                                              shape=(self.config.n_time_steps, len(self.columns)))
+        elif out_format == 'parquet':
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        elif out_format != 'csv':
+            raise ValueError(f'Unknown output format {out_format}')
+
+        for index, values in self.chunks(workers):
+            start = self.chunk_start(index)
+            if out_format == 'npy':
+                array[start:start + len(values)] = values
+                continue
+            df = pd.DataFrame(values, columns=self.columns, index=self.time_index(index, len(values)))
+            if out_format == 'csv':
+                df.to_csv(out_filename, mode='w' if index == 0 else 'a', header=index == 0)
+            else:
+                table = pa.Table.from_pandas(df, preserve_index=True)
+                if writer is None:
+                    writer = pq.ParquetWriter(out_filename, table.schema)
+                writer.write_table(table)
+
+        if out_format == 'npy':
+            array.flush()
+        elif writer is not None:
+            writer.close()
+        return self.config.n_time_steps
+
 def main(n_features,
          n_time_steps,
          out_filename,
          add_nonlinearity=False,
-         add_extra_noise=False):
+         add_extra_noise=False,
+         chunk_rows=None,
+         out_format=None,
+         dtype='float32',
+         workers=1,
+         random_state=42,
+         freq='D'):
     # Generate both linear and nonlinear datasets
     config = RegressionDataConfig(n_time_steps=n_time_steps,
                                   noise=15,
-                                  n_features=n_features)
+                                  n_features=n_features,
+                                  random_state=random_state)
+    if chunk_rows:
+        generator = ChunkedRegressionDataGenerator(config,
+                                                   chunk_rows=chunk_rows,
+                                                   dtype=dtype,
+                                                   add_nonlinearity=add_nonlinearity,
+                                                   add_extra_noise=add_extra_noise,
+                                                   freq=freq)
+        generator.write(out_filename, out_format=out_format, workers=workers)
+        return
+
     generator = RegressionDataGenerator(config)
 
     data = generator.generate_data(add_nonlinearity=add_nonlinearity,
@@ -94,9 +246,41 @@ if __name__ == '__main__':
     parser.add_argument('--noise', help="Add extra noise to the data.",
                     required=False,
                     action='store_true')
+    parser.add_argument('--chunk-rows', help="Generate and write this many rows at a time (bounded memory).",
+                    required=False,
+                    type=int,
+                    default=None,
+                    dest='chunk_rows')
+    parser.add_argument('--format', help="Output format with --chunk-rows: csv, parquet or npy (default: from extension).",
+                    required=False,
+                    choices=['csv', 'parquet', 'npy'],
+                    default=None,
+                    dest='out_format')
+    parser.add_argument('--dtype', help="Value dtype with --chunk-rows.",
+                    required=False,
+                    choices=['uint8', 'float32'],
+                    default='float32')
+    parser.add_argument('--workers', help="Processes generating chunks in parallel.",
+                    required=False,
+                    type=int,
+                    default=1)
+    parser.add_argument('--freq', help="Time step of the DateTime index with --chunk-rows (fixed, e.g. D, h, s).",
+                    required=False,
+                    type=str,
+                    default='D')
+    parser.add_argument('--seed', help="Random seed.",
+                    required=False,
+                    type=int,
+                    default=42)
     args = parser.parse_args()
 
     main(n_features=args.n_feats,
          n_time_steps=args.n_steps,
          add_extra_noise=args.noise,
-         out_filename=args.out)
\ No newline at end of file
+         out_filename=args.out,
+         chunk_rows=args.chunk_rows,
+         out_format=args.out_format,
+         dtype=args.dtype,
+         workers=args.workers,
+         random_state=args.seed,
+         freq=args.freq)
\ No newline at end of file
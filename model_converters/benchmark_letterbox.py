@@ -0,0 +1,69 @@
+"""
+Benchmark letterbox preprocessing of 1080p frames: letterbox_image (PIL
+BICUBIC, new canvas per frame) against LetterboxPreprocessor (cached layout,
+preallocated NHWC buffer) for each interpolation mode and dtype.
+
+Usage example:
+python benchmark_letterbox.py --frames 200 --batch-size 4 --input-size 416
+"""
+import argparse
+import time
+
+import numpy as np
+from PIL import Image
+
+from yolo3.utils import LetterboxPreprocessor, letterbox_image
+
+
+def arg_parse():
+    """Parse arguements to the benchmark"""
+    parser = argparse.ArgumentParser(description='Letterbox preprocessing benchmark')
+    parser.add_argument("--frames", dest='frames', default=200, type=int,
+                        help="Number of frames to preprocess per method")
+    parser.add_argument("--batch-size", dest='batch_size', default=4, type=int,
+                        help="Frames per batch")
+    parser.add_argument("--input-size", dest='input_size', default=416, type=int,
+                        help="Network input width and height")
+    parser.add_argument("--width", dest='width', default=1920, type=int,
+                        help="Source frame width")
+    parser.add_argument("--height", dest='height', default=1080, type=int,
+                        help="Source frame height")
+    return parser.parse_args()
+
+
+def baseline(frames, size):
+    """Current path: PIL letterbox per frame, then stack and scale"""
+    batch = [np.array(letterbox_image(Image.fromarray(f), size), dtype='float32') / 255.
+             for f in frames]
+    return np.stack(batch)
+
+
+def main(args):
+    size = (args.input_size, args.input_size)
+    # A handful of distinct frames, cycled, so generation cost is not measured
+    pool = [np.random.randint(0, 256, (args.height, args.width, 3), dtype='uint8')
+            for _ in range(args.batch_size)]
+    batches = max(1, args.frames // args.batch_size)
+
+    methods = [('letterbox_image (bicubic)', lambda frames: baseline(frames, size))]
+    for interpolation in ('bilinear', 'area'):
+        for dtype in ('float32', 'uint8'):
+            preprocessor = LetterboxPreprocessor(size, batch_size=args.batch_size,
+                                                 interpolation=interpolation, dtype=dtype)
+            methods.append(('preprocessor {} {}'.format(interpolation, dtype), preprocessor))
+
+    print('{}x{} frames -> {}x{}, batch size {}'.format(
+        args.width, args.height, args.input_size, args.input_size, args.batch_size))
+    print('{:<34} {:>12} {:>10}'.format('method', 'ms / frame', 'fps'))
+    for name, method in methods:
+        method(pool)
+        t0 = time.perf_counter()
+        for _ in range(batches):
+            method(pool)
+        elapsed = time.perf_counter() - t0
+        n = batches * args.batch_size
+        print('{:<34} {:>12.3f} {:>10.1f}'.format(name, elapsed / n * 1000, n / elapsed))
+
+
+if __name__ == '__main__':
+    main(arg_parse())
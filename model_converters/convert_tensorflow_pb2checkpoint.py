@@ -5,38 +5,138 @@ Based upon:
 https://blog.metaflow.fr/tensorflow-how-to-freeze-a-model-and-serve-it-with-a-python-api-d4f3596b3adc
 https://blog.metaflow.fr/tensorflow-saving-restoring-and-mixing-multiple-models-c4c94d5d7125
 https://stackoverflow.com/questions/33759623/tensorflow-how-to-save-restore-a-model
+
+Optionally (--optimize) the frozen graph is first run through the TensorFlow
+Graph Transform Tool to strip unused nodes, fold constants, fuse batch norm
+into conv weights and remove identity ops.  Op counts and CPU inference
+latency are reported before and after, and the optimized graph is what gets
+saved.
 """
 
 import argparse 
+import collections
+import time
+
+import numpy as np
 import tensorflow as tf
 
-def load_graph(frozen_graph_filename):
+# Graph Transform Tool passes, in order (fold_constants must precede the batch norm folds)
+OPTIMIZE_TRANSFORMS = [
+    'strip_unused_nodes',
+    'remove_nodes(op=Identity, op=CheckNumerics)',
+    'fold_constants(ignore_errors=true)',
+    'fold_batch_norms',
+    'fold_old_batch_norms',
+    'sort_by_execution_order',
+]
+
+def load_graph_def(frozen_graph_filename):
     """We load the protobuf file from the disk and parse it to retrieve the 
     unserialized graph_def"""
     with tf.gfile.GFile(frozen_graph_filename, "rb") as f:
         graph_def = tf.GraphDef()
         graph_def.ParseFromString(f.read())
+    return graph_def
 
-    # Then, we import the graph_def into a new Graph and returns it 
+def import_graph(graph_def):
+    """Import the graph_def into a new Graph and returns it"""
     with tf.Graph().as_default() as graph:
         # The name var will prefix every op/nodes in your graph
         # Since we load everything in a new graph, this is not needed
         tf.import_graph_def(graph_def, name="prefix")
     return graph
 
+def load_graph(frozen_graph_filename):
+    """Load a frozen graph file into a new Graph"""
+    return import_graph(load_graph_def(frozen_graph_filename))
+
+def optimize_graph(graph_def, input_names, output_names, transforms=OPTIMIZE_TRANSFORMS):
+    """Run the Graph Transform Tool passes over a frozen graph_def"""
+    # Only in TF 1.x builds that ship the graph transforms, needed for --optimize only
+    from tensorflow.tools.graph_transforms import TransformGraph
+    return TransformGraph(graph_def, input_names, output_names, transforms)
+
+def op_counts(graph_def):
+    """Count of nodes per op type"""
+    return collections.Counter(node.op for node in graph_def.node)
+
+def print_summary(graph_def, list_ops=False):
+    """Opt-in graph summary: op type counts, and every op name if asked"""
+    if list_ops:
+        for node in graph_def.node:
+            print(node.name)
+    counts = op_counts(graph_def)
+    print('{} ops in graph'.format(sum(counts.values())))
+    for op, count in counts.most_common():
+        print('  {:<30} {}'.format(op, count))
+
+def benchmark_graph(graph_def, input_names, output_names, input_shape, runs=20):
+    """Mean and p90 CPU latency in milliseconds over random inputs"""
+    graph = import_graph(graph_def)
+    inputs = [graph.get_tensor_by_name('prefix/{}:0'.format(n)) for n in input_names]
+    outputs = [graph.get_tensor_by_name('prefix/{}:0'.format(n)) for n in output_names]
+    feed = {}
+    for tensor in inputs:
+        shape = tensor.shape.as_list() if tensor.shape.is_fully_defined() else input_shape
+        feed[tensor] = np.random.uniform(0, 255, shape).astype(tensor.dtype.as_numpy_dtype)
+
+    config = tf.ConfigProto(device_count={'GPU': 0})
+    with tf.Session(graph=graph, config=config) as sess:
+        sess.run(outputs, feed_dict=feed)
+        timings = []
+        for _ in range(runs):
+            t0 = time.perf_counter()
+            sess.run(outputs, feed_dict=feed)
+            timings.append((time.perf_counter() - t0) * 1000)
+    return np.mean(timings), np.percentile(timings, 90)
+
+def report_optimization(graph_def, optimized_graph_def, input_names, output_names, input_shape, runs):
+    """Print op counts and latency before and after optimization"""
+    before, after = op_counts(graph_def), op_counts(optimized_graph_def)
+    print('{:<30} {:>8} {:>8}'.format('op', 'before', 'after'))
+    for op in sorted(set(before) | set(after), key=lambda o: -before.get(o, 0)):
+        if before.get(op, 0) != after.get(op, 0):
+            print('{:<30} {:>8} {:>8}'.format(op, before.get(op, 0), after.get(op, 0)))
+    print('{:<30} {:>8} {:>8}'.format('total', sum(before.values()), sum(after.values())))
+
+    for name, gdef in (('before', graph_def), ('after', optimized_graph_def)):
+        mean_ms, p90_ms = benchmark_graph(gdef, input_names, output_names, input_shape, runs)
+        print('Latency {}: mean {:.2f} ms, p90 {:.2f} ms'.format(name, mean_ms, p90_ms))
+
 
 if __name__ == '__main__':
     # Let's allow the user to pass the filename as an argument
     parser = argparse.ArgumentParser()
     parser.add_argument("--frozen_model_filename", default="results/frozen_model.pb", type=str, help="Frozen model file to import")
+    parser.add_argument("--summary", action='store_true', help="Print op type counts of the graph")
+    parser.add_argument("--list_ops", action='store_true', help="With --summary, also print every op name")
+    parser.add_argument("--optimize", action='store_true', help="Optimize the frozen graph before saving")
+    parser.add_argument("--input_names", default="Placeholder", type=str, help="Comma separated graph input names (for --optimize)")
+    parser.add_argument("--output_names", default="model_outputs", type=str, help="Comma separated graph output names (for --optimize)")
+    parser.add_argument("--input_shape", default="227,227,3", type=str, help="Input shape used to time the graph when not fully defined")
+    parser.add_argument("--optimized_filename", default=None, type=str, help="Optionally write the optimized frozen graph here")
+    parser.add_argument("--runs", default=20, type=int, help="Timed runs before/after optimization")
     args = parser.parse_args()
 
-    # We use our "load_graph" function
-    graph = load_graph(args.frozen_model_filename)
+    graph_def = load_graph_def(args.frozen_model_filename)
+
+    if args.optimize:
+        input_names = args.input_names.split(',')
+        output_names = args.output_names.split(',')
+        input_shape = [int(d) for d in args.input_shape.split(',')]
+        optimized_graph_def = optimize_graph(graph_def, input_names, output_names)
+        report_optimization(graph_def, optimized_graph_def, input_names, output_names,
+                            input_shape, args.runs)
+        graph_def = optimized_graph_def
+        if args.optimized_filename:
+            with tf.gfile.GFile(args.optimized_filename, "wb") as f:
+                f.write(graph_def.SerializeToString())
 
     # We can verify that we can access the list of operations in the graph
-    for op in graph.get_operations():
-        print(op.name)
+    if args.summary:
+        print_summary(graph_def, args.list_ops)
+
+    graph = import_graph(graph_def)
 
     with graph.as_default():
         batch_size_placeholder = tf.placeholder(tf.int64, name='batch_size_ph')
@@ -0,0 +1,91 @@
+"""
+Fold BatchNormalization into the preceding Conv2D of every DarknetConv2D_BN_Leaky
+block of a keras YOLO v3 model for inference.
+
+Checks output parity between the original and fused model on random inputs
+and reports CPU latency and parameter count before and after.  The fused
+model is saved as a full keras model (architecture + weights) because its
+layers no longer match yolo_body/tiny_yolo_body for load_weights.
+
+Usage example:
+python fuse_batchnorm.py --model yolo.h5 --full --num-anchors 3 --num-classes 80 --output yolo_fused.h5
+"""
+import argparse
+import os
+import time
+
+# Benchmark on CPU
+os.environ.setdefault('CUDA_VISIBLE_DEVICES', '-1')
+
+import numpy as np
+from keras.layers import Input
+
+from yolo3.model import fuse_batchnorm, tiny_yolo_body, yolo_body
+
+
+def arg_parse():
+    """Parse arguements to the fuse module"""
+    parser = argparse.ArgumentParser(description='YOLO v3 BatchNormalization folding')
+    parser.add_argument("--model", dest='model', required=True, type=str,
+                        help="Keras weights file to fuse")
+    parser.add_argument("--output", dest='output', default=None, type=str,
+                        help="Where to save the fused keras model (optional)")
+    parser.add_argument("--full", dest='full', action='store_true',
+                        help="Model is full YOLO v3 (yolo_body) rather than tiny")
+    parser.add_argument("--num-anchors", dest='num_anchors', default=6, type=int,
+                        help="Number of anchors passed to the model body")
+    parser.add_argument("--num-classes", dest='num_classes', default=2, type=int,
+                        help="Number of classes the model was trained with")
+    parser.add_argument("--input-size", dest='input_size', default=416, type=int,
+                        help="Input width and height (multiple of 32)")
+    parser.add_argument("--batch-size", dest='batch_size', default=2, type=int,
+                        help="Batch size of the random parity/latency inputs")
+    parser.add_argument("--runs", dest='runs', default=20, type=int,
+                        help="Timed inference runs per model")
+    parser.add_argument("--atol", dest='atol', default=1e-3, type=float,
+                        help="Maximum allowed absolute output difference")
+    return parser.parse_args()
+
+
+def time_model(model, batch, runs):
+    """Mean and p90 latency in milliseconds of predict_on_batch"""
+    model.predict_on_batch(batch)
+    timings = []
+    for _ in range(runs):
+        t0 = time.perf_counter()
+        model.predict_on_batch(batch)
+        timings.append((time.perf_counter() - t0) * 1000)
+    return np.mean(timings), np.percentile(timings, 90)
+
+
+def main(args):
+    body = yolo_body if args.full else tiny_yolo_body
+    yolo_model = body(Input(shape=(args.input_size, args.input_size, 3)),
+                      args.num_anchors, args.num_classes)
+    yolo_model.load_weights(args.model) # make sure model, anchors and classes match
+    fused_model = fuse_batchnorm(yolo_model)
+
+    batch = np.random.rand(args.batch_size, args.input_size, args.input_size, 3).astype('float32')
+    outputs = yolo_model.predict_on_batch(batch)
+    fused_outputs = fused_model.predict_on_batch(batch)
+    if not isinstance(outputs, list):
+        outputs, fused_outputs = [outputs], [fused_outputs]
+    max_diff = max(float(np.abs(o - f).max()) for o, f in zip(outputs, fused_outputs))
+    print('Max abs output difference: {:.2e}'.format(max_diff))
+    if max_diff > args.atol:
+        raise SystemExit('Fused model output differs by more than {}'.format(args.atol))
+
+    print('{:<10} {:>8} {:>12} {:>10} {:>10}'.format('model', 'layers', 'params', 'mean ms', 'p90 ms'))
+    for name, model in (('original', yolo_model), ('fused', fused_model)):
+        mean_ms, p90_ms = time_model(model, batch, args.runs)
+        print('{:<10} {:>8} {:>12,} {:>10.2f} {:>10.2f}'.format(
+            name, len(model.layers), model.count_params(), mean_ms, p90_ms))
+
+    if args.output:
+        fused_model.save(args.output)
+        print('Wrote {}'.format(args.output))
+    return fused_model
+
+
+if __name__ == '__main__':
+    main(arg_parse())
@@ -1,24 +1,141 @@
+"""
+Convert a keras YOLO v3 model (weights file) to ONNX format.
+
+By default the model is exported at a fixed 416x416 input with batch size 1.
+Options allow a dynamic batch axis, a dynamic (multiple of 32) spatial size,
+or a set of pre-built size buckets (one model per size).  Each exported size
+is validated on CPU with onnxruntime against the keras model.
+
+Usage examples:
+python keras2onnx.py --model yolo.h5
+python keras2onnx.py --model yolo.h5 --dynamic-batch --buckets 320,416,608
+python keras2onnx.py --model yolo.h5 --dynamic-batch --dynamic-size --buckets 320,416,608
+"""
+import argparse
+import os
+import time
+
+import numpy as np
+import onnx
 import onnxmltools
+import onnxruntime as ort
 from keras.layers import Input
 
-from yolo3.model import tiny_yolo_body
-import argparse
+from yolo3.model import fuse_batchnorm, tiny_yolo_body, yolo_body
 
 
 def arg_parse():
     """Parse arguements to the detect module"""
     parser = argparse.ArgumentParser(description='YOLO v3 Video Detection Module')
-   
-    parser.add_argument("--model", dest='model', help = 
+
+    parser.add_argument("--model", dest='model', help =
                         "Keras model to convert", type = str)
+    parser.add_argument("--output", dest='output', default=None, type=str,
+                        help="ONNX file to write (default: model name with .onnx)")
+    parser.add_argument("--full", dest='full', action='store_true',
+                        help="Model is full YOLO v3 (yolo_body) rather than tiny")
+    parser.add_argument("--num-anchors", dest='num_anchors', default=6, type=int,
+                        help="Number of anchors passed to the model body")
+    parser.add_argument("--num-classes", dest='num_classes', default=2, type=int,
+                        help="Number of classes the model was trained with")
+    parser.add_argument("--input-size", dest='input_size', default=416, type=int,
+                        help="Input width and height (multiple of 32)")
+    parser.add_argument("--buckets", dest='buckets', default=None, type=str,
+                        help="Comma separated input sizes, e.g. 320,416,608")
+    parser.add_argument("--dynamic-batch", dest='dynamic_batch', action='store_true',
+                        help="Export with a dynamic batch axis instead of batch size 1")
+    parser.add_argument("--dynamic-size", dest='dynamic_size', action='store_true',
+                        help="Export one model with dynamic height/width, buckets are only validated")
+    parser.add_argument("--validate-batch", dest='validate_batch', default=4, type=int,
+                        help="Batch size used to validate a dynamic batch axis")
+    parser.add_argument("--fuse-bn", dest='fuse_bn', action='store_true',
+                        help="Fold BatchNormalization into conv weights before export")
+    parser.add_argument("--target-opset", dest='target_opset', default=None, type=int,
+                        help="ONNX opset (optional)")
 
     return parser.parse_args()
 
-args = arg_parse()
 
+def build_model(args, input_size):
+    """Create the keras body for an input size (None for dynamic) and load weights"""
+    body = yolo_body if args.full else tiny_yolo_body
+    yolo_model = body(Input(shape=(input_size, input_size, 3)), args.num_anchors, args.num_classes)
+    yolo_model.load_weights(args.model) # make sure model, anchors and classes match
+    if args.fuse_bn:
+        yolo_model = fuse_batchnorm(yolo_model)
+    return yolo_model
+
+
+def set_batch_dim(onnx_model, dynamic_batch):
+    """Make the first axis of every graph input/output symbolic or fix it at 1"""
+    for value in list(onnx_model.graph.input) + list(onnx_model.graph.output):
+        dim = value.type.tensor_type.shape.dim[0]
+        if dynamic_batch:
+            dim.dim_param = 'N'
+        else:
+            dim.dim_value = 1
+    return onnx_model
+
+
+def convert(yolo_model, output_file, args):
+    """Convert a keras model and save it to output_file"""
+    onnx_model = onnxmltools.convert_keras(yolo_model, target_opset=args.target_opset)
+    onnx_model = set_batch_dim(onnx_model, args.dynamic_batch)
+    onnx.checker.check_model(onnx_model)
+    onnxmltools.utils.save_model(onnx_model, output_file)
+    print('Wrote {}'.format(output_file))
+
+
+def validate(onnx_file, yolo_model, input_size, batch_sizes):
+    """Run the ONNX model on CPU at one input size and compare to keras"""
+    session = ort.InferenceSession(onnx_file, providers=['CPUExecutionProvider'])
+    input_name = session.get_inputs()[0].name
+    for batch_size in batch_sizes:
+        batch = np.random.rand(batch_size, input_size, input_size, 3).astype('float32')
+        t0 = time.perf_counter()
+        onnx_outputs = session.run(None, {input_name: batch})
+        elapsed = (time.perf_counter() - t0) * 1000
+        keras_outputs = yolo_model.predict(batch)
+        if not isinstance(keras_outputs, list):
+            keras_outputs = [keras_outputs]
+
+        for l, (o, k) in enumerate(zip(onnx_outputs, keras_outputs)):
+            stride = 32 // (2 ** l)
+            expected = (batch_size, input_size // stride, input_size // stride)
+            if o.shape[:3] != expected:
+                raise RuntimeError('{}: output {} has shape {}, expected {}'.format(
+                    onnx_file, l, o.shape, expected))
+        max_diff = max(float(np.abs(o - k).max()) for o, k in zip(onnx_outputs, keras_outputs))
+        print('Validated {} at {}x{} batch {}: {:.1f} ms, max abs diff vs keras {:.2e}'.format(
+            os.path.basename(onnx_file), input_size, input_size, batch_size, elapsed, max_diff))
+
+
+def main(args):
+    sizes = [int(s) for s in args.buckets.split(',')] if args.buckets else [args.input_size]
+    for size in sizes:
+        if size % 32 != 0:
+            raise ValueError('Input size {} is not a multiple of 32'.format(size))
+    batch_sizes = [1, args.validate_batch] if args.dynamic_batch else [1]
+    output = args.output or os.path.splitext(args.model)[0] + '.onnx'
+
+    if args.dynamic_size:
+        yolo_model = build_model(args, None)
+        convert(yolo_model, output, args)
+        for size in sizes:
+            validate(output, yolo_model, size, batch_sizes)
+        return [output]
+
+    outputs = []
+    for size in sizes:
+        bucket_output = output
+        if len(sizes) > 1:
+            bucket_output = '{}_{}.onnx'.format(os.path.splitext(output)[0], size)
+        yolo_model = build_model(args, size)
+        convert(yolo_model, bucket_output, args)
+        validate(bucket_output, yolo_model, size, batch_sizes)
+        outputs.append(bucket_output)
+    return outputs
 
-yolo_model = tiny_yolo_body(Input(shape=(416, 416, 3)), 6, 2)         
-yolo_model.load_weights(args.model) # make sure model, anchors and classes match
 
-# # Convert it! The target_opset parameter is optional.
-# onnx_model = onnxmltools.convert_keras(keras_model, target_opset=7) 
+if __name__ == '__main__':
+    main(arg_parse())
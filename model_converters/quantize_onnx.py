@@ -0,0 +1,270 @@
+"""
+Post-training quantization of an exported YOLO ONNX model (e.g. from keras2onnx.py).
+
+Produces, next to the float model:
+- <name>_int8_dynamic.onnx - INT8 weights, activations quantized at runtime
+- <name>_int8_static.onnx - INT8 weights and activations, calibrated on a
+  YOLO-format label folder (images with a .txt of the same basename)
+- <name>_fp16.onnx - FP16 weights and compute, float32 inputs/outputs
+
+Each variant is then benchmarked on CPU with onnxruntime: file size,
+latency percentiles and mAP@0.5 delta against the float model on an
+evaluation folder in the same YOLO format.
+
+Usage example:
+python quantize_onnx.py --model yolo.onnx --anchors anchors.txt --num-classes 2 \
+    --calib-dir data/obj --eval-dir data/valid --output-dir quantized
+"""
+import argparse
+import glob
+import json
+import os
+import time
+
+import numpy as np
+import onnx
+import onnxruntime as ort
+from onnxconverter_common import float16
+from onnxruntime.quantization import (CalibrationDataReader, QuantFormat,
+                                      QuantType, quantize_dynamic,
+                                      quantize_static)
+from PIL import Image
+
+from yolo3.utils import get_anchors, letterbox_image, yolo_eval_np
+
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp')
+
+
+def arg_parse():
+    """Parse arguements to the quantization module"""
+    parser = argparse.ArgumentParser(description='YOLO ONNX post-training quantization')
+    parser.add_argument("--model", dest='model', required=True, type=str,
+                        help="Float ONNX model to quantize")
+    parser.add_argument("--anchors", dest='anchors', required=True, type=str,
+                        help="Anchors file the model was trained with")
+    parser.add_argument("--num-classes", dest='num_classes', required=True, type=int,
+                        help="Number of classes the model was trained with")
+    parser.add_argument("--calib-dir", dest='calib_dir', required=True, type=str,
+                        help="YOLO-format folder used to calibrate static INT8")
+    parser.add_argument("--eval-dir", dest='eval_dir', default=None, type=str,
+                        help="YOLO-format folder used for mAP (default: --calib-dir)")
+    parser.add_argument("--output-dir", dest='output_dir', default='quantized', type=str,
+                        help="Folder for the quantized models and report")
+    parser.add_argument("--variants", dest='variants', default='int8_dynamic,int8_static,fp16',
+                        type=str, help="Comma separated variants to produce")
+    parser.add_argument("--input-size", dest='input_size', default=416, type=int,
+                        help="Network input size used when the model input is dynamic")
+    parser.add_argument("--num-calib", dest='num_calib', default=100, type=int,
+                        help="Maximum number of calibration images")
+    parser.add_argument("--runs", dest='runs', default=50, type=int,
+                        help="Timed inference runs per model")
+    parser.add_argument("--score-threshold", dest='score_threshold', default=.05, type=float,
+                        help="Score threshold used when computing mAP")
+    return parser.parse_args()
+
+
+def list_images(folder):
+    """Images in a YOLO-format folder that have a label file next to them"""
+    images = []
+    for filename in sorted(glob.glob(os.path.join(folder, '*.*'))):
+        if os.path.splitext(filename)[1].lower() not in IMAGE_EXTENSIONS:
+            continue
+        if os.path.isfile(os.path.splitext(filename)[0] + '.txt'):
+            images.append(filename)
+    return images
+
+
+def read_yolo_labels(image_file, width, height):
+    """Read <object-class> <x_center> <y_center> <width> <height> lines and
+    return (boxes, classes) with boxes as y_min, x_min, y_max, x_max pixels"""
+    boxes, classes = [], []
+    with open(os.path.splitext(image_file)[0] + '.txt', 'r') as f:
+        for line in f:
+            if not line.strip():
+                continue
+            label, xc, yc, w, h = line.split()
+            xc, yc = float(xc) * width, float(yc) * height
+            w, h = float(w) * width, float(h) * height
+            boxes.append([yc - h/2., xc - w/2., yc + h/2., xc + w/2.])
+            classes.append(int(label))
+    return np.array(boxes, dtype='float32').reshape(-1, 4), np.array(classes, dtype='int32')
+
+
+def preprocess(image, input_size):
+    """Letterbox a PIL image into a (1, h, w, 3) float32 batch"""
+    boxed_image = letterbox_image(image.convert('RGB'), (input_size[1], input_size[0]))
+    image_data = np.array(boxed_image, dtype='float32') / 255.
+    return np.expand_dims(image_data, 0)
+
+
+def model_input_size(model_path, default_size):
+    """Spatial (h, w) of the model input, falling back when it is dynamic"""
+    shape = onnx.load(model_path).graph.input[0].type.tensor_type.shape.dim
+    h, w = shape[1].dim_value, shape[2].dim_value
+    if h > 0 and w > 0:
+        return h, w
+    return default_size, default_size
+
+
+class YoloCalibrationDataReader(CalibrationDataReader):
+    """Feeds letterboxed images from a YOLO-format folder to quantize_static"""
+
+    def __init__(self, images, input_name, input_size):
+        self.images = iter(images)
+        self.input_name = input_name
+        self.input_size = input_size
+
+    def get_next(self):
+        image_file = next(self.images, None)
+        if image_file is None:
+            return None
+        return {self.input_name: preprocess(Image.open(image_file), self.input_size)}
+
+
+def quantize(model_path, output_dir, variants, calib_images, input_size):
+    """Write each requested variant and return {variant: path}"""
+    base = os.path.splitext(os.path.basename(model_path))[0]
+    paths = {}
+    for variant in variants:
+        out_path = os.path.join(output_dir, '{}_{}.onnx'.format(base, variant))
+        if variant == 'int8_dynamic':
+            quantize_dynamic(model_path, out_path, weight_type=QuantType.QUInt8)
+        elif variant == 'int8_static':
+            input_name = onnx.load(model_path).graph.input[0].name
+            reader = YoloCalibrationDataReader(calib_images, input_name, input_size)
+            quantize_static(model_path, out_path, reader,
+                            quant_format=QuantFormat.QDQ,
+                            activation_type=QuantType.QUInt8,
+                            weight_type=QuantType.QInt8)
+        elif variant == 'fp16':
+            model_fp16 = float16.convert_float_to_float16(onnx.load(model_path),
+                                                          keep_io_types=True)
+            onnx.save(model_fp16, out_path)
+        else:
+            raise ValueError('Unknown quantization variant: {}'.format(variant))
+        print('Wrote {}'.format(out_path))
+        paths[variant] = out_path
+    return paths
+
+
+def benchmark_latency(session, input_size, runs):
+    """Latency percentiles in milliseconds for a single image on CPU"""
+    input_name = session.get_inputs()[0].name
+    batch = np.random.rand(1, input_size[0], input_size[1], 3).astype('float32')
+    for _ in range(5):
+        session.run(None, {input_name: batch})
+    timings = []
+    for _ in range(runs):
+        t0 = time.perf_counter()
+        session.run(None, {input_name: batch})
+        timings.append((time.perf_counter() - t0) * 1000)
+    p50, p90, p99 = np.percentile(timings, [50, 90, 99])
+    return {'p50_ms': p50, 'p90_ms': p90, 'p99_ms': p99, 'mean_ms': float(np.mean(timings))}
+
+
+def average_precision(recall, precision):
+    """All-point interpolated AP (VOC 2010+)"""
+    mrec = np.concatenate(([0.], recall, [1.]))
+    mpre = np.concatenate(([0.], precision, [0.]))
+    mpre = np.maximum.accumulate(mpre[::-1])[::-1]
+    i = np.where(mrec[1:] != mrec[:-1])[0]
+    return np.sum((mrec[i + 1] - mrec[i]) * mpre[i + 1])
+
+
+def box_iou_np(box, boxes):
+    """IoU of one y_min, x_min, y_max, x_max box against many"""
+    inter_min = np.maximum(box[0:2], boxes[:, 0:2])
+    inter_max = np.minimum(box[2:4], boxes[:, 2:4])
+    inter_hw = np.maximum(inter_max - inter_min, 0.)
+    inter_area = inter_hw[:, 0] * inter_hw[:, 1]
+    area = (box[2]-box[0]) * (box[3]-box[1])
+    areas = (boxes[:, 2]-boxes[:, 0]) * (boxes[:, 3]-boxes[:, 1])
+    return inter_area / np.maximum(area + areas - inter_area, 1e-9)
+
+
+def evaluate_map(session, images, anchors, num_classes, input_size,
+                 score_threshold, iou_threshold=.5):
+    """mAP@iou_threshold of a session over a YOLO-format image list"""
+    input_name = session.get_inputs()[0].name
+    detections = [[] for _ in range(num_classes)]
+    ground_truth = {}
+    num_gt = np.zeros(num_classes, dtype='int32')
+
+    for image_id, image_file in enumerate(images):
+        image = Image.open(image_file)
+        width, height = image.size
+        gt_boxes, gt_classes = read_yolo_labels(image_file, width, height)
+        ground_truth[image_id] = (gt_boxes, gt_classes, np.zeros(len(gt_classes), dtype=bool))
+        num_gt += np.bincount(gt_classes, minlength=num_classes)[:num_classes]
+
+        outputs = session.run(None, {input_name: preprocess(image, input_size)})
+        boxes, scores, classes = yolo_eval_np([o[0] for o in outputs], anchors, num_classes,
+                                              (height, width),
+                                              max_boxes=100,
+                                              score_threshold=score_threshold,
+                                              input_shape=input_size)
+        for box, score, c in zip(boxes, scores, classes):
+            detections[c].append((score, image_id, box))
+
+    aps = []
+    for c in range(num_classes):
+        if num_gt[c] == 0:
+            continue
+        dets = sorted(detections[c], key=lambda d: -d[0])
+        tp = np.zeros(len(dets))
+        for i, (_, image_id, box) in enumerate(dets):
+            gt_boxes, gt_classes, matched = ground_truth[image_id]
+            candidates = np.where(gt_classes == c)[0]
+            if len(candidates) == 0:
+                continue
+            ious = box_iou_np(box, gt_boxes[candidates])
+            best = np.argmax(ious)
+            if ious[best] >= iou_threshold and not matched[candidates[best]]:
+                matched[candidates[best]] = True
+                tp[i] = 1
+        tp = np.cumsum(tp)
+        recall = tp / num_gt[c]
+        precision = tp / np.arange(1, len(dets) + 1)
+        aps.append(average_precision(recall, precision))
+    return float(np.mean(aps)) if aps else 0.
+
+
+def main(args):
+    os.makedirs(args.output_dir, exist_ok=True)
+    anchors = get_anchors(args.anchors)
+    input_size = model_input_size(args.model, args.input_size)
+    calib_images = list_images(args.calib_dir)[:args.num_calib]
+    eval_images = list_images(args.eval_dir or args.calib_dir)
+    if not calib_images or not eval_images:
+        raise SystemExit('No labeled images found in calibration/evaluation folder')
+
+    variants = [v.strip() for v in args.variants.split(',') if v.strip()]
+    models = {'float': args.model}
+    models.update(quantize(args.model, args.output_dir, variants, calib_images, input_size))
+
+    report = {}
+    for name, path in models.items():
+        session = ort.InferenceSession(path, providers=['CPUExecutionProvider'])
+        report[name] = {'path': path, 'size_mb': os.path.getsize(path) / 1e6}
+        report[name].update(benchmark_latency(session, input_size, args.runs))
+        report[name]['map50'] = evaluate_map(session, eval_images, anchors,
+                                             args.num_classes, input_size,
+                                             args.score_threshold)
+    for name in report:
+        report[name]['map50_delta'] = report[name]['map50'] - report['float']['map50']
+
+    print('{:<14} {:>9} {:>9} {:>9} {:>9} {:>8} {:>8}'.format(
+        'model', 'size MB', 'p50 ms', 'p90 ms', 'p99 ms', 'mAP50', 'delta'))
+    for name, r in report.items():
+        print('{:<14} {:>9.2f} {:>9.2f} {:>9.2f} {:>9.2f} {:>8.4f} {:>+8.4f}'.format(
+            name, r['size_mb'], r['p50_ms'], r['p90_ms'], r['p99_ms'],
+            r['map50'], r['map50_delta']))
+
+    with open(os.path.join(args.output_dir, 'quantization_report.json'), 'w') as f:
+        json.dump(report, f, indent=4)
+    return report
+
+
+if __name__ == '__main__':
+    main(arg_parse())
@@ -0,0 +1,309 @@
+"""
+Batched YOLO v3 inference on frames sampled from one or more RTSP streams
+(e.g. the simulated cameras served by video_tools/rtsp-server.py).
+
+Stages run on their own threads, connected by bounded queues so they overlap:
+
+capture (GStreamer appsink per URL, sampled at --sample-fps)
+  -> preprocess (LetterboxPreprocessor into an NHWC batch)
+  -> inference (keras yolo_body/tiny_yolo_body weights, or an exported ONNX model)
+  -> postprocess (yolo_eval semantics via yolo_eval_np)
+
+When a queue is full the newest sampled frame is dropped rather than building
+up latency.  Per-stage latency and end-to-end latency are reported at the end
+and every --report-interval seconds.
+
+Usage examples:
+python rtsp_inference.py --urls rtsp://127.0.0.1:8554/cam1,rtsp://127.0.0.1:8554/cam2 \
+    --onnx yolo.onnx --anchors anchors.txt --num-classes 2 --sample-fps 5 --batch-size 4
+python rtsp_inference.py --urls rtsp://127.0.0.1:8554/stream1 --weights yolo.h5 --full \
+    --num-anchors 3 --num-classes 80 --anchors anchors.txt --output detections.jsonl
+"""
+import argparse
+import itertools
+import json
+import queue
+import threading
+import time
+
+import gi
+import numpy as np
+
+gi.require_version('Gst', '1.0')
+
+from gi.repository import Gst, GLib
+
+from yolo3.utils import LetterboxPreprocessor, get_anchors, yolo_eval_np
+
+
+STOP = object()
+STAGES = ('capture', 'preprocess', 'inference', 'postprocess', 'end_to_end')
+
+
+def arg_parse():
+    """Parse arguements to the inference bridge"""
+    parser = argparse.ArgumentParser(description='YOLO v3 inference on RTSP streams')
+    parser.add_argument("--urls", dest='urls', required=True, type=str,
+                        help="Comma separated RTSP URLs")
+    parser.add_argument("--onnx", dest='onnx', default=None, type=str,
+                        help="Exported ONNX model (see keras2onnx.py)")
+    parser.add_argument("--weights", dest='weights', default=None, type=str,
+                        help="Keras weights file, used when --onnx is not given")
+    parser.add_argument("--full", dest='full', action='store_true',
+                        help="Keras model is full YOLO v3 (yolo_body) rather than tiny")
+    parser.add_argument("--num-anchors", dest='num_anchors', default=6, type=int,
+                        help="Number of anchors passed to the keras model body")
+    parser.add_argument("--num-classes", dest='num_classes', required=True, type=int,
+                        help="Number of classes the model was trained with")
+    parser.add_argument("--anchors", dest='anchors', required=True, type=str,
+                        help="Anchors file the model was trained with")
+    parser.add_argument("--input-size", dest='input_size', default=416, type=int,
+                        help="Network input width and height")
+    parser.add_argument("--sample-fps", dest='sample_fps', default=5., type=float,
+                        help="Frames per second sampled from each stream")
+    parser.add_argument("--batch-size", dest='batch_size', default=4, type=int,
+                        help="Maximum frames per inference batch")
+    parser.add_argument("--batch-timeout", dest='batch_timeout', default=0.05, type=float,
+                        help="Seconds to wait for a batch to fill")
+    parser.add_argument("--queue-size", dest='queue_size', default=4, type=int,
+                        help="Bound of each inter-stage queue")
+    parser.add_argument("--score-threshold", dest='score_threshold', default=.3, type=float,
+                        help="Minimum box score")
+    parser.add_argument("--iou-threshold", dest='iou_threshold', default=.45, type=float,
+                        help="NMS IoU threshold")
+    parser.add_argument("--duration", dest='duration', default=0, type=int,
+                        help="Seconds to run (0 runs until interrupted)")
+    parser.add_argument("--report-interval", dest='report_interval', default=10, type=int,
+                        help="Seconds between latency reports (0 to disable)")
+    parser.add_argument("--output", dest='output', default=None, type=str,
+                        help="Write detections as JSON lines")
+    return parser.parse_args()
+
+
+class StageTimings():
+    """Thread-safe per-stage latency samples in milliseconds"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.samples = {stage: [] for stage in STAGES}
+        self.dropped = 0
+
+    def add(self, stage, seconds):
+        with self.lock:
+            self.samples[stage].append(seconds * 1000)
+
+    def drop(self):
+        """Count a sampled frame dropped because the queue was full"""
+        with self.lock:
+            self.dropped += 1
+
+    def report(self):
+        with self.lock:
+            samples = {stage: list(values) for stage, values in self.samples.items()}
+            dropped = self.dropped
+        print('{:<12} {:>8} {:>9} {:>9} {:>9}'.format('stage', 'count', 'p50 ms', 'p90 ms', 'max ms'))
+        for stage, values in samples.items():
+            if values:
+                p50, p90 = np.percentile(values, [50, 90])
+                print('{:<12} {:>8} {:>9.1f} {:>9.1f} {:>9.1f}'.format(
+                    stage, len(values), p50, p90, max(values)))
+        print('dropped frames: {}'.format(dropped))
+        return True # keep GLib.timeout_add_seconds callbacks alive
+
+
+class StreamCapture():
+    """Decodes one RTSP URL to RGB frames and samples them into a queue"""
+
+    def __init__(self, stream_id, url, sample_fps, out_queue, timings):
+        self.stream_id = stream_id
+        self.interval = 1. / sample_fps
+        self.last_sample = 0
+        self.out_queue = out_queue
+        self.timings = timings
+        self.pipeline = Gst.parse_launch(
+            'rtspsrc location={} latency=0 ! decodebin ! videoconvert ! video/x-raw,format=RGB ! '
+            'appsink name=sink emit-signals=true max-buffers=1 drop=true sync=false'.format(url))
+        self.pipeline.get_by_name('sink').connect('new-sample', self.on_new_sample)
+
+    def on_new_sample(self, sink):
+        sample = sink.emit('pull-sample')
+        now = time.monotonic()
+        if now - self.last_sample < self.interval:
+            return Gst.FlowReturn.OK
+        self.last_sample = now
+
+        buf = sample.get_buffer()
+        structure = sample.get_caps().get_structure(0)
+        width, height = structure.get_value('width'), structure.get_value('height')
+        data = np.frombuffer(buf.extract_dup(0, buf.get_size()), dtype=np.uint8)
+        # Rows may be padded to 4 bytes
+        frame = data.reshape(height, -1)[:, :width * 3].reshape(height, width, 3)
+        self.timings.add('capture', time.monotonic() - now)
+        try:
+            self.out_queue.put_nowait((self.stream_id, now, frame))
+        except queue.Full:
+            self.timings.drop()
+        return Gst.FlowReturn.OK
+
+    def start(self):
+        self.pipeline.set_state(Gst.State.PLAYING)
+
+    def stop(self):
+        self.pipeline.set_state(Gst.State.NULL)
+
+
+def load_predict(args):
+    """Return a function running a (n, h, w, 3) float32 batch through the model"""
+    if args.onnx:
+        import onnxruntime as ort
+        session = ort.InferenceSession(args.onnx, providers=['CPUExecutionProvider'])
+        input_name = session.get_inputs()[0].name
+        return lambda batch: session.run(None, {input_name: batch})
+
+    from keras import backend as K
+    from keras.layers import Input
+    from yolo3.model import tiny_yolo_body, yolo_body
+    body = yolo_body if args.full else tiny_yolo_body
+    yolo_model = body(Input(shape=(args.input_size, args.input_size, 3)),
+                      args.num_anchors, args.num_classes)
+    yolo_model.load_weights(args.weights) # make sure model, anchors and classes match
+    # The model lives in this thread's default graph and session, build the
+    # predict function now and enter them on the inference thread
+    yolo_model._make_predict_function()
+    session = K.get_session()
+    graph = session.graph
+
+    def predict(batch):
+        with graph.as_default(), session.as_default():
+            return yolo_model.predict_on_batch(batch)
+    return predict
+
+
+def put_stop(out_queue):
+    """Queue STOP without blocking, dropping the oldest items of a full queue"""
+    while True:
+        try:
+            out_queue.put_nowait(STOP)
+            return
+        except queue.Full:
+            try:
+                out_queue.get_nowait()
+            except queue.Empty:
+                pass
+
+
+def preprocess_stage(args, in_queue, out_queue, timings):
+    """Collect up to batch_size frames and letterbox them into a batch"""
+    size = (args.input_size, args.input_size)
+    # Batches are handed on while the next is filled, so rotate enough buffers
+    preprocessors = itertools.cycle([LetterboxPreprocessor(size, batch_size=args.batch_size)
+                                     for _ in range(args.queue_size + 2)])
+    while True:
+        item = in_queue.get()
+        if item is STOP:
+            break
+        items = [item]
+        deadline = time.monotonic() + args.batch_timeout
+        while len(items) < args.batch_size:
+            try:
+                item = in_queue.get(timeout=max(deadline - time.monotonic(), 0))
+            except queue.Empty:
+                break
+            if item is STOP:
+                in_queue.put(STOP)
+                break
+            items.append(item)
+
+        t0 = time.monotonic()
+        batch = next(preprocessors)([frame for _, _, frame in items])
+        meta = [(stream_id, capture_time, frame.shape[:2]) for stream_id, capture_time, frame in items]
+        timings.add('preprocess', time.monotonic() - t0)
+        out_queue.put((meta, batch))
+    out_queue.put(STOP)
+
+
+def inference_stage(predict, in_queue, out_queue, timings):
+    while True:
+        item = in_queue.get()
+        if item is STOP:
+            break
+        meta, batch = item
+        t0 = time.monotonic()
+        outputs = predict(batch)
+        if not isinstance(outputs, list):
+            outputs = [outputs]
+        timings.add('inference', time.monotonic() - t0)
+        out_queue.put((meta, outputs))
+    out_queue.put(STOP)
+
+
+def postprocess_stage(args, anchors, in_queue, timings, output_file):
+    input_shape = (args.input_size, args.input_size)
+    while True:
+        item = in_queue.get()
+        if item is STOP:
+            break
+        meta, outputs = item
+        t0 = time.monotonic()
+        for i, (stream_id, capture_time, image_shape) in enumerate(meta):
+            boxes, scores, classes = yolo_eval_np([o[i] for o in outputs], anchors,
+                                                  args.num_classes, image_shape,
+                                                  score_threshold=args.score_threshold,
+                                                  iou_threshold=args.iou_threshold,
+                                                  input_shape=input_shape)
+            done = time.monotonic()
+            timings.add('end_to_end', done - capture_time)
+            if output_file is not None:
+                output_file.write(json.dumps({
+                    'stream': stream_id, 'capture_time': capture_time,
+                    'boxes': boxes.round(1).tolist(), 'scores': scores.round(4).tolist(),
+                    'classes': classes.tolist()}) + '\n')
+        timings.add('postprocess', time.monotonic() - t0)
+
+
+def main(args):
+    if not args.onnx and not args.weights:
+        raise SystemExit('One of --onnx or --weights is required')
+    Gst.init(None)
+    anchors = get_anchors(args.anchors)
+    predict = load_predict(args)
+    timings = StageTimings()
+    captured, preprocessed, inferred = [queue.Queue(maxsize=args.queue_size) for _ in range(3)]
+    output_file = open(args.output, 'w') if args.output else None
+
+    captures = [StreamCapture(url, url, args.sample_fps, captured, timings)
+                for url in args.urls.split(',')]
+    threads = [
+        threading.Thread(target=preprocess_stage, args=(args, captured, preprocessed, timings)),
+        threading.Thread(target=inference_stage, args=(predict, preprocessed, inferred, timings)),
+        threading.Thread(target=postprocess_stage, args=(args, anchors, inferred, timings, output_file)),
+    ]
+    for thread in threads:
+        thread.start()
+    for capture in captures:
+        capture.start()
+
+    loop = GLib.MainLoop()
+    if args.duration > 0:
+        GLib.timeout_add_seconds(args.duration, loop.quit)
+    if args.report_interval > 0:
+        GLib.timeout_add_seconds(args.report_interval, timings.report)
+    try:
+        loop.run()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for capture in captures:
+            capture.stop()
+        # Frames left in a full queue are not worth blocking shutdown for
+        put_stop(captured)
+        for thread in threads:
+            thread.join()
+        if output_file is not None:
+            output_file.close()
+    timings.report()
+    return timings
+
+
+if __name__ == '__main__':
+    main(arg_parse())
@@ -6,6 +6,7 @@ import numpy as np
 import tensorflow as tf
 from keras import backend as K
 from keras.layers import Conv2D, Add, ZeroPadding2D, UpSampling2D, Concatenate, MaxPooling2D
+from keras.layers import Input, InputLayer
 from keras.layers.advanced_activations import LeakyReLU
 from keras.layers.normalization import BatchNormalization
 from keras.models import Model
@@ -119,6 +120,58 @@ def tiny_yolo_body(inputs, num_anchors, num_classes):
     return Model(inputs, [y1,y2])
 
 
+def fold_batchnorm_weights(conv, bn):
+    """Kernel and bias of a Conv2D with the following BatchNormalization folded in."""
+    conv_weights = conv.get_weights()
+    kernel = conv_weights[0]
+    bias = conv_weights[1] if conv.use_bias else np.zeros(kernel.shape[-1], dtype=kernel.dtype)
+
+    bn_weights = list(bn.get_weights())
+    gamma = bn_weights.pop(0) if bn.scale else np.ones_like(bias)
+    beta = bn_weights.pop(0) if bn.center else np.zeros_like(bias)
+    moving_mean, moving_variance = bn_weights
+
+    factor = gamma / np.sqrt(moving_variance + bn.epsilon)
+    return [kernel * factor, beta + (bias - moving_mean) * factor]
+
+def fuse_batchnorm(model):
+    """Inference-only copy of a model (e.g. yolo_body, tiny_yolo_body) with every
+    Conv2D -> BatchNormalization pair of DarknetConv2D_BN_Leaky folded into a
+    single biased Conv2D. Other layers and weights are copied unchanged."""
+    convs = {layer.output.name: layer for layer in model.layers if isinstance(layer, Conv2D)}
+    fused = {} # conv name -> batch norm folded into it
+    skipped = set() # batch norm layers that disappear
+    for layer in model.layers:
+        if isinstance(layer, BatchNormalization) and layer.input.name in convs:
+            fused[convs[layer.input.name].name] = layer
+            skipped.add(layer.name)
+
+    tensors = {t.name: Input(batch_shape=K.int_shape(t), dtype=K.dtype(t)) for t in model.inputs}
+    for layer in model.layers:
+        if isinstance(layer, InputLayer):
+            continue
+        if isinstance(layer.input, list):
+            x = [tensors[t.name] for t in layer.input]
+        else:
+            x = tensors[layer.input.name]
+        if layer.name in skipped:
+            tensors[layer.output.name] = x
+            continue
+
+        config = layer.get_config()
+        if layer.name in fused:
+            config['use_bias'] = True
+        new_layer = layer.__class__.from_config(config)
+        tensors[layer.output.name] = new_layer(x)
+        if layer.name in fused:
+            new_layer.set_weights(fold_batchnorm_weights(layer, fused[layer.name]))
+        else:
+            new_layer.set_weights(layer.get_weights())
+
+    return Model([tensors[t.name] for t in model.inputs],
+                 [tensors[t.name] for t in model.outputs])
+
+
 def yolo_head(feats, anchors, num_classes, input_shape, calc_loss=False):
     """Convert final layer features to bounding box parameters."""
     num_anchors = len(anchors)
@@ -190,11 +243,17 @@ def yolo_eval(yolo_outputs,
               image_shape,
               max_boxes=20,
               score_threshold=.6,
-              iou_threshold=.5):
-    """Evaluate YOLO model on given input and return filtered boxes."""
+              iou_threshold=.5,
+              input_shape=None):
+    """Evaluate YOLO model on given input and return filtered boxes.
+
+    input_shape (hw) defaults to the first output grid * 32, so models
+    exported with a dynamic spatial size decode at whatever size they ran.
+    """
     num_layers = len(yolo_outputs)
     anchor_mask = [[6,7,8], [3,4,5], [0,1,2]] if num_layers==3 else [[3,4,5], [1,2,3]] # default setting
-    input_shape = K.shape(yolo_outputs[0])[1:3] * 32
+    if input_shape is None:
+        input_shape = K.shape(yolo_outputs[0])[1:3] * 32
     boxes = []
     box_scores = []
     for l in range(num_layers):
@@ -5,6 +5,10 @@ from functools import reduce
 from PIL import Image
 import numpy as np
 from matplotlib.colors import rgb_to_hsv, hsv_to_rgb
+try:
+    import cv2
+except ImportError:
+    cv2 = None # LetterboxPreprocessor falls back to PIL
 
 def compose(*funcs):
     """Compose arbitrarily many functions, evaluated left to right.
@@ -30,6 +34,204 @@ def letterbox_image(image, size):
     new_image.paste(image, ((w-nw)//2, (h-nh)//2))
     return new_image
 
+class LetterboxPreprocessor(object):
+    '''letterbox_image for streams of NumPy HWC uint8 frames, producing NHWC batches
+
+    Scale and offset are cached per source size and every batch is written into
+    one preallocated buffer, so a stream whose frame size never changes does not
+    allocate per frame. The returned batch is only valid until the next call.
+
+    Parameters
+    ----------
+    size: wh of the network input
+    batch_size: integer, maximum number of frames per call
+    interpolation: 'bilinear' or 'area'
+    dtype: 'float32' (scaled to 0-1) or 'uint8'
+    bgr_to_rgb: swap channels, for frames coming from OpenCV
+    '''
+
+    def __init__(self, size, batch_size=1, interpolation='bilinear', dtype='float32',
+                 bgr_to_rgb=False, fill=128):
+        if interpolation not in ('bilinear', 'area'):
+            raise ValueError('interpolation must be bilinear or area')
+        self.size = size
+        self.fill = fill
+        self.bgr_to_rgb = bgr_to_rgb
+        if cv2 is not None:
+            self.resample = {'bilinear': cv2.INTER_LINEAR, 'area': cv2.INTER_AREA}[interpolation]
+        else:
+            self.resample = {'bilinear': Image.BILINEAR, 'area': Image.BOX}[interpolation]
+        w, h = size
+        self.canvas = np.full((batch_size, h, w, 3), fill, dtype='uint8')
+        if np.dtype(dtype) == np.uint8:
+            self.batch = self.canvas
+        else:
+            self.batch = np.empty((batch_size, h, w, 3), dtype=dtype)
+        self.layouts = {}
+        self.slot_layouts = [None] * batch_size
+
+    def layout(self, image_shape):
+        '''(scale, nw, nh, dx, dy) for a source hw, same math as letterbox_image'''
+        image_shape = tuple(image_shape[:2])
+        if image_shape not in self.layouts:
+            ih, iw = image_shape
+            w, h = self.size
+            scale = min(w/iw, h/ih)
+            nw = int(iw*scale)
+            nh = int(ih*scale)
+            self.layouts[image_shape] = (scale, nw, nh, (w-nw)//2, (h-nh)//2)
+        return self.layouts[image_shape]
+
+    def letterbox_into(self, frame, index):
+        '''Letterbox one frame into slot index of the uint8 canvas'''
+        layout = self.layout(frame.shape)
+        _, nw, nh, dx, dy = layout
+        if self.slot_layouts[index] != layout:
+            # Border only needs repainting when the source size changes
+            self.canvas[index].fill(self.fill)
+            self.slot_layouts[index] = layout
+        roi = self.canvas[index, dy:dy+nh, dx:dx+nw]
+
+        if cv2 is not None:
+            # Resize straight into the canvas when the padded area is a contiguous band
+            direct = roi.flags['C_CONTIGUOUS'] and not self.bgr_to_rgb
+            resized = cv2.resize(frame, (nw, nh), dst=roi if direct else None,
+                                 interpolation=self.resample)
+            if resized is roi:
+                return
+        else:
+            resized = np.asarray(Image.fromarray(frame).resize((nw, nh), self.resample))
+        roi[...] = resized[..., ::-1] if self.bgr_to_rgb else resized
+
+    def __call__(self, frames):
+        '''Letterbox a list of frames into an (n, h, w, 3) batch'''
+        n = len(frames)
+        if n > len(self.canvas):
+            raise ValueError('{} frames exceed batch size {}'.format(n, len(self.canvas)))
+        for i, frame in enumerate(frames):
+            self.letterbox_into(frame, i)
+        if self.batch is self.canvas:
+            return self.batch[:n]
+        np.multiply(self.canvas[:n], 1/255., out=self.batch[:n], casting='unsafe')
+        return self.batch[:n]
+
+def get_anchors(anchors_path):
+    '''loads the anchors from a file (e.g. output of calc_anchors_yolo_format.py)'''
+    with open(anchors_path) as f:
+        anchors = f.readline()
+    anchors = [float(x) for x in anchors.split(',')]
+    return np.array(anchors).reshape(-1, 2)
+
+def sigmoid(x):
+    return 1. / (1. + np.exp(-x))
+
+def yolo_boxes_and_scores_np(feats, anchors, num_classes, input_shape, image_shape):
+    '''NumPy counterpart of model.yolo_boxes_and_scores for a single image
+
+    Parameters
+    ----------
+    feats: array, shape=(grid_h, grid_w, num_anchors*(num_classes+5))
+    anchors: array, shape=(num_anchors, 2), wh
+    num_classes: integer
+    input_shape: hw of the network input
+    image_shape: hw of the original image
+
+    Returns
+    -------
+    boxes: array, shape=(n, 4), y_min, x_min, y_max, x_max in image pixels
+    box_scores: array, shape=(n, num_classes)
+    '''
+    grid_h, grid_w = feats.shape[0:2]
+    num_anchors = len(anchors)
+    feats = feats.reshape(grid_h, grid_w, num_anchors, num_classes + 5)
+    grid_x = np.arange(grid_w).reshape(1, -1, 1)
+    grid_y = np.arange(grid_h).reshape(-1, 1, 1)
+    input_shape = np.array(input_shape, dtype='float32')
+    image_shape = np.array(image_shape, dtype='float32')
+
+    box_x = (sigmoid(feats[..., 0]) + grid_x) / grid_w
+    box_y = (sigmoid(feats[..., 1]) + grid_y) / grid_h
+    box_w = np.exp(feats[..., 2]) * anchors[:, 0] / input_shape[1]
+    box_h = np.exp(feats[..., 3]) * anchors[:, 1] / input_shape[0]
+    box_confidence = sigmoid(feats[..., 4:5])
+    box_class_probs = sigmoid(feats[..., 5:])
+
+    # Undo the letterbox, same as model.yolo_correct_boxes
+    new_shape = np.round(image_shape * np.min(input_shape/image_shape))
+    offset = (input_shape-new_shape)/2./input_shape
+    scale = input_shape/new_shape
+    box_y = (box_y - offset[0]) * scale[0]
+    box_x = (box_x - offset[1]) * scale[1]
+    box_h = box_h * scale[0]
+    box_w = box_w * scale[1]
+    boxes = np.stack([box_y - box_h/2., box_x - box_w/2.,
+                      box_y + box_h/2., box_x + box_w/2.], axis=-1)
+    boxes *= np.tile(image_shape, 2)
+
+    box_scores = box_confidence * box_class_probs
+    return boxes.reshape(-1, 4), box_scores.reshape(-1, num_classes)
+
+def non_max_suppression(boxes, scores, max_boxes, iou_threshold):
+    '''Greedy NMS over y_min, x_min, y_max, x_max boxes, returns kept indices'''
+    areas = (boxes[:, 2]-boxes[:, 0]) * (boxes[:, 3]-boxes[:, 1])
+    order = np.argsort(-scores)
+    keep = []
+    while order.size > 0 and len(keep) < max_boxes:
+        i = order[0]
+        keep.append(i)
+        rest = order[1:]
+        inter_min = np.maximum(boxes[i, 0:2], boxes[rest, 0:2])
+        inter_max = np.minimum(boxes[i, 2:4], boxes[rest, 2:4])
+        inter_hw = np.maximum(inter_max - inter_min, 0.)
+        inter_area = inter_hw[:, 0] * inter_hw[:, 1]
+        iou = inter_area / np.maximum(areas[i] + areas[rest] - inter_area, 1e-9)
+        order = rest[iou <= iou_threshold]
+    return np.array(keep, dtype='int32')
+
+def yolo_eval_np(yolo_outputs,
+                 anchors,
+                 num_classes,
+                 image_shape,
+                 max_boxes=20,
+                 score_threshold=.6,
+                 iou_threshold=.5,
+                 input_shape=None):
+    '''NumPy counterpart of model.yolo_eval for a single image
+
+    Used when the model runs outside of Keras (e.g. an exported ONNX model).
+    yolo_outputs holds one array per output layer, without the batch axis.
+    '''
+    num_layers = len(yolo_outputs)
+    anchor_mask = [[6,7,8], [3,4,5], [0,1,2]] if num_layers==3 else [[3,4,5], [1,2,3]] # default setting
+    if input_shape is None:
+        input_shape = np.array(yolo_outputs[0].shape[0:2]) * 32
+    boxes = []
+    box_scores = []
+    for l in range(num_layers):
+        _boxes, _box_scores = yolo_boxes_and_scores_np(yolo_outputs[l],
+            anchors[anchor_mask[l]], num_classes, input_shape, image_shape)
+        boxes.append(_boxes)
+        box_scores.append(_box_scores)
+    boxes = np.concatenate(boxes, axis=0)
+    box_scores = np.concatenate(box_scores, axis=0)
+
+    mask = box_scores >= score_threshold
+    boxes_ = []
+    scores_ = []
+    classes_ = []
+    for c in range(num_classes):
+        class_boxes = boxes[mask[:, c]]
+        class_box_scores = box_scores[:, c][mask[:, c]]
+        nms_index = non_max_suppression(class_boxes, class_box_scores, max_boxes, iou_threshold)
+        boxes_.append(class_boxes[nms_index])
+        scores_.append(class_box_scores[nms_index])
+        classes_.append(np.full(len(nms_index), c, dtype='int32'))
+    boxes_ = np.concatenate(boxes_, axis=0)
+    scores_ = np.concatenate(scores_, axis=0)
+    classes_ = np.concatenate(classes_, axis=0)
+
+    return boxes_, scores_, classes_
+
 def rand(a=0, b=1):
     return np.random.rand()*(b-a) + a
 
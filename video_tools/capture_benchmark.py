@@ -0,0 +1,87 @@
+"""
+Test harness for the live server capture path (frame_capture.py) without a
+camera or GStreamer: a SyntheticSource feeds a CaptureThread and a consumer
+thread plays the part of the appsrc push loop, including periodic
+enough-data stalls.  Reports end-to-end latency (capture to push) and dropped
+frames for each buffer policy.
+
+Usage example:
+python capture_benchmark.py --seconds 10 --fps 30 --consumer-ms 20 --stall-every 2 --stall-ms 300
+"""
+import argparse
+import threading
+import time
+
+import numpy as np
+
+from frame_capture import CaptureThread, FrameRingBuffer, SyntheticSource
+
+
+def run_policy(policy, args):
+    """Run one capture/consume session, returns (latencies in ms, frames, dropped)"""
+    source = SyntheticSource(args.width, args.height, args.fps,
+                             num_frames=int(args.seconds * args.fps))
+    frame_buffer = FrameRingBuffer(args.buffer_size, policy)
+    capture = CaptureThread(source, frame_buffer)
+    need_data = threading.Event()
+    need_data.set()
+    latencies = []
+
+    def consume():
+        while True:
+            need_data.wait()
+            item = frame_buffer.get(timeout=1.)
+            if item is None:
+                if frame_buffer.closed:
+                    return
+                continue
+            _, capture_time = item
+            latencies.append((time.monotonic() - capture_time) * 1000)
+            time.sleep(args.consumer_ms / 1000.) # encode/push cost
+
+    consumer = threading.Thread(target=consume, daemon=True)
+    capture.start()
+    consumer.start()
+
+    start = time.monotonic()
+    next_stall = start + args.stall_every if args.stall_every > 0 else None
+    while capture.is_alive():
+        if next_stall is not None and time.monotonic() >= next_stall:
+            need_data.clear() # enough-data
+            time.sleep(args.stall_ms / 1000.)
+            need_data.set() # need-data
+            next_stall += args.stall_every
+        time.sleep(0.01)
+    consumer.join(timeout=5)
+    return np.array(latencies), len(latencies), frame_buffer.dropped
+
+
+def main(args):
+    print('{:<8} {:>8} {:>8} {:>9} {:>9} {:>9}'.format(
+        'policy', 'frames', 'dropped', 'p50 ms', 'p90 ms', 'max ms'))
+    for policy in ('latest', 'queue'):
+        latencies, frames, dropped = run_policy(policy, args)
+        if frames == 0:
+            print('{:<8} no frames consumed'.format(policy))
+            continue
+        p50, p90 = np.percentile(latencies, [50, 90])
+        print('{:<8} {:>8} {:>8} {:>9.1f} {:>9.1f} {:>9.1f}'.format(
+            policy, frames, dropped, p50, p90, latencies.max()))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--seconds', type=float, default=10, help="Length of each run")
+    parser.add_argument('--fps', type=int, default=30, help="Synthetic camera frame rate")
+    parser.add_argument('--width', type=int, default=1920, help="Frame width")
+    parser.add_argument('--height', type=int, default=1080, help="Frame height")
+    parser.add_argument('--buffer-size', type=int, default=2, help="Ring buffer size")
+    parser.add_argument('--consumer-ms', type=float, default=20,
+                        help="Simulated per-frame push/encode time")
+    parser.add_argument('--stall-every', type=float, default=2,
+                        help="Seconds between simulated enough-data stalls (0 to disable)")
+    parser.add_argument('--stall-ms', type=float, default=300,
+                        help="Length of each enough-data stall")
+
+    args = parser.parse_args()
+    main(args)
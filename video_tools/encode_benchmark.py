@@ -0,0 +1,68 @@
+"""
+CPU H.264 encode throughput for common resolutions, using the same encoder
+settings as rtsp-server-live.py (see encoding.py).  Each run encodes
+--frames frames from videotestsrc as fast as possible into a fakesink.
+
+Usage example:
+python3 encode_benchmark.py --frames 300 --resolutions 640x360,1280x720,1920x1080
+"""
+import argparse
+import os
+import time
+
+import gi
+
+gi.require_version('Gst', '1.0')
+
+from gi.repository import Gst
+
+from encoding import h264_encoder_description, pick_h264_encoder
+
+
+def encode(width, height, args):
+    """Encode args.frames frames, returns (wall seconds, cpu seconds)"""
+    pipeline = Gst.parse_launch(
+        'videotestsrc num-buffers={} pattern={} ! video/x-raw,width={},height={},framerate={}/1 ! '
+        '{} ! fakesink sync=false'.format(
+            args.frames, args.pattern, width, height, args.fps,
+            h264_encoder_description(args.encoder, args.bitrate, args.gop, args.speed_preset)))
+    cpu0, t0 = sum(os.times()[:2]), time.perf_counter()
+    pipeline.set_state(Gst.State.PLAYING)
+    msg = pipeline.get_bus().timed_pop_filtered(Gst.CLOCK_TIME_NONE,
+                                                Gst.MessageType.EOS | Gst.MessageType.ERROR)
+    wall, cpu = time.perf_counter() - t0, sum(os.times()[:2]) - cpu0
+    pipeline.set_state(Gst.State.NULL)
+    if msg.type == Gst.MessageType.ERROR:
+        err, debug = msg.parse_error()
+        raise RuntimeError('{}x{}: {} {}'.format(width, height, err, debug))
+    return wall, cpu
+
+
+def main(args):
+    print('Encoder: {} (bitrate {} kbit/s, gop {}, preset {})'.format(
+        pick_h264_encoder(args.encoder), args.bitrate, args.gop, args.speed_preset))
+    print('{:<12} {:>10} {:>10} {:>10}'.format('resolution', 'enc fps', 'realtime', 'cpu cores'))
+    for resolution in args.resolutions.split(','):
+        width, height = [int(v) for v in resolution.split('x')]
+        wall, cpu = encode(width, height, args)
+        fps = args.frames / wall
+        print('{:<12} {:>10.1f} {:>9.2f}x {:>10.2f}'.format(resolution, fps, fps / args.fps, cpu / wall))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--resolutions', type=str, default='640x360,1280x720,1920x1080,3840x2160',
+                        help="Comma separated WIDTHxHEIGHT list")
+    parser.add_argument('--frames', type=int, default=300, help="Frames encoded per resolution")
+    parser.add_argument('--fps', type=int, default=30, help="Nominal stream frame rate")
+    parser.add_argument('--pattern', type=str, default='smpte', help="videotestsrc pattern")
+    parser.add_argument('--encoder', type=str, default='auto',
+                        help="H.264 encoder element (auto picks x264enc, then openh264enc)")
+    parser.add_argument('--bitrate', type=int, default=4000, help="Encoder bitrate in kbit/s")
+    parser.add_argument('--gop', type=int, default=60, help="Maximum frames between key frames")
+    parser.add_argument('--speed-preset', type=str, default='ultrafast',
+                        help="x264enc speed-preset, e.g. ultrafast, veryfast, medium")
+
+    args = parser.parse_args()
+    Gst.init(None)
+    main(args)
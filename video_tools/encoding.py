@@ -0,0 +1,42 @@
+"""
+H.264 software encoder selection shared by the RTSP scripts.  Uses x264enc
+when installed (gst-plugins-ugly) and falls back to openh264enc
+(gst-plugins-bad), so no particular GPU or hardware encoder is required.
+"""
+import gi
+
+gi.require_version('Gst', '1.0')
+
+from gi.repository import Gst
+
+# Preference order of software H.264 encoders
+H264_ENCODERS = ['x264enc', 'openh264enc']
+
+# x264enc speed presets considered "fast" when mapping to openh264enc complexity
+FAST_PRESETS = ('ultrafast', 'superfast', 'veryfast', 'faster', 'fast')
+
+
+def pick_h264_encoder(preferred='auto'):
+    """Name of the encoder element to use, checking it is installed"""
+    candidates = H264_ENCODERS if preferred == 'auto' else [preferred]
+    for name in candidates:
+        if Gst.ElementFactory.find(name) is not None:
+            return name
+    raise RuntimeError('No H.264 encoder found (tried {}), install gstreamer1.0-plugins-ugly '
+                       'or gstreamer1.0-plugins-bad'.format(', '.join(candidates)))
+
+
+def h264_encoder_description(encoder='auto', bitrate=4000, gop=60, speed_preset='ultrafast'):
+    """gst-launch description converting raw video to low-latency H.264
+
+    bitrate is in kbit/s, gop is the maximum number of frames between key frames.
+    """
+    name = pick_h264_encoder(encoder)
+    if name == 'x264enc':
+        enc = 'x264enc tune=zerolatency bitrate={} key-int-max={} speed-preset={}'.format(
+            bitrate, gop, speed_preset)
+    else:
+        complexity = 'low' if speed_preset in FAST_PRESETS else 'medium'
+        enc = 'openh264enc bitrate={} gop-size={} complexity={}'.format(
+            bitrate * 1000, gop, complexity)
+    return 'videoconvert ! video/x-raw,format=I420 ! {}'.format(enc)
@@ -0,0 +1,122 @@
+"""
+Capture-side building blocks for the live RTSP server: a capture thread that
+decodes frames into a small ring buffer, so slow capture never stalls the
+GStreamer callbacks, and a synthetic frame source for running without a camera.
+
+Buffer policies:
+- latest: keep only the newest frames, older ones are dropped (lowest latency)
+- queue: bounded FIFO, the capture thread waits for space (no drops after capture)
+"""
+import collections
+import threading
+import time
+
+import numpy as np
+
+
+class FrameRingBuffer:
+    """Thread-safe bounded frame buffer of (frame, capture_time) items"""
+
+    def __init__(self, size=2, policy='latest'):
+        if policy not in ('latest', 'queue'):
+            raise ValueError('policy must be latest or queue')
+        self.size = size
+        self.policy = policy
+        self.items = collections.deque()
+        self.cond = threading.Condition()
+        self.dropped = 0
+        self.closed = False
+
+    def put(self, frame, capture_time, timeout=None):
+        """Add a frame, returns False if it was not stored"""
+        with self.cond:
+            if self.policy == 'latest':
+                while len(self.items) >= self.size:
+                    self.items.popleft()
+                    self.dropped += 1
+            elif not self.cond.wait_for(lambda: len(self.items) < self.size or self.closed,
+                                        timeout):
+                self.dropped += 1
+                return False
+            if self.closed:
+                return False
+            self.items.append((frame, capture_time))
+            self.cond.notify_all()
+            return True
+
+    def get(self, timeout=None):
+        """Oldest buffered (frame, capture_time), or None on timeout/close"""
+        with self.cond:
+            if not self.cond.wait_for(lambda: self.items or self.closed, timeout):
+                return None
+            if not self.items:
+                return None
+            item = self.items.popleft()
+            self.cond.notify_all()
+            return item
+
+    def close(self):
+        """Wake up any waiting producer/consumer"""
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
+
+
+class CaptureThread(threading.Thread):
+    """Reads frames from a cv2.VideoCapture-like source into a FrameRingBuffer"""
+
+    def __init__(self, source, frame_buffer):
+        super(CaptureThread, self).__init__(daemon=True)
+        self.source = source
+        self.frame_buffer = frame_buffer
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.is_set() and self.source.isOpened():
+            ret, frame = self.source.read()
+            if not ret:
+                break
+            self.frame_buffer.put(frame, time.monotonic())
+        self.frame_buffer.close()
+
+    def stop(self):
+        self.stopped.set()
+        self.frame_buffer.close()
+
+
+class SyntheticSource:
+    """cv2.VideoCapture stand-in producing paced frames with a moving bar,
+    for testing the live server without a camera"""
+
+    def __init__(self, width=1920, height=1080, fps=30, num_frames=None):
+        self.width = width
+        self.height = height
+        self.fps = fps
+        self.num_frames = num_frames
+        self.count = 0
+        self.next_time = time.monotonic()
+
+    def isOpened(self):
+        return self.num_frames is None or self.count < self.num_frames
+
+    def read(self):
+        if not self.isOpened():
+            return False, None
+        # Pace like a camera would
+        delay = self.next_time - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        self.next_time = max(self.next_time, time.monotonic() - 1. / self.fps) + 1. / self.fps
+
+        frame = np.zeros((self.height, self.width, 3), dtype=np.uint8)
+        x = (self.count * 8) % self.width
+        frame[:, x:x + 16] = 255
+        self.count += 1
+        return True, frame
+
+    def get(self, prop_id):
+        # cv2.CAP_PROP_FRAME_WIDTH, CAP_PROP_FRAME_HEIGHT, CAP_PROP_FPS
+        return {3: self.width, 4: self.height, 5: self.fps}.get(prop_id, 0)
+
+    def release(self):
+        self.num_frames = self.count
@@ -3,52 +3,134 @@ Creates an RTSP endpoint from a live stream (e.g. webcam)
 at rtsp://127.0.0.1:8554/stream2 using GStreamer Python 
 API and OpenCV.
 Based on https://github.com/Azure-Samples/azure-intelligent-edge-patterns/tree/master/factory-ai-vision/rtsp-generator
+
+Frames are copied once, straight from the OpenCV array into buffers from a
+GstBufferPool (writable buffer mapping needs gst-python >= 1.20; older
+bindings fall back to Gst.Buffer.new_wrapped).  Pushed fps, bitrate and
+copied bytes per second are printed every --stats-interval seconds.
+
+Capture runs on its own thread into a small ring buffer (see frame_capture.py)
+and a push thread feeds appsrc only between its need-data and enough-data
+signals, so the GStreamer callbacks return immediately.  Use --video synthetic
+to serve generated frames without a camera.
+
+appsrc carries raw BGR video with the width, height and fps reported by
+cv2.VideoCapture; it is converted and encoded to H.264 (x264enc with
+tune=zerolatency, or openh264enc when x264 is not installed) before payloading.
 """
 import argparse
+import fractions
+import threading
+
 import cv2
 import gi
+import numpy as np
 
 gi.require_version('Gst', '1.0')
 gi.require_version('GstRtspServer', '1.0')
 
 from gi.repository import Gst, GstRtspServer, GObject, GLib
 
+from encoding import h264_encoder_description
+from frame_capture import CaptureThread, FrameRingBuffer, SyntheticSource
+from stream_metrics import StreamMetrics
+
 
 class SensorFactory(GstRtspServer.RTSPMediaFactory):
-    def __init__(self, video_device, **properties):
+    def __init__(self, video_device, buffer_size=2, policy='latest', encoder='auto',
+                 bitrate=4000, gop=60, speed_preset='ultrafast', **properties):
         super(SensorFactory, self).__init__(**properties)
         if video_device.isdigit():
             video_device = int(video_device)
-        self.cap = cv2.VideoCapture(video_device)
+        # Converted device, reopened as is when a session restarts the capture
+        self.video_device = video_device
+        if video_device == 'synthetic':
+            self.cap = SyntheticSource()
+        else:
+            self.cap = cv2.VideoCapture(video_device)
+        self.buffer_size = buffer_size
+        self.policy = policy
+        self.frame_buffer = None
+        self.capture = None
+        self.pusher = None
+        self.need_data = threading.Event()
+        self.appsrc = None
+        self.reported_drops = 0
         self.number_frames = 0
-        self.fps = 30
+        self.width = int(self.cap.get(cv2.CAP_PROP_FRAME_WIDTH)) or 1920
+        self.height = int(self.cap.get(cv2.CAP_PROP_FRAME_HEIGHT)) or 1080
+        self.fps = self.cap.get(cv2.CAP_PROP_FPS) or 30
         self.duration = 1 / self.fps * Gst.SECOND  # duration of a frame in nanoseconds
-        # self.launch_string = 'appsrc name=source is-live=true block=true format=GST_FORMAT_TIME ' \
-        #                      '! rtph264pay config-interval=1 name=pay0 pt=96'
+        self.pool = None
+        self.metrics = StreamMetrics(str(video_device))
+        framerate = fractions.Fraction(self.fps).limit_denominator(1001)
         self.launch_string = """
-                                appsrc name=source is-live=true block=true format=GST_FORMAT_TIME ! queue max-size-buffers=1 ! 
-                                video/x-h264,width=1920,height=1080,framerate={} ! rtph264pay config-interval=1 pt=99 name=pay0 
-                             """.format(self.fps)
+                                appsrc name=source is-live=true block=true format=GST_FORMAT_TIME
+                                caps=video/x-raw,format=BGR,width={},height={},framerate={}/{} ! queue max-size-buffers=1 !
+                                {} ! rtph264pay config-interval=1 pt=99 name=pay0
+                             """.format(self.width, self.height, framerate.numerator, framerate.denominator,
+                                        h264_encoder_description(encoder, bitrate, gop, speed_preset))
+
+    def create_pool(self, size):
+        """Buffer pool of frame-sized buffers, reused across pushes"""
+        pool = Gst.BufferPool.new()
+        config = pool.get_config()
+        Gst.BufferPool.config_set_params(config, None, size, 2, 0)
+        pool.set_config(config)
+        pool.set_active(True)
+        return pool
+
+    def frame_to_buffer(self, frame):
+        """Copy a frame into a pooled buffer, returns (buffer, bytes copied)"""
+        frame = np.ascontiguousarray(frame)
+        if self.pool is None:
+            self.pool = self.create_pool(frame.nbytes)
+        ret, buf = self.pool.acquire_buffer(None)
+        if ret == Gst.FlowReturn.OK:
+            info = buf.map(Gst.MapFlags.WRITE)
+            if isinstance(info, tuple):
+                # Bindings before gst-python 1.20 return (success, info)
+                _, info = info
+            try:
+                if isinstance(info.data, memoryview) and not info.data.readonly:
+                    np.copyto(np.ndarray(frame.shape, dtype=frame.dtype, buffer=info.data), frame)
+                    return buf, frame.nbytes
+            finally:
+                buf.unmap(info)
+        # Bindings without writable mappings: tobytes() plus the copy made by new_wrapped
+        return Gst.Buffer.new_wrapped(frame.tobytes()), 2 * frame.nbytes
+
+    def push_loop(self, capture, frame_buffer):
+        """Push buffered frames to appsrc while it is asking for data"""
+        while not capture.stopped.is_set():
+            if not self.need_data.wait(timeout=0.5):
+                continue
+            item = frame_buffer.get(timeout=0.5)
+            if item is None:
+                if frame_buffer.closed:
+                    break
+                continue
+            frame, _ = item
+            buf, copied = self.frame_to_buffer(frame)
+            buf.duration = self.duration
+            timestamp = self.number_frames * self.duration
+            buf.pts = buf.dts = int(timestamp)
+            buf.offset = timestamp
+            self.number_frames += 1
+            retval = self.appsrc.emit('push-buffer', buf)
+            self.metrics.add(frame.nbytes, copied)
+            dropped = frame_buffer.dropped
+            if dropped > self.reported_drops:
+                self.metrics.drop(dropped - self.reported_drops)
+                self.reported_drops = dropped
+            if retval != Gst.FlowReturn.OK:
+                print(retval)
 
     def on_need_data(self, src, length):
-        if self.cap.isOpened():
-            while True:
-                ret, frame = self.cap.read()
-                if ret:
-                    data = frame.tobytes()
-                    buf = Gst.Buffer.new_allocate(None, len(data), None)
-                    buf.fill(0, data)
-                    buf.duration = self.duration
-                    timestamp = self.number_frames * self.duration
-                    buf.pts = buf.dts = int(timestamp)
-                    buf.offset = timestamp
-                    self.number_frames += 1
-                    retval = src.emit('push-buffer', buf)
-                    print('pushed buffer, frame {}, duration {} ns, durations {} s'.format(self.number_frames,
-                                                                                        self.duration,
-                                                                                        self.duration / Gst.SECOND))
-                    if retval != Gst.FlowReturn.OK:
-                        print(retval)
+        self.need_data.set()
+
+    def on_enough_data(self, src):
+        self.need_data.clear()
 
     def do_create_element(self, url):
         pipeline = Gst.parse_launch(self.launch_string)
@@ -57,14 +139,37 @@ class SensorFactory(GstRtspServer.RTSPMediaFactory):
 
     def do_configure(self, rtsp_media):
         self.number_frames = 0
-        appsrc = rtsp_media.get_element().get_child_by_name('source')
-        appsrc.connect('need-data', self.on_need_data)
+        self.appsrc = rtsp_media.get_element().get_child_by_name('source')
+        self.appsrc.connect('need-data', self.on_need_data)
+        self.appsrc.connect('enough-data', self.on_enough_data)
+        self.start_capture()
+
+    def start_capture(self):
+        """Start the capture and push threads, or new ones if they exited (e.g.
+        after a camera error), since a thread can only be started once"""
+        if self.capture is not None and self.capture.is_alive() and self.pusher.is_alive():
+            return
+        if self.capture is not None:
+            self.capture.stop()
+            self.pusher.join(timeout=1)
+            # Reopen a camera that failed, the synthetic source has nothing to reopen
+            if not self.cap.isOpened() and hasattr(self.cap, 'open'):
+                self.cap.open(self.video_device)
+        self.frame_buffer = FrameRingBuffer(self.buffer_size, self.policy)
+        self.reported_drops = 0
+        self.capture = CaptureThread(self.cap, self.frame_buffer)
+        self.pusher = threading.Thread(target=self.push_loop, args=(self.capture, self.frame_buffer),
+                                       daemon=True)
+        self.capture.start()
+        self.pusher.start()
 
 
 class GstServer(GstRtspServer.RTSPServer):
-    def __init__(self, video_device, **properties):
+    def __init__(self, video_device, buffer_size=2, policy='latest', encoder='auto',
+                 bitrate=4000, gop=60, speed_preset='ultrafast', **properties):
         super(GstServer, self).__init__(**properties)
-        self.factory = SensorFactory(video_device)
+        self.factory = SensorFactory(video_device, buffer_size, policy, encoder,
+                                     bitrate, gop, speed_preset)
         self.factory.set_shared(True)
         self.get_mount_points().add_factory("/stream2", self.factory)
         self.attach(None)
@@ -74,15 +179,30 @@ if __name__ == "__main__":
 
     parser = argparse.ArgumentParser()
     parser.add_argument('--video', type=str, default="0",
-                        help="Video device for live stream")
+                        help="Video device for live stream ('synthetic' for generated frames)")
+    parser.add_argument('--buffer-size', type=int, default=2,
+                        help="Frames held between the capture thread and appsrc")
+    parser.add_argument('--policy', type=str, default='latest', choices=['latest', 'queue'],
+                        help="latest: drop old frames when full, queue: capture waits for space")
+    parser.add_argument('--encoder', type=str, default='auto',
+                        help="H.264 encoder element (auto picks x264enc, then openh264enc)")
+    parser.add_argument('--bitrate', type=int, default=4000, help="Encoder bitrate in kbit/s")
+    parser.add_argument('--gop', type=int, default=60, help="Maximum frames between key frames")
+    parser.add_argument('--speed-preset', type=str, default='ultrafast',
+                        help="x264enc speed-preset, e.g. ultrafast, veryfast, medium")
+    parser.add_argument('--stats-interval', type=int, default=10,
+                        help="Seconds between throughput reports (0 to disable)")
 
     args = parser.parse_args()
 
     GObject.threads_init()
     Gst.init(None)
 
-    server = GstServer(args.video)
+    server = GstServer(args.video, args.buffer_size, args.policy, args.encoder,
+                       args.bitrate, args.gop, args.speed_preset)
     print("Running as - rtsp://127.0.0.1:8554/stream2")
+    if args.stats_interval > 0:
+        GLib.timeout_add_seconds(args.stats_interval, server.factory.metrics.report)
 
     loop = GLib.MainLoop()
     loop.run()
\ No newline at end of file
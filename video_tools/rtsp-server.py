@@ -3,9 +3,29 @@ Creates an RTSP endpoint at rtsp://127.0.0.1:8554/stream1
 using GStreamer Python API.
 Based on https://stackoverflow.com/questions/59858898/how-to-convert-a-video-on-disk-to-a-rtsp-stream
 Only video, not audio.
+
+With --manifest, mounts many simulated cameras at once, each at its own
+path, from a JSON manifest of files, devices and test patterns, e.g.:
+
+{"streams": [
+    {"path": "/cam", "type": "file", "location": "video.h264", "replicas": 20},
+    {"path": "/lobby", "type": "test", "pattern": "ball", "width": 1280, "height": 720, "fps": 30},
+    {"path": "/webcam", "type": "device", "location": "/dev/video0"}
+]}
+
+File sources (MP4/MOV/MKV containers or raw .h264/.h265 streams) are
+demuxed and parsed but never transcoded, and loop seamlessly with timestamps
+fixed up across the loop.  All mounts that reference the same file share a
+single filesrc/demux/parse branch whose buffers are fanned out by reference
+to each mount's appsrc, so extra simulated cameras cost almost no CPU.
+Stream count and per-stream fps/bitrate are printed every --stats-interval
+seconds.
 """
 import sys
 import argparse
+import json
+import os
+import threading
 
 import gi
 
@@ -14,47 +34,269 @@ gi.require_version('GstRtspServer', '1.0')
 
 from gi.repository import Gst, GstRtspServer, GObject, GLib
 
+from encoding import h264_encoder_description
+from stream_metrics import StreamMetrics
+
+
+# Demuxer per container extension, None for elementary streams
+DEMUXERS = {
+    '.mp4': 'qtdemux', '.mov': 'qtdemux', '.m4v': 'qtdemux',
+    '.mkv': 'matroskademux', '.webm': 'matroskademux',
+    '.h264': None, '.264': None, '.h265': None, '.265': None, '.hevc': None,
+}
+
+
+def file_codec(video_file):
+    """h265 for .h265/.265/.hevc files, otherwise h264 (override with "codec" in the manifest)"""
+    return 'h265' if os.path.splitext(video_file)[1].lower() in ('.h265', '.265', '.hevc') else 'h264'
+
+
+class SharedFileSource():
+    """One demux/parse branch per file that fans its access units out to every
+    registered appsrc (buffers are shared, not copied).  The compressed stream
+    is passed through without transcoding and loops seamlessly: non-flushing
+    segment seeks when the demuxer supports them, otherwise a seek at EOS with
+    the timestamp offset carried over so each consumer sees monotonic time."""
+
+    def __init__(self, video_file, codec=None):
+        self.video_file = video_file
+        self.codec = codec or file_codec(video_file)
+        self.appsrcs = {} # appsrc -> timestamp offset, set on its first buffer
+        self.lock = threading.Lock()
+        self.caps = None
+        self.loop_offset = 0
+        self.last_end = 0
+        self.segment_looping = False
+
+        ext = os.path.splitext(video_file)[1].lower()
+        demux = DEMUXERS.get(ext, 'parsebin' if ext else None)
+        # Link the demuxer's video pad by name: its pads appear late and an
+        # unnamed link could take an audio track.  parsebin pads are src_%u,
+        # so there the link is filtered by the video caps instead.
+        if demux == 'parsebin':
+            demux_link = 'parsebin name=demux demux. ! video/x-{} ! queue ! '.format(self.codec)
+        elif demux:
+            demux_link = '{} name=demux demux.video_0 ! queue ! '.format(demux)
+        else:
+            demux_link = ''
+        self.pipeline = Gst.parse_launch(
+            'filesrc location="{}" ! {}{}parse ! '
+            'video/x-{},stream-format=byte-stream,alignment=au ! '
+            'appsink name=sink emit-signals=true sync=true max-buffers=2'.format(
+                video_file, demux_link, self.codec, self.codec))
+        self.pipeline.get_by_name('sink').connect('new-sample', self.on_new_sample)
+        bus = self.pipeline.get_bus()
+        bus.add_signal_watch()
+        bus.connect('message', self.on_message)
+        self.started = False
+
+    def start(self):
+        self.started = True
+        self.pipeline.set_state(Gst.State.PAUSED)
+        self.pipeline.get_state(5 * Gst.SECOND)
+        # A segment seek makes the demuxer post SEGMENT_DONE instead of EOS
+        self.segment_looping = self.pipeline.seek_simple(
+            Gst.Format.TIME, Gst.SeekFlags.FLUSH | Gst.SeekFlags.SEGMENT, 0)
+        self.pipeline.set_state(Gst.State.PLAYING)
+
+    def add(self, appsrc):
+        with self.lock:
+            self.appsrcs[appsrc] = None
+            if self.caps is not None:
+                appsrc.set_caps(self.caps)
+        if not self.started:
+            self.start()
+
+    def remove(self, appsrc):
+        with self.lock:
+            self.appsrcs.pop(appsrc, None)
+
+    def on_new_sample(self, sink):
+        sample = sink.emit('pull-sample')
+        buf = sample.get_buffer()
+        segment = sample.get_segment()
+        # Running time keeps increasing across segment loops; loop_offset covers EOS loops
+        pts = self.to_stream_time(segment, buf.pts)
+        dts = self.to_stream_time(segment, buf.dts)
+        ref = dts if dts is not None else pts
+        if ref is not None:
+            self.last_end = ref + (buf.duration if buf.duration != Gst.CLOCK_TIME_NONE else 0)
+
+        with self.lock:
+            if self.caps is None:
+                self.caps = sample.get_caps()
+                for appsrc in self.appsrcs:
+                    appsrc.set_caps(self.caps)
+            for appsrc, offset in self.appsrcs.items():
+                if offset is None:
+                    # Start each consumer on a key frame at its own current running time
+                    running_time = appsrc.get_current_running_time()
+                    if (ref is None or running_time == Gst.CLOCK_TIME_NONE
+                            or buf.has_flags(Gst.BufferFlags.DELTA_UNIT)):
+                        continue
+                    offset = self.appsrcs[appsrc] = running_time - ref
+                # Shallow copy: new metadata, same memory
+                out = buf.copy()
+                out.pts = pts + offset if pts is not None else Gst.CLOCK_TIME_NONE
+                out.dts = dts + offset if dts is not None else Gst.CLOCK_TIME_NONE
+                appsrc.emit('push-buffer', out)
+        return Gst.FlowReturn.OK
+
+    def to_stream_time(self, segment, timestamp):
+        """Running time plus the loop offset, None when unknown or negative
+        (a B-frame DTS before the segment start at the beginning of the file)"""
+        if timestamp == Gst.CLOCK_TIME_NONE:
+            return None
+        sign, running_time = segment.to_running_time_full(Gst.Format.TIME, timestamp)
+        if sign == 0:
+            return None
+        stream_time = self.loop_offset + (running_time if sign > 0 else -running_time)
+        return stream_time if stream_time >= 0 else None
+
+    def restart(self):
+        # Flushing seek restarts running time at 0, continue after the last buffer
+        self.loop_offset = self.last_end
+        self.pipeline.seek_simple(Gst.Format.TIME,
+                                  Gst.SeekFlags.FLUSH | Gst.SeekFlags.KEY_UNIT, 0)
+
+    def on_message(self, bus, message):
+        if message.type == Gst.MessageType.SEGMENT_DONE and self.segment_looping:
+            # Seamless loop, no flush; fall back to restarting at EOS if the demuxer refuses
+            self.segment_looping = self.pipeline.seek_simple(Gst.Format.TIME, Gst.SeekFlags.SEGMENT, 0)
+            if not self.segment_looping:
+                self.restart()
+        elif message.type in (Gst.MessageType.SEGMENT_DONE, Gst.MessageType.EOS):
+            self.restart()
+        elif message.type == Gst.MessageType.ERROR:
+            err, debug = message.parse_error()
+            print('Error in {}: {} {}'.format(self.video_file, err, debug))
+
 
 class TestRtspMediaFactory(GstRtspServer.RTSPMediaFactory):
-    def __init__(self, video_file):
+    """Mount fed from a SharedFileSource"""
+
+    def __init__(self, source):
         GstRtspServer.RTSPMediaFactory.__init__(self)
-        self.video_file = video_file
+        self.source = source
 
     def do_create_element(self, url):
-        # Set video file path to filesrc's location property
-        src = "filesrc location={}".format(self.video_file)
-        demux =  "qtdemux name=demux"
-        h264_transcode = "demux.video_0"
-        ## Uncomment following line if video transcoding is necessary
-        # h264_transcode = "demux.video_0 ! decodebin ! queue ! x264enc"
-        #pipeline = "{0} ! {1} {2} ! queue ! rtph264pay name=pay0 config-interval=1 pt=96".format(src, demux, h264_transcode)
-        pipeline = "{0} ! rtph264pay name=pay0 config-interval=1 pt=96".format(src)
+        pipeline = ("appsrc name=source is-live=true format=time ! "
+                    "rtp{}pay name=pay0 config-interval=1 pt=96".format(self.source.codec))
         print ("Element created: " + pipeline)
         return Gst.parse_launch(pipeline)
 
+    def do_configure(self, rtsp_media):
+        appsrc = rtsp_media.get_element().get_child_by_name('source')
+        self.source.add(appsrc)
+        rtsp_media.connect('unprepared', lambda media: self.source.remove(appsrc))
+
+
+def launch_factory(launch):
+    """Factory for a self-contained gst-launch description"""
+    factory = GstRtspServer.RTSPMediaFactory()
+    factory.set_launch('( {} ! rtph264pay name=pay0 config-interval=1 pt=96 )'.format(launch))
+    return factory
+
+
+def count_payloader_input(factory, metrics):
+    """Count encoded buffers entering pay0 of every media of a factory"""
+    def on_buffer(pad, info):
+        metrics.add(info.get_buffer().get_size())
+        return Gst.PadProbeReturn.OK
+
+    def on_media_configure(factory, media):
+        pay = media.get_element().get_child_by_name('pay0')
+        pay.get_static_pad('sink').add_probe(Gst.PadProbeType.BUFFER, on_buffer)
+
+    factory.connect('media-configure', on_media_configure)
+
+
 class GstreamerRtspServer():
     def __init__(self, args):
         self.rtspServer = GstRtspServer.RTSPServer()
-        factory = TestRtspMediaFactory(args.video)
-        factory.set_shared(True)
+        self.rtspServer.set_service(str(args.port))
+        self.file_sources = {}
+        self.metrics = []
         mountPoints = self.rtspServer.get_mount_points()
-        mountPoints.add_factory("/stream1", factory)
+        for stream in load_streams(args):
+            factory = self.create_factory(stream, args)
+            factory.set_shared(True)
+            metrics = StreamMetrics(stream['path'])
+            count_payloader_input(factory, metrics)
+            self.metrics.append(metrics)
+            mountPoints.add_factory(stream['path'], factory)
+            print("Running as - rtsp://127.0.0.1:{}{}".format(args.port, stream['path']))
         self.rtspServer.attach(None)
+        print('{} streams mounted, {} shared file branches'.format(
+            len(self.metrics), len(self.file_sources)))
+
+    def create_factory(self, stream, args):
+        kind = stream.get('type', 'file')
+        if kind == 'file':
+            location = stream['location']
+            if location not in self.file_sources:
+                self.file_sources[location] = SharedFileSource(location, stream.get('codec'))
+            return TestRtspMediaFactory(self.file_sources[location])
+
+        encode = h264_encoder_description(args.encoder, stream.get('bitrate', args.bitrate),
+                                          stream.get('gop', args.gop), args.speed_preset)
+        if kind == 'test':
+            return launch_factory(
+                'videotestsrc is-live=true pattern={} ! video/x-raw,width={},height={},framerate={}/1 ! {}'.format(
+                    stream.get('pattern', 'smpte'), stream.get('width', 1280),
+                    stream.get('height', 720), stream.get('fps', 30), encode))
+        if kind == 'device':
+            return launch_factory('v4l2src device={} ! {}'.format(stream['location'], encode))
+        raise ValueError('Unknown stream type {} for {}'.format(kind, stream['path']))
+
+    def report(self):
+        for metrics in self.metrics:
+            metrics.report()
+        return True
+
+
+def load_streams(args):
+    """Stream entries from --manifest (expanding replicas) or the single --video"""
+    if not args.manifest:
+        return [{'path': '/stream1', 'type': 'file', 'location': args.video}]
+    with open(args.manifest) as f:
+        entries = json.load(f)['streams']
+    streams = []
+    for entry in entries:
+        replicas = entry.get('replicas', 1)
+        for i in range(replicas):
+            stream = dict(entry)
+            if replicas > 1:
+                stream['path'] = '{}{}'.format(entry['path'], i + 1)
+            streams.append(stream)
+    return streams
+
 
 if __name__ == '__main__':
 
     parser = argparse.ArgumentParser()
     parser.add_argument('--video', type=str, help="Video media file")
+    parser.add_argument('--manifest', type=str, default=None,
+                        help="JSON manifest of streams to mount (instead of --video)")
+    parser.add_argument('--port', type=int, default=8554, help="RTSP port")
+    parser.add_argument('--stats-interval', type=int, default=10,
+                        help="Seconds between per-stream reports (0 to disable)")
+    parser.add_argument('--encoder', type=str, default='auto',
+                        help="H.264 encoder for test/device streams")
+    parser.add_argument('--bitrate', type=int, default=2000,
+                        help="Default bitrate in kbit/s for test/device streams")
+    parser.add_argument('--gop', type=int, default=60, help="Maximum frames between key frames")
+    parser.add_argument('--speed-preset', type=str, default='ultrafast',
+                        help="x264enc speed-preset for test/device streams")
 
     args = parser.parse_args()
+    if not args.video and not args.manifest:
+        parser.error('one of --video or --manifest is required')
 
     Gst.init(None)
     s = GstreamerRtspServer(args)
-
-    print("Running as - rtsp://127.0.0.1:8554/stream1")
+    if args.stats_interval > 0:
+        GLib.timeout_add_seconds(args.stats_interval, s.report)
 
     loop = GLib.MainLoop()
     loop.run()
-
-
-
@@ -0,0 +1,211 @@
+"""
+RTSP load generator and latency benchmark.  Opens N concurrent RTSP
+sessions, depacketizes (and optionally decodes) each stream and reports
+per-stream fps, inter-frame jitter and first-frame latency, plus server CPU.
+
+Without --url it starts rtsp-server.py on localhost with a synthetic
+videotestsrc manifest, so it runs in CI without cameras or video files:
+
+python3 rtsp_benchmark.py --streams 16 --duration 20
+python3 rtsp_benchmark.py --streams 16 --distinct-mounts --decode
+python3 rtsp_benchmark.py --url rtsp://127.0.0.1:8554/stream1 --streams 8 --server-pid 1234
+"""
+import argparse
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import gi
+
+gi.require_version('Gst', '1.0')
+
+from gi.repository import Gst, GLib
+import numpy as np
+
+
+class StreamClient():
+    """One RTSP session whose frame arrival times are recorded at the sink"""
+
+    def __init__(self, url, decode):
+        decoder = ' ! avdec_h264' if decode else ''
+        self.url = url
+        self.pipeline = Gst.parse_launch(
+            'rtspsrc location={} latency=0 ! rtph264depay ! h264parse{} ! '
+            'fakesink name=sink sync=false'.format(url, decoder))
+        sink_pad = self.pipeline.get_by_name('sink').get_static_pad('sink')
+        sink_pad.add_probe(Gst.PadProbeType.BUFFER, self.on_buffer)
+        bus = self.pipeline.get_bus()
+        bus.add_signal_watch()
+        bus.connect('message::error', self.on_error)
+        self.arrivals = []
+        self.error = None
+        self.start_time = None
+
+    def start(self):
+        self.start_time = time.monotonic()
+        self.pipeline.set_state(Gst.State.PLAYING)
+
+    def stop(self):
+        self.pipeline.set_state(Gst.State.NULL)
+
+    def on_buffer(self, pad, info):
+        self.arrivals.append(time.monotonic())
+        return Gst.PadProbeReturn.OK
+
+    def on_error(self, bus, message):
+        err, debug = message.parse_error()
+        self.error = str(err)
+
+    def stats(self):
+        if len(self.arrivals) < 2:
+            return {'url': self.url, 'frames': len(self.arrivals), 'error': self.error}
+        arrivals = np.array(self.arrivals)
+        deltas = np.diff(arrivals) * 1000
+        return {
+            'url': self.url,
+            'frames': len(arrivals),
+            'fps': (len(arrivals) - 1) / (arrivals[-1] - arrivals[0]),
+            'jitter_ms': float(deltas.std()),
+            'first_frame_ms': (arrivals[0] - self.start_time) * 1000,
+            'error': self.error,
+        }
+
+
+def process_cpu_seconds(pid):
+    """User + system CPU seconds of a process (Linux /proc)"""
+    with open('/proc/{}/stat'.format(pid)) as f:
+        fields = f.read().rsplit(')', 1)[1].split()
+    return (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+
+
+def wait_for_port(port, timeout=15):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=1):
+                return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError('RTSP server did not start on port {}'.format(port))
+
+
+def start_local_server(args):
+    """Run rtsp-server.py with a videotestsrc manifest, returns (process, urls, manifest file)"""
+    manifest = {'streams': [{
+        'path': '/bench', 'type': 'test', 'pattern': 'ball',
+        'width': args.width, 'height': args.height, 'fps': args.fps,
+        'replicas': args.streams if args.distinct_mounts else 1,
+    }]}
+    manifest_file = tempfile.NamedTemporaryFile('w', suffix='.json', delete=False)
+    json.dump(manifest, manifest_file)
+    manifest_file.close()
+
+    server = subprocess.Popen(
+        [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'rtsp-server.py'),
+         '--manifest', manifest_file.name, '--port', str(args.port), '--stats-interval', '0'],
+        stdout=subprocess.DEVNULL)
+    try:
+        wait_for_port(args.port)
+    except RuntimeError:
+        server.terminate()
+        os.remove(manifest_file.name)
+        raise
+    base = 'rtsp://127.0.0.1:{}/bench'.format(args.port)
+    if args.distinct_mounts:
+        urls = ['{}{}'.format(base, i + 1) for i in range(args.streams)]
+    else:
+        urls = [base] * args.streams
+    return server, urls, manifest_file.name
+
+
+def wait_for_sessions(clients, loop, timeout):
+    """Run the main loop until every client received a frame or failed, or timeout seconds"""
+    deadline = time.monotonic() + timeout
+
+    def check():
+        if time.monotonic() > deadline or all(c.arrivals or c.error for c in clients):
+            loop.quit()
+            return False
+        return True
+
+    GLib.timeout_add(100, check)
+    loop.run()
+
+
+def main(args):
+    server = manifest = None
+    server_pid = args.server_pid
+    if args.url:
+        urls = [args.url] * args.streams
+    else:
+        server, urls, manifest = start_local_server(args)
+        server_pid = server.pid
+
+    clients = [StreamClient(url, args.decode) for url in urls]
+    loop = GLib.MainLoop()
+    try:
+        for client in clients:
+            client.start()
+        # Measure server CPU only once sessions are established (first frame received)
+        wait_for_sessions(clients, loop, args.session_timeout)
+        GLib.timeout_add_seconds(args.duration, loop.quit)
+        cpu0, t0 = (process_cpu_seconds(server_pid) if server_pid else 0), time.monotonic()
+        loop.run()
+        cpu = (process_cpu_seconds(server_pid) - cpu0) / (time.monotonic() - t0) if server_pid else None
+    finally:
+        for client in clients:
+            client.stop()
+        if server is not None:
+            server.terminate()
+            server.wait()
+        if manifest is not None:
+            os.remove(manifest)
+
+    results = [client.stats() for client in clients]
+    print('{:<4} {:>7} {:>7} {:>10} {:>12}  {}'.format('#', 'frames', 'fps', 'jitter ms', 'first ms', 'url'))
+    for i, r in enumerate(results):
+        if 'fps' in r:
+            print('{:<4} {:>7} {:>7.1f} {:>10.2f} {:>12.1f}  {}'.format(
+                i, r['frames'], r['fps'], r['jitter_ms'], r['first_frame_ms'], r['url']))
+        else:
+            print('{:<4} {:>7} {:>7} {:>10} {:>12}  {} {}'.format(
+                i, r['frames'], '-', '-', '-', r['url'], r['error'] or ''))
+    fps = [r['fps'] for r in results if 'fps' in r]
+    print('{}/{} streams received frames, mean fps {:.1f}, min fps {:.1f}'.format(
+        len(fps), len(results), np.mean(fps) if fps else 0, min(fps) if fps else 0))
+    if cpu is not None:
+        print('Server CPU: {:.2f} cores'.format(cpu))
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'streams': results, 'server_cpu_cores': cpu}, f, indent=4)
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--url', type=str, default=None,
+                        help="Existing RTSP stream to load (default: start a local test server)")
+    parser.add_argument('--streams', type=int, default=8, help="Concurrent RTSP sessions")
+    parser.add_argument('--duration', type=int, default=20, help="Seconds to measure")
+    parser.add_argument('--decode', action='store_true',
+                        help="Decode frames (avdec_h264) instead of only depacketizing")
+    parser.add_argument('--distinct-mounts', action='store_true',
+                        help="Local server: one mount (and encoder) per session instead of one shared mount")
+    parser.add_argument('--server-pid', type=int, default=None,
+                        help="PID of an external server to measure CPU for (with --url)")
+    parser.add_argument('--session-timeout', type=int, dest='session_timeout', default=15,
+                        help="Seconds to wait for every session's first frame before measuring")
+    parser.add_argument('--port', type=int, default=8554, help="Local server port")
+    parser.add_argument('--width', type=int, default=1280, help="Local test stream width")
+    parser.add_argument('--height', type=int, default=720, help="Local test stream height")
+    parser.add_argument('--fps', type=int, default=30, help="Local test stream frame rate")
+    parser.add_argument('--json', type=str, default=None, help="Write results as JSON")
+
+    args = parser.parse_args()
+    Gst.init(None)
+    main(args)
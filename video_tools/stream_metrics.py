@@ -0,0 +1,56 @@
+"""
+Thread-safe frame/byte counters shared by the RTSP scripts, so throughput
+can be reported periodically instead of printing per frame.
+"""
+import threading
+import time
+
+
+class StreamMetrics:
+    """Counts pushed frames, bytes and copied bytes for one stream and
+    reports rates over the window since the previous report."""
+
+    def __init__(self, name):
+        self.name = name
+        self.lock = threading.Lock()
+        self.frames = 0
+        self.bytes = 0
+        self.copied_bytes = 0
+        self.dropped = 0
+        self.start = time.monotonic()
+        self.window = (self.start, 0, 0, 0)
+
+    def add(self, nbytes, copied_bytes=0, frames=1):
+        """Record frames pushed downstream"""
+        with self.lock:
+            self.frames += frames
+            self.bytes += nbytes
+            self.copied_bytes += copied_bytes
+
+    def drop(self, frames=1):
+        """Record frames that were discarded"""
+        with self.lock:
+            self.dropped += frames
+
+    def rates(self):
+        """Rates since the previous call, and start a new window"""
+        now = time.monotonic()
+        with self.lock:
+            t0, frames0, bytes0, copied0 = self.window
+            elapsed = max(now - t0, 1e-9)
+            rates = {
+                'fps': (self.frames - frames0) / elapsed,
+                'mbps': (self.bytes - bytes0) * 8 / elapsed / 1e6,
+                'copy_mb_per_s': (self.copied_bytes - copied0) / elapsed / 1e6,
+                'frames': self.frames,
+                'dropped': self.dropped,
+            }
+            self.window = (now, self.frames, self.bytes, self.copied_bytes)
+        return rates
+
+    def report(self):
+        """Print one line of rates for this stream"""
+        r = self.rates()
+        print('{}: {:.1f} fps, {:.2f} Mbit/s, {:.1f} MB/s copied, {} frames, {} dropped'.format(
+            self.name, r['fps'], r['mbps'], r['copy_mb_per_s'], r['frames'], r['dropped']))
+        return True # keep GLib.timeout_add_seconds callbacks alive